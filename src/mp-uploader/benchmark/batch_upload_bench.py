@@ -0,0 +1,111 @@
+"""Small-chunk upload throughput, one request per chunk against /upload/chunks
+
+Each request pays a simulated round trip (default 20 ms) on top of the
+in-process app, as a client on a high-latency link would.
+
+run from src/mp-uploader:
+    python -m benchmark.batch_upload_bench [rtt_ms] [batch_size]
+"""
+
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import server
+from mp_server import encode_frame, settings
+
+FILE_SIZE = 64 * 2**20
+UPLOADERS = 4
+
+
+class LatencyTransport(httpx.ASGITransport):
+    def __init__(self, rtt, **kwargs):
+        super().__init__(**kwargs)
+        self.rtt = rtt
+
+    async def handle_async_request(self, request):
+        await asyncio.sleep(self.rtt)
+        return await super().handle_async_request(request)
+
+
+async def init(client, data):
+    file_hash = hashlib.sha256(data).hexdigest()
+    response = await client.post(
+        "/upload/init",
+        params={
+            "file_size": len(data),
+            "file_hash": file_hash,
+            "chunk_size": settings.min_chunk_size,
+        },
+    )
+    chunk_size = response.json()["chunk_size"]
+    chunks = [
+        (offset, hashlib.sha256(piece).hexdigest(), piece)
+        for offset in response.json()["chunks"]
+        for piece in [data[offset : offset + chunk_size]]
+    ]
+    return file_hash, chunks
+
+
+async def upload_single(client, file_hash, chunks):
+    for offset, chunk_hash, piece in chunks:
+        await client.post(
+            "/upload/chunk/raw",
+            params={"file_hash": file_hash, "chunk_hash": chunk_hash, "offset": offset},
+            content=piece,
+        )
+
+
+async def upload_batch(client, file_hash, chunks, batch_size):
+    for i in range(0, len(chunks), batch_size):
+        body = b"".join(encode_frame(*chunk) for chunk in chunks[i : i + batch_size])
+        await client.post(
+            "/upload/chunks", params={"file_hash": file_hash}, content=body
+        )
+
+
+async def run(rtt, upload, *args):
+    transport = LatencyTransport(rtt, app=server.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=None
+    ) as client:
+        data = os.urandom(FILE_SIZE)
+        file_hash, chunks = await init(client, data)
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                upload(client, file_hash, chunks[i::UPLOADERS], *args)
+                for i in range(UPLOADERS)
+            )
+        )
+        elapsed = time.perf_counter() - start
+        status = (await client.get(f"/upload/status/{file_hash}")).json()["status"]
+    return len(chunks), elapsed, status
+
+
+async def main(rtt, batch_size):
+    print(f"{FILE_SIZE / 2**20:.0f} MiB in {settings.min_chunk_size / 2**20:.0f} MiB")
+    print(f"chunks, rtt {rtt * 1000:.0f} ms, {UPLOADERS} uploaders")
+    for name, upload, args in [
+        ("per chunk", upload_single, ()),
+        (f"batch of {batch_size}", upload_batch, (batch_size,)),
+    ]:
+        chunks, elapsed, status = await run(rtt, upload, *args)
+        print(
+            f"{name:<14}{chunks / elapsed:10,.0f} chunks/s"
+            f"{FILE_SIZE / elapsed / 2**20:10,.0f} MiB/s  {status}"
+        )
+
+
+if __name__ == "__main__":
+    rtt = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.02
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    with tempfile.TemporaryDirectory() as dir:
+        # keep benchmark uploads out of the real upload directory
+        server.__UPLOAD_DIR__ = Path(dir)
+        asyncio.run(main(rtt, batch_size))
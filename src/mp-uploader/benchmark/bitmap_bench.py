@@ -0,0 +1,101 @@
+"""Marks per second of the shared mmap bitmap against the old open-per-call bitmap
+
+run from src/mp-uploader:
+    python -m benchmark.bitmap_bench
+"""
+
+import math
+import multiprocessing
+import struct
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from mp_server import BinaryChunkMapManager
+
+CHUNK_SIZE = 1024
+TOTAL_CHUNKS = 64 * 1024
+MARKS = 20000
+
+
+class OpenPerCallChunkMap:
+    """The previous mark_chunk: open, seek, read and write one byte per call"""
+
+    def __init__(self, filename, dir):
+        self.map_file = Path(dir) / f"{filename}.bmap"
+        self.lock = threading.Lock()
+        self.header_size = struct.calcsize("QQQ")
+        self.chunk_size = CHUNK_SIZE
+
+    def mark_chunk(self, offset, complete=True):
+        chunk_index = offset // self.chunk_size
+        with self.lock:
+            with open(self.map_file, "r+b") as f:
+                byte_index = chunk_index // 8
+                bit_index = chunk_index % 8
+                f.seek(self.header_size + byte_index)
+                current_byte = ord(f.read(1))
+                if complete:
+                    updated_byte = current_byte | (1 << bit_index)
+                else:
+                    updated_byte = current_byte & ~(1 << bit_index)
+                f.seek(self.header_size + byte_index)
+                f.write(bytes([updated_byte]))
+
+
+def fresh_map(dir, name):
+    manager = BinaryChunkMapManager(name, dir)
+    manager.initialize_map(TOTAL_CHUNKS * CHUNK_SIZE, CHUNK_SIZE, reinit=True)
+    return manager
+
+
+def bench(label, make_manager, marks=MARKS):
+    manager = make_manager()
+    start = time.perf_counter()
+    for i in range(marks):
+        manager.mark_chunk((i % TOTAL_CHUNKS) * CHUNK_SIZE)
+    reused = marks / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(marks):
+        # a new manager per mark, as the server builds one per request
+        make_manager().mark_chunk((i % TOTAL_CHUNKS) * CHUNK_SIZE)
+    per_request = marks / (time.perf_counter() - start)
+    print(f"{label:<28}{reused:>14,.0f}{per_request:>14,.0f}")
+
+
+def mark_worker(dir, name, worker, workers):
+    manager = BinaryChunkMapManager(name, dir)
+    # interleaved indexes, so every byte is shared between workers
+    for i in range(worker, TOTAL_CHUNKS, workers):
+        manager.mark_chunk(i * CHUNK_SIZE)
+
+
+def check_multiprocess(dir, workers=4):
+    manager = fresh_map(dir, "shared")
+    procs = [
+        multiprocessing.Process(target=mark_worker, args=(dir, "shared", w, workers))
+        for w in range(workers)
+    ]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+    lost = len(manager.get_incomplete_chunks())
+    print(
+        f"{workers} processes x {math.ceil(TOTAL_CHUNKS / workers)} marks"
+        f"{TOTAL_CHUNKS / elapsed:>14,.0f} marks/s, lost bits: {lost}"
+    )
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as dir:
+        print(f"{'marks/s':<28}{'reused':>14}{'per request':>14}")
+        fresh_map(dir, "old")
+        bench("open per call", lambda: OpenPerCallChunkMap("old", dir))
+        fresh_map(dir, "new")
+        bench("shared mmap", lambda: BinaryChunkMapManager("new", dir))
+        check_multiprocess(dir)
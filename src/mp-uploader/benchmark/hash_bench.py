@@ -0,0 +1,47 @@
+"""MB/s of each hashlib algorithm on this machine, to pick allowed_hash_types
+
+Hashes an in-memory buffer (CPU bound) and a file on disk read in
+HASH_BUFFER_SIZE pieces (as calculate_hash does).
+
+run from src/mp-uploader:
+    python -m benchmark.hash_bench [size_mib]
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+from mp_server import calculate_hash
+from mp_server.utils import HASH_BUFFER_SIZE
+
+ALGORITHMS = ["md5", "sha1", "sha256", "sha512", "blake2b", "blake2s", "sha3_256"]
+
+
+def bench_memory(name, data):
+    start = time.perf_counter()
+    hashlib.new(name, data).hexdigest()
+    return len(data) / (time.perf_counter() - start) / 2**20
+
+
+def bench_file(name, path, size):
+    start = time.perf_counter()
+    calculate_hash(path, hash_type=name)
+    return size / (time.perf_counter() - start) / 2**20
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) * 2**20 if len(sys.argv) > 1 else 512 * 2**20
+    data = os.urandom(size)
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        print(f"{size / 2**20:.0f} MiB, read buffer {HASH_BUFFER_SIZE / 2**20:.0f} MiB")
+        print(f"{'algorithm':<12}{'memory MB/s':>14}{'file MB/s':>14}")
+        for name in ALGORITHMS:
+            if name not in hashlib.algorithms_available:
+                continue
+            memory = bench_memory(name, data)
+            file = bench_file(name, f.name, size)
+            print(f"{name:<12}{memory:>14,.0f}{file:>14,.0f}")
@@ -0,0 +1,88 @@
+"""Thread-per-chunk parallel_write_chunks against the bounded ParallelWriter
+
+The old function started a thread per chunk, and every thread reopened the
+file and wrote under one global lock. ParallelWriter shares one descriptor
+between a bounded pool and writes with os.pwrite, or os.pwritev when a chunk
+arrives as a list of network-sized buffers.
+
+run from src/mp-uploader:
+    python -m benchmark.parallel_write_bench [size_mib] [chunk_mib] [workers]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from mp_server import ParallelWriter, create_empty_file, write_chunk
+
+# piece size of a chunk received from the network, for the pwritev case
+PIECE_SIZE = 64 * 1024
+
+
+def thread_per_chunk(filename, chunks):
+    """parallel_write_chunks as it was"""
+    lock = threading.Lock()
+    threads = []
+    for position, data in chunks:
+        t = threading.Thread(target=write_chunk, args=(filename, position, data, lock))
+        threads.append(t)
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def bounded_pwrite(filename, chunks, workers):
+    with ParallelWriter(filename, max_workers=workers) as writer:
+        writer.write_all(chunks)
+
+
+def run(name, func, dir, size, chunks, *args):
+    path = os.path.join(dir, name)
+    create_empty_file(name, dir, size, preallocate="fallocate")
+    start = time.perf_counter()
+    func(path, chunks, *args)
+    written = time.perf_counter()
+    fd = os.open(path, os.O_RDONLY)
+    os.fsync(fd)
+    os.close(fd)
+    synced = time.perf_counter()
+    os.unlink(path)
+    print(
+        f"{name:<18}{size / (written - start) / 2**20:>12,.0f}"
+        f"{size / (synced - start) / 2**20:>16,.0f}"
+    )
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) * 2**20 if len(sys.argv) > 1 else 1024 * 2**20
+    chunk_size = int(sys.argv[2]) * 2**20 if len(sys.argv) > 2 else 4 * 2**20
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+    data = os.urandom(chunk_size)
+    offsets = list(range(0, size, chunk_size))
+    random.shuffle(offsets)
+    chunks = [(offset, data[: min(chunk_size, size - offset)]) for offset in offsets]
+
+    print(
+        f"{size / 2**20:.0f} MiB in {len(chunks)} chunks of"
+        f" {chunk_size / 2**20:.0f} MiB, {workers} workers"
+    )
+    print(f"{'writer':<18}{'write MiB/s':>12}{'+fsync MiB/s':>16}")
+    with tempfile.TemporaryDirectory(dir=".") as dir:
+        run("thread-per-chunk", thread_per_chunk, dir, size, chunks)
+        run("pwrite", bounded_pwrite, dir, size, chunks, workers)
+        # chunks as received, in network-sized pieces, written without joining
+        pieces = [
+            (
+                offset,
+                [
+                    memoryview(data)[i : i + PIECE_SIZE]
+                    for i in range(0, len(data), PIECE_SIZE)
+                ],
+            )
+            for offset, data in chunks
+        ]
+        run("pwritev", bounded_pwrite, dir, size, pieces, workers)
@@ -0,0 +1,94 @@
+"""Sequential read speed of completed uploads, preallocated vs sparse
+
+Creates a file in each settings.preallocate mode with create_empty_file,
+fills it with chunks written in random order with os.pwrite (as concurrent
+uploads do), then drops it from the page cache and reads it front to back.
+filefrag, when installed, reports the extents each mode ended up with.
+
+run from src/mp-uploader, with a directory on the volume to measure (tmpfs
+has no extents to fragment):
+    python -m benchmark.prealloc_read_bench [dir] [size_mib] [chunk_mib]
+"""
+
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mp_server import create_empty_file
+from mp_server.utils import HASH_BUFFER_SIZE
+
+MODES = ["sparse", "fallocate"]
+ROUNDS = 3
+
+
+def fill_out_of_order(path, size, chunk_size):
+    offsets = list(range(0, size, chunk_size))
+    random.shuffle(offsets)
+    data = os.urandom(chunk_size)
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        for offset in offsets:
+            os.pwrite(fd, data[: min(chunk_size, size - offset)], offset)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def drop_cache(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def read_speed(path, size):
+    drop_cache(path)
+    start = time.perf_counter()
+    with open(path, "rb", buffering=0) as f:
+        while f.read(HASH_BUFFER_SIZE):
+            pass
+    return size / (time.perf_counter() - start) / 2**20
+
+
+def extents(path):
+    if shutil.which("filefrag") is None:
+        return None
+    output = subprocess.run(["filefrag", path], capture_output=True, text=True).stdout
+    # "<path>: N extents found"
+    try:
+        return int(output.rsplit(":", 1)[1].split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+if __name__ == "__main__":
+    dir = sys.argv[1] if len(sys.argv) > 1 else tempfile.gettempdir()
+    size = int(sys.argv[2]) * 2**20 if len(sys.argv) > 2 else 1024 * 2**20
+    chunk_size = int(sys.argv[3]) * 2**20 if len(sys.argv) > 3 else 32 * 2**20
+
+    print(
+        f"{dir}: {size / 2**20:.0f} MiB in {chunk_size / 2**20:.0f} MiB chunks,"
+        f" written in random order"
+    )
+    print(f"{'mode':<12}{'create s':>10}{'fill s':>10}{'read MB/s':>12}{'extents':>9}")
+    for mode in MODES:
+        with tempfile.TemporaryDirectory(dir=dir) as work_dir:
+            name = f"prealloc-{mode}"
+            path = os.path.join(work_dir, name)
+            start = time.perf_counter()
+            create_empty_file(name, work_dir, size, preallocate=mode)
+            created = time.perf_counter()
+            fill_out_of_order(path, size, chunk_size)
+            filled = time.perf_counter()
+            speed = statistics.median(read_speed(path, size) for _ in range(ROUNDS))
+            count = extents(path)
+            print(
+                f"{mode:<12}{created - start:>10.2f}{filled - created:>10.2f}"
+                f"{speed:>12,.0f}{count if count is not None else '-':>9}"
+            )
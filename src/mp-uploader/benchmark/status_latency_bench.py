@@ -0,0 +1,100 @@
+"""p99 latency of /upload/status while large chunks are being written
+
+Chunks are posted to the app in-process with several uploaders at once,
+while a poller hits the status endpoint of another, idle upload every few
+milliseconds, as other clients of the same worker would.
+Pool sizes come from the usual settings, e.g.
+
+run from src/mp-uploader:
+    MP_IO_WORKERS=8 MP_HASH_POOL=process python -m benchmark.status_latency_bench
+"""
+
+import asyncio
+import hashlib
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import server
+from mp_server import CHUNK_SIZE, settings
+
+CHUNKS = 16
+UPLOADERS = 4
+POLL_INTERVAL = 0.005
+
+
+async def upload(client, file_hash, chunks):
+    for offset, chunk_hash, piece in chunks:
+        await client.post(
+            "/upload/chunk/raw",
+            params={
+                "file_hash": file_hash,
+                "chunk_hash": chunk_hash,
+                "offset": offset,
+            },
+            content=piece,
+        )
+
+
+async def poll(client, file_hash, latencies, done):
+    while not done.is_set():
+        start = time.perf_counter()
+        await client.get(f"/upload/status/{file_hash}")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+async def main():
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=None
+    ) as client:
+        await client.post("/upload/init", params={"file_size": 1, "file_hash": "idle"})
+        data = os.urandom(CHUNK_SIZE * CHUNKS)
+        file_hash = hashlib.sha256(data).hexdigest()
+        response = await client.post(
+            "/upload/init",
+            params={
+                "file_size": len(data),
+                "file_hash": file_hash,
+                "chunk_size": CHUNK_SIZE,
+            },
+        )
+        chunk_size = response.json()["chunk_size"]
+        # hash on the client side up front, the client shares this event loop
+        chunks = [
+            (offset, hashlib.sha256(piece).hexdigest(), piece)
+            for offset in response.json()["chunks"]
+            for piece in [data[offset : offset + chunk_size]]
+        ]
+
+        latencies, done = [], asyncio.Event()
+        poller = asyncio.create_task(poll(client, "idle", latencies, done))
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(upload(client, file_hash, chunks[i::UPLOADERS]) for i in range(UPLOADERS))
+        )
+        elapsed = time.perf_counter() - start
+        done.set()
+        await poller
+
+    latencies.sort()
+    print(
+        f"io_workers={settings.io_workers} hash_pool={settings.hash_pool}"
+        f" hash_workers={settings.hash_workers}"
+    )
+    print(f"uploaded {len(data) / 2**20:.0f} MiB in {elapsed:.2f}s")
+    print(f"status polls: {len(latencies)}")
+    print(f"p50 {statistics.median(latencies) * 1000:8.2f} ms")
+    print(f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:8.2f} ms")
+    print(f"max {latencies[-1] * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as dir:
+        # keep benchmark uploads out of the real upload directory
+        server.__UPLOAD_DIR__ = Path(dir)
+        asyncio.run(main())
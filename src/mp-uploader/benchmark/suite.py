@@ -0,0 +1,390 @@
+"""Upload throughput suite, in-process (ASGI) and through a local uvicorn
+
+Sweeps file size, chunk size, concurrency and hash algorithm, uploading with
+mp_client.ParallelUploader, and writes MB/s, requests/s, p50/p99 chunk request
+latency and peak RSS per run as JSON. With --baseline the results are
+compared against a stored run and regressions make the exit status 1.
+
+run from src/mp-uploader:
+    python -m benchmark.suite --output bench.json
+    python -m benchmark.suite --output bench.json --save-baseline baseline.json
+    python -m benchmark.suite --baseline baseline.json --tolerance 0.15
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+SIZE_UNITS = {"K": 2**10, "M": 2**20, "G": 2**30}
+
+
+def parse_size(text):
+    text = text.strip().upper().removesuffix("IB").removesuffix("B")
+    if text[-1:] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def parse_list(text, cast=str):
+    return [cast(item) for item in text.split(",") if item]
+
+
+def reset_peak_rss(pid):
+    """Reset VmHWM of a process (Linux >= 4.0), False where unsupported"""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss(pid):
+    """Peak resident set size of a process in bytes, None where unknown"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid == os.getpid():
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+class TimedTransport(httpx.AsyncBaseTransport):
+    """Wrap a transport and record the latency of every chunk request"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+        self.latencies = []
+
+    async def handle_async_request(self, request):
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        if request.url.path.startswith("/upload/chunk"):
+            # the body is read here so the time covers the whole exchange
+            await response.aread()
+            self.latencies.append(time.perf_counter() - start)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class Target:
+    """Where the app runs, and which process to measure, subclasses give the
+    httpx transport reaching it with transport(concurrency)"""
+
+    name = None
+    base_url = "http://bench"
+    pid = os.getpid()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class AsgiTarget(Target):
+    name = "asgi"
+
+    def __init__(self, upload_dir):
+        # the upload directory is prepared when server is first imported,
+        # main runs this target in a child process started with it set
+        if os.environ.get("MP_UPLOAD_DIR") != str(upload_dir):
+            raise RuntimeError(f"MP_UPLOAD_DIR is not {upload_dir}")
+        import server
+
+        self.app = server.app
+
+    def transport(self, concurrency):
+        return httpx.ASGITransport(app=self.app)
+
+
+class UvicornTarget(Target):
+    name = "uvicorn"
+
+    def __init__(self, upload_dir):
+        self.upload_dir = upload_dir
+        self.process = None
+
+    def transport(self, concurrency):
+        limits = httpx.Limits(
+            max_connections=concurrency, max_keepalive_connections=concurrency
+        )
+        return httpx.AsyncHTTPTransport(limits=limits)
+
+    def __enter__(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        env = {**os.environ, "MP_UPLOAD_DIR": str(self.upload_dir)}
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "server:app",
+                "--port",
+                str(port),
+                "--log-level",
+                "warning",
+            ],
+            cwd=Path(__file__).parent.parent,
+            env=env,
+        )
+        self.pid = self.process.pid
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                httpx.get(f"{self.base_url}/docs", timeout=1)
+                return self
+            except httpx.TransportError:
+                time.sleep(0.1)
+        self.process.kill()
+        raise RuntimeError("uvicorn did not start")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait(timeout=30)
+
+
+async def run_case(target, data_file, file_size, chunk_size, concurrency, hash_type):
+    from mp_client import ParallelUploader
+
+    # a fresh prefix gives a file hash the server has not seen yet
+    with open(data_file, "r+b") as f:
+        f.write(os.urandom(16))
+
+    timed = TimedTransport(target.transport(concurrency))
+    async with httpx.AsyncClient(
+        transport=timed, base_url=target.base_url, timeout=None
+    ) as client:
+        uploader = ParallelUploader(
+            client=client,
+            concurrency=concurrency,
+            chunk_size=chunk_size,
+            hash_type=hash_type,
+            progress=lambda *args: None,
+        )
+        measured_rss = reset_peak_rss(target.pid)
+        result = await uploader.upload(data_file)
+
+    latencies = sorted(timed.latencies)
+    rss = peak_rss(target.pid)
+    return {
+        "transport": target.name,
+        "file_size": file_size,
+        "chunk_size": chunk_size,
+        "concurrency": concurrency,
+        "hash_type": hash_type,
+        "status": result["status"],
+        "seconds": result["seconds"],
+        "mb_s": result["bytes"] / result["seconds"] / 1e6,
+        "requests_s": len(latencies) / result["seconds"],
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p99_ms": (
+            latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000
+            if latencies
+            else None
+        ),
+        # process-lifetime peak where it can not be reset per run
+        "peak_rss_mib": rss / 2**20 if rss else None,
+        "peak_rss_per_run": measured_rss,
+    }
+
+
+def case_key(result):
+    return (
+        result["transport"],
+        result["file_size"],
+        result["chunk_size"],
+        result["concurrency"],
+        result["hash_type"],
+    )
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of MB/s and p99 latency beyond `tolerance` against a baseline"""
+    previous = {case_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None:
+            continue
+        if result["mb_s"] < old["mb_s"] * (1 - tolerance):
+            regressions.append((result, "mb_s", old["mb_s"], result["mb_s"]))
+        if (
+            result["p99_ms"] is not None
+            and old["p99_ms"] is not None
+            and result["p99_ms"] > old["p99_ms"] * (1 + tolerance)
+        ):
+            regressions.append((result, "p99_ms", old["p99_ms"], result["p99_ms"]))
+    return regressions
+
+
+async def sweep(target, upload_dir, work_dir, args):
+    """Every case of the sweep against one target"""
+    results = []
+    for file_size in args.file_sizes:
+        data_file = work_dir / f"data-{file_size}"
+        with open(data_file, "wb") as f:
+            for position in range(0, file_size, 2**24):
+                f.write(os.urandom(min(2**24, file_size - position)))
+        for chunk_size, concurrency, hash_type in itertools.product(
+            args.chunk_sizes, args.concurrency, args.hash_types
+        ):
+            result = await run_case(
+                target, data_file, file_size, chunk_size, concurrency, hash_type
+            )
+            results.append(result)
+            print(
+                f"{target.name:<8}{file_size / 2**20:>7.0f}M"
+                f"{chunk_size / 2**20:>6.0f}M x{concurrency:<4}"
+                f"{hash_type:<9}{result['mb_s']:>9.1f} MB/s"
+                f"{result['requests_s']:>9.1f} req/s"
+                f"  p50 {result['p50_ms']:.1f} p99 {result['p99_ms']:.1f} ms"
+                f"  rss {result['peak_rss_mib'] or 0:.0f} MiB"
+                f"  {result['status']}",
+                file=sys.stderr,
+            )
+            # uploads are not kept between runs, the indexes are
+            # emptied with them and recreated on the next use
+            for path in upload_dir.iterdir():
+                if path.is_dir():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink()
+        data_file.unlink()
+    return results
+
+
+def sweep_asgi(upload_dir, work_dir, args):
+    """Run the ASGI sweep in a child process with MP_UPLOAD_DIR set before
+    server is imported, returns its results"""
+    output = work_dir / "asgi.json"
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmark.suite",
+            "--transports",
+            "asgi",
+            "--file-sizes",
+            ",".join(map(str, args.file_sizes)),
+            "--chunk-sizes",
+            ",".join(map(str, args.chunk_sizes)),
+            "--concurrency",
+            ",".join(map(str, args.concurrency)),
+            "--hash-types",
+            ",".join(args.hash_types),
+            "--upload-dir",
+            str(upload_dir),
+            "--output",
+            str(output),
+        ],
+        cwd=Path(__file__).parent.parent,
+        env={**os.environ, "MP_UPLOAD_DIR": str(upload_dir)},
+        check=True,
+    )
+    return json.loads(output.read_text())["results"]
+
+
+async def main(args):
+    from mp_server import settings
+
+    targets = {"asgi": AsgiTarget, "uvicorn": UvicornTarget}
+    results = []
+    work_dir = Path(tempfile.mkdtemp(prefix="mp-bench-"))
+    try:
+        for transport in args.transports:
+            if args.upload_dir:
+                # the ASGI child process of sweep_asgi
+                upload_dir = Path(args.upload_dir)
+            else:
+                upload_dir = work_dir / transport / "upload"
+                upload_dir.mkdir(parents=True)
+            if transport == "asgi" and not args.upload_dir:
+                results += await asyncio.to_thread(
+                    sweep_asgi, upload_dir, work_dir, args
+                )
+                continue
+            with targets[transport](upload_dir) as target:
+                results += await sweep(target, upload_dir, work_dir, args)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "settings": settings.model_dump(),
+        },
+        "results": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(report, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(results, baseline, args.tolerance)
+        for result, metric, old, new in regressions:
+            print(
+                f"REGRESSION {case_key(result)} {metric}: {old:.2f} -> {new:.2f}",
+                file=sys.stderr,
+            )
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transports", type=parse_list, default="asgi,uvicorn")
+    parser.add_argument(
+        "--file-sizes", type=lambda text: parse_list(text, parse_size), default="64M"
+    )
+    parser.add_argument(
+        "--chunk-sizes",
+        type=lambda text: parse_list(text, parse_size),
+        default="1M,8M,32M",
+    )
+    parser.add_argument(
+        "--concurrency", type=lambda text: parse_list(text, int), default="1,4,16"
+    )
+    parser.add_argument("--hash-types", type=parse_list, default="sha256,blake2b")
+    parser.add_argument("--output", help="write the JSON report here, else stdout")
+    # set by sweep_asgi for its child process
+    parser.add_argument("--upload-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--baseline", help="compare against this stored report")
+    parser.add_argument("--save-baseline", help="also store this run as a baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="allowed relative drop of MB/s or rise of p99 latency",
+    )
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,13 @@
+from .downloader import ParallelDownloader
+from .transfer import RetryableError, Throughput, TransferClient, TransferError
+from .uploader import ParallelUploader, file_hash
+
+__all__ = [
+    "ParallelUploader",
+    "ParallelDownloader",
+    "file_hash",
+    "Throughput",
+    "TransferClient",
+    "TransferError",
+    "RetryableError",
+]
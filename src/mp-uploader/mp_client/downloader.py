@@ -0,0 +1,250 @@
+"""Parallel verified download client for the mp-uploader server
+
+run from src/mp-uploader:
+    python -m mp_client.downloader <file_hash> <dest> [--url URL] [--concurrency N]
+"""
+
+import argparse
+import asyncio
+import errno
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+import httpx
+from mp_server.chunk_map import ChunkMap
+from mp_server.manifest import merkle_root
+
+from .transfer import (
+    RetryableError,
+    Throughput,
+    TransferClient,
+    TransferError,
+    check_response,
+    run_workers,
+    with_retries,
+)
+from .uploader import file_hash as calculate_file_hash
+
+logger = logging.getLogger(__name__)
+
+
+def write_durably(fd, data, offset):
+    """Write a chunk and flush it, so it is on disk before its bit is set"""
+    view = memoryview(data)
+    written = 0
+    while written < len(view):
+        written += os.pwrite(fd, view[written:], offset + written)
+    os.fdatasync(fd)
+
+
+def create_part_file(part_file: Path, size):
+    """Preallocate the partial download, sparse where fallocate is missing"""
+    with open(part_file, "wb") as f:
+        if not size:
+            return
+        if hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                    raise
+        f.truncate(size)
+
+
+class ParallelDownloader(TransferClient):
+    """Download a stored file as concurrent byte ranges, one chunk each
+
+    Chunks go straight to their offset in a preallocated `.part` file
+    with os.pwrite, once their hash matches /download/chunk-hashes. A local
+    chunk map in the server's `.bmap` format records finished chunks, so an
+    interrupted download resumes where it stopped. At most `concurrency`
+    chunks are held in memory.
+    """
+
+    def __init__(
+        self,
+        base_url="http://localhost:8000",
+        concurrency=8,
+        retries=5,
+        backoff=0.5,
+        timeout=300,
+        verify_file=True,
+        client: httpx.AsyncClient = None,
+        progress=None,
+    ):
+        super().__init__(
+            base_url, concurrency, retries, backoff, timeout, client, progress
+        )
+        # rehash the whole file at the end ("file" mode files only)
+        self.verify_file = verify_file
+
+    def open_part(self, part_file: Path, info):
+        """Chunk map of the partial download, started over unless it matches"""
+        chunk_manager = ChunkMap(part_file.name, part_file.parent)
+        if (
+            part_file.is_file()
+            and part_file.stat().st_size == info["file_size"]
+            and chunk_manager.chunk_size == info["chunk_size"]
+            and chunk_manager.total_chunks == info["total_chunks"]
+            and chunk_manager.hash_type == info["hash"]
+        ):
+            return chunk_manager
+        create_part_file(part_file, info["file_size"])
+        chunk_manager.initialize_map(
+            info["file_size"],
+            info["chunk_size"],
+            hash_mode=info["hash_mode"],
+            hash_type=info["hash"],
+        )
+        return chunk_manager
+
+    async def fetch_chunk(self, client, file_hash, start, end, chunk_hash, hash_type):
+        response = check_response(
+            await client.get(
+                f"/download/file/{file_hash}",
+                headers={
+                    "range": f"bytes={start}-{end - 1}",
+                    # the etag is the file hash, a different file is never mixed in
+                    "if-range": f'"{file_hash}"',
+                },
+            )
+        )
+        if response.status_code != 206:
+            raise TransferError(f"Range not honored, HTTP {response.status_code}")
+        data = response.content
+        actual = await asyncio.to_thread(
+            lambda: hashlib.new(hash_type, data).hexdigest()
+        )
+        if len(data) != end - start or actual != chunk_hash:
+            # corrupted on the way, fetch it again
+            raise RetryableError(f"Chunk at {start} failed verification")
+        return data
+
+    async def worker(self, client, fd, file_hash, queue, info, hashes, throughput):
+        chunk_manager = info["chunk_manager"]
+        chunk_size, file_size = info["chunk_size"], info["file_size"]
+        while True:
+            try:
+                offset = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            data = await with_retries(
+                self.fetch_chunk,
+                client,
+                file_hash,
+                offset,
+                min(offset + chunk_size, file_size),
+                hashes[str(offset)],
+                info["hash"],
+                retries=self.retries,
+                backoff=self.backoff,
+            )
+            await asyncio.to_thread(write_durably, fd, data, offset)
+            chunk_manager.mark_chunk(offset, complete=True)
+            throughput.add(len(data))
+
+    async def download(self, file_hash, dest):
+        """Download `file_hash` to `dest`, returns the throughput reached"""
+        dest = Path(dest)
+        part_file = dest.with_name(f"{dest.name}.{file_hash[:16]}.part")
+
+        async with self.connect() as client:
+            info = await self.request(
+                client, "GET", "/download/init", params={"file_hash": file_hash}
+            )
+            if info["status"] != "ready":
+                raise TransferError(info["message"])
+            hashes = await self.request(
+                client,
+                "GET",
+                "/download/chunk-hashes",
+                params={"file_hash": file_hash},
+            )
+            if hashes["status"] != "success":
+                raise TransferError(hashes["message"])
+            hashes = hashes["chunk_hashes"]
+
+            chunk_manager = await asyncio.to_thread(self.open_part, part_file, info)
+            info["chunk_manager"] = chunk_manager
+            queue = asyncio.Queue()
+            for offset in chunk_manager.get_incomplete_chunks():
+                queue.put_nowait(offset)
+
+            throughput = Throughput(
+                info["file_size"], name=dest.name, callback=self.progress
+            )
+            fd = os.open(part_file, os.O_WRONLY)
+            try:
+                with throughput:
+                    await run_workers(
+                        self.worker(
+                            client, fd, file_hash, queue, info, hashes, throughput
+                        )
+                        for _ in range(self.concurrency)
+                    )
+            finally:
+                os.close(fd)
+
+        if not chunk_manager.is_complete():
+            raise TransferError("Download incomplete")
+        if info["hash_mode"] == "tree":
+            digests = [
+                bytes.fromhex(hashes[str(offset)])
+                for offset in range(0, info["file_size"], info["chunk_size"])
+            ]
+            verified = (
+                merkle_root(
+                    digests, info["file_size"], info["chunk_size"], info["hash"]
+                )
+                == file_hash
+            )
+        elif self.verify_file:
+            verified = (
+                await asyncio.to_thread(calculate_file_hash, part_file, info["hash"])
+                == file_hash
+            )
+        else:
+            verified = True
+        if not verified:
+            # every chunk matched its listed hash, so the list itself was wrong
+            chunk_manager.mark_all(complete=False)
+            raise TransferError("File hash mismatch")
+
+        os.replace(part_file, dest)
+        chunk_manager.map_file.unlink(missing_ok=True)
+        return {
+            "file_hash": file_hash,
+            "path": str(dest),
+            "bytes": throughput.done,
+            "seconds": throughput.elapsed(),
+            "rate": throughput.rate(),
+        }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file_hash")
+    parser.add_argument("dest")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--retries", type=int, default=5)
+    args = parser.parse_args()
+
+    downloader = ParallelDownloader(
+        args.url, concurrency=args.concurrency, retries=args.retries
+    )
+    result = await downloader.download(args.file_hash, args.dest)
+    logger.info(
+        f"{result['path']}: {result['bytes'] / 2**20:,.0f} MiB received in"
+        f" {result['seconds']:.1f}s, {result['rate'] / 2**20:,.1f} MiB/s"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    asyncio.run(main())
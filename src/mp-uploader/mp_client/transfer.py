@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class TransferError(Exception):
+    pass
+
+
+class RetryableError(Exception):
+    """A chunk transfer that failed in a way worth trying again"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_after(response: httpx.Response):
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+def check_response(response: httpx.Response):
+    """Raise RetryableError for overload and server errors, TransferError
+    for other failures, so callers only see successful responses"""
+    if response.status_code == 507:
+        # the server is out of space, retrying soon will not help
+        raise TransferError(f"HTTP 507: {response.text}")
+    if response.status_code in (408, 429) or response.status_code >= 500:
+        raise RetryableError(
+            f"HTTP {response.status_code}", retry_after=retry_after(response)
+        )
+    if response.status_code >= 400:
+        raise TransferError(f"HTTP {response.status_code}: {response.text}")
+    return response
+
+
+async def with_retries(func, *args, retries=5, backoff=0.5, max_backoff=30):
+    """Await func(*args), retrying transport and retryable errors with
+    exponential backoff and full jitter, or the server's Retry-After"""
+    for attempt in range(retries + 1):
+        try:
+            return await func(*args)
+        except (httpx.TransportError, RetryableError) as e:
+            if attempt == retries:
+                raise TransferError(f"Giving up after {retries} retries: {e!r}")
+            delay = getattr(e, "retry_after", None)
+            if delay is None:
+                delay = random.uniform(0, min(max_backoff, backoff * 2**attempt))
+            logger.debug(f"retry {attempt + 1}/{retries} in {delay:.2f}s: {e!r}")
+            await asyncio.sleep(delay)
+
+
+async def run_workers(coroutines):
+    """Run worker coroutines together, cancelling the rest when one fails"""
+    tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+class TransferClient:
+    """Connection and retry settings shared by the upload and download clients"""
+
+    def __init__(
+        self,
+        base_url="http://localhost:8000",
+        concurrency=8,
+        retries=5,
+        backoff=0.5,
+        timeout=300,
+        client: httpx.AsyncClient = None,
+        progress=None,
+    ):
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        # an existing client, e.g. one bound to an in-process ASGI app
+        self.client = client
+        # called with (done, total, bytes/s) instead of logging throughput
+        self.progress = progress
+
+    @asynccontextmanager
+    async def connect(self):
+        if self.client is not None:
+            yield self.client
+            return
+        limits = httpx.Limits(
+            max_connections=self.concurrency,
+            max_keepalive_connections=self.concurrency,
+        )
+        async with httpx.AsyncClient(
+            base_url=self.base_url, limits=limits, timeout=self.timeout
+        ) as client:
+            yield client
+
+    async def request(self, client, method, url, **kwargs):
+        async def send():
+            return check_response(await client.request(method, url, **kwargs))
+
+        response = await with_retries(send, retries=self.retries, backoff=self.backoff)
+        return response.json()
+
+
+class Throughput:
+    """Bytes transferred so far, reported every `interval` seconds while running"""
+
+    def __init__(self, total, name="transfer", interval=1.0, callback=None):
+        self.total = total
+        self.name = name
+        self.interval = interval
+        # called with (done, total, current bytes/s) instead of logging
+        self.callback = callback
+        self.done = 0
+        self.start = None
+        self.task = None
+
+    def add(self, size):
+        self.done += size
+
+    def elapsed(self):
+        return time.perf_counter() - self.start if self.start else 0.0
+
+    def rate(self):
+        elapsed = self.elapsed()
+        return self.done / elapsed if elapsed else 0.0
+
+    def report(self, current):
+        if self.callback is not None:
+            self.callback(self.done, self.total, current)
+            return
+        logger.info(
+            f"{self.name}: {self.done / 2**20:,.0f}/{self.total / 2**20:,.0f} MiB"
+            f" {current / 2**20:,.1f} MiB/s (avg {self.rate() / 2**20:,.1f} MiB/s)"
+        )
+
+    async def run(self):
+        last_done, last_time = self.done, time.perf_counter()
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self.report((self.done - last_done) / (now - last_time))
+            last_done, last_time = self.done, now
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.task = asyncio.create_task(self.run())
+        return self
+
+    def __exit__(self, *exc):
+        self.task.cancel()
@@ -0,0 +1,212 @@
+"""Parallel resumable upload client for the mp-uploader server
+
+run from src/mp-uploader:
+    python -m mp_client.uploader <file> [--url URL] [--concurrency N]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+
+import httpx
+
+from .transfer import (
+    RetryableError,
+    Throughput,
+    TransferClient,
+    TransferError,
+    check_response,
+    run_workers,
+    with_retries,
+)
+
+logger = logging.getLogger(__name__)
+
+# slice of the mapped file handed to hashlib at once, large enough that
+# hashlib runs without the GIL, small enough to keep the page cache warm
+HASH_WINDOW = 64 * 1024 * 1024
+
+
+def file_hash(path, hash_type="sha256"):
+    """Hash a whole file through mmap, without copying it into Python"""
+    hash = hashlib.new(hash_type)
+    size = os.path.getsize(path)
+    if not size:
+        return hash.hexdigest()
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mm) as view:
+                for position in range(0, size, HASH_WINDOW):
+                    hash.update(view[position : position + HASH_WINDOW])
+    return hash.hexdigest()
+
+
+def ranges_to_offsets(ranges, chunk_size):
+    return [offset for start, end in ranges for offset in range(start, end, chunk_size)]
+
+
+class ParallelUploader(TransferClient):
+    """Upload a file as concurrent raw chunks, resuming whatever is missing
+
+    At most `concurrency` chunks are read, hashed and sent at once, so memory
+    stays at concurrency x chunk size. Failed chunks are retried with backoff,
+    and after each pass the server status decides what is sent again.
+    """
+
+    def __init__(
+        self,
+        base_url="http://localhost:8000",
+        concurrency=8,
+        retries=5,
+        backoff=0.5,
+        hash_type="sha256",
+        chunk_size=None,
+        passes=3,
+        timeout=300,
+        client: httpx.AsyncClient = None,
+        progress=None,
+    ):
+        super().__init__(
+            base_url, concurrency, retries, backoff, timeout, client, progress
+        )
+        self.hash_type = hash_type
+        # None lets the server pick the chunk size
+        self.chunk_size = chunk_size
+        self.passes = passes
+
+    async def send_chunk(self, client, file_hash, offset, chunk_hash, data):
+        response = check_response(
+            await client.post(
+                "/upload/chunk/raw",
+                params={
+                    "file_hash": file_hash,
+                    "chunk_hash": chunk_hash,
+                    "offset": offset,
+                },
+                content=data,
+            )
+        )
+        result = response.json()
+        if result["status"] == "chunk_failed":
+            # corrupted on the way, send it again
+            raise RetryableError(result["message"])
+        if result["status"] == "error":
+            raise TransferError(result["message"])
+        return result
+
+    async def worker(self, client, fd, file_hash, queue, info, throughput):
+        chunk_size, hash_type = info["chunk_size"], info["hash"]
+        while True:
+            try:
+                offset = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            data = await asyncio.to_thread(os.pread, fd, chunk_size, offset)
+            chunk_hash = await asyncio.to_thread(
+                lambda: hashlib.new(hash_type, data).hexdigest()
+            )
+            await with_retries(
+                self.send_chunk,
+                client,
+                file_hash,
+                offset,
+                chunk_hash,
+                data,
+                retries=self.retries,
+                backoff=self.backoff,
+            )
+            throughput.add(len(data))
+
+    async def upload(self, path):
+        """Upload `path`, returns the final status and the throughput reached"""
+        file_size = os.path.getsize(path)
+        digest = await asyncio.to_thread(file_hash, path, self.hash_type)
+        logger.info(f"{path}: {file_size} bytes, {self.hash_type} {digest}")
+
+        async with self.connect() as client:
+            info = await self.request(
+                client,
+                "POST",
+                "/upload/init",
+                params={
+                    "file_size": file_size,
+                    "file_hash": digest,
+                    "hash_type": self.hash_type,
+                    "chunk_format": "ranges",
+                    **({"chunk_size": self.chunk_size} if self.chunk_size else {}),
+                },
+            )
+            throughput = Throughput(
+                file_size, name=os.path.basename(path), callback=self.progress
+            )
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                with throughput:
+                    for _ in range(self.passes):
+                        if info["status"] != "incomplete":
+                            break
+                        queue = asyncio.Queue()
+                        for offset in ranges_to_offsets(
+                            info["chunks"], info["chunk_size"]
+                        ):
+                            if offset < file_size:
+                                queue.put_nowait(offset)
+                        await run_workers(
+                            self.worker(client, fd, digest, queue, info, throughput)
+                            for _ in range(self.concurrency)
+                        )
+                        # resume from what the server still misses
+                        status = await self.request(
+                            client,
+                            "GET",
+                            f"/upload/status/{digest}",
+                            params={"chunk_format": "ranges"},
+                        )
+                        info = {**info, **status}
+            finally:
+                os.close(fd)
+
+        if info["status"] == "error":
+            raise TransferError(info["message"])
+        return {
+            "file_hash": digest,
+            "status": info["status"],
+            "message": info["message"],
+            "bytes": throughput.done,
+            "seconds": throughput.elapsed(),
+            "rate": throughput.rate(),
+        }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--hash-type", default="sha256")
+    args = parser.parse_args()
+
+    uploader = ParallelUploader(
+        args.url,
+        concurrency=args.concurrency,
+        retries=args.retries,
+        hash_type=args.hash_type,
+    )
+    result = await uploader.upload(args.file)
+    logger.info(
+        f"{result['status']}: {result['bytes'] / 2**20:,.0f} MiB sent in"
+        f" {result['seconds']:.1f}s, {result['rate'] / 2**20:,.1f} MiB/s"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    asyncio.run(main())
@@ -1,26 +1,178 @@
+import importlib
 from pathlib import Path
 
 PROJ_ROOT = Path(__file__).parent.resolve()
 CHUNK_SIZE = 1024 * 1024 * 32
 HASH_METHOD = "sha256"
 
-from .BinaryChunkMapManager import BinaryChunkMapManager, setup_file_and_chunk_map
-from .utils import (
-    calculate_hash,
-    calculate_optimal_chunk_size,
-    create_empty_file,
-    parallel_write_chunks,
-    write_chunk,
-    write_chunk_to_position,
-)
+# every export is imported on first use, so a client importing the chunk map
+# format does not load the server's settings, indexes and pools along with it
+_exports = {
+    "AdmissionController": "admission",
+    "AdmissionMiddleware": "admission",
+    "ChunkIndex": "chunk_index",
+    "ChunkMap": "chunk_map",
+    "read_chunk_map": "chunk_map",
+    "BinaryChunkMapManager": "chunk_map_manager",
+    "setup_file_and_chunk_map": "chunk_map_manager",
+    "GarbageCollector": "collector",
+    "settings": "config",
+    "apply_delta": "delta",
+    "compute_delta": "delta",
+    "encode_delta": "delta",
+    "file_signature": "delta",
+    "signature_block_size": "delta",
+    "VerifiedDigestRecord": "digest_record",
+    "digest_record_type": "digest_record",
+    "verified_file_hash": "digest_record",
+    "GroupCommit": "durability",
+    "fdatasync_file": "durability",
+    "sync_data": "durability",
+    "run_hash": "executor",
+    "run_io": "executor",
+    "shutdown_executors": "executor",
+    "FrameReader": "framing",
+    "FramingError": "framing",
+    "encode_frame": "framing",
+    "encode_frame_header": "framing",
+    "fanout_dir": "layout",
+    "index_uploads": "layout",
+    "migrate_layout": "layout",
+    "prepare_upload_dir": "layout",
+    "verify_upload": "layout",
+    "verify_uploads": "layout",
+    "ChunkHashManifest": "manifest",
+    "merkle_root": "manifest",
+    "METRICS_CONTENT_TYPE": "metrics",
+    "active_uploads": "metrics",
+    "count_coalesced": "metrics",
+    "count_evicted": "metrics",
+    "count_received": "metrics",
+    "count_upload_started": "metrics",
+    "record": "metrics",
+    "record_admission": "metrics",
+    "render_metrics": "metrics",
+    "timed": "metrics",
+    "track_admitted": "metrics",
+    "upload_session": "metrics",
+    "FileRangeResponse": "responses",
+    "RangeNotSatisfiable": "responses",
+    "file_validators": "responses",
+    "parse_range_header": "responses",
+    "Scrubber": "scrubber",
+    "Throttle": "scrubber",
+    "ChunkClaims": "single_flight",
+    "SingleFlight": "single_flight",
+    "claim_chunk": "single_flight",
+    "coalesce": "single_flight",
+    "invalidate_upload": "single_flight",
+    "UPLOAD_BAD_FILE": "upload_index",
+    "UPLOAD_UNVERIFIED": "upload_index",
+    "UPLOAD_COMPLETED": "upload_index",
+    "UPLOAD_INCOMPLETE": "upload_index",
+    "UploadIndex": "upload_index",
+    "ChunkWriter": "utils",
+    "ParallelWriter": "utils",
+    "buffer_stream": "utils",
+    "calculate_chunk_hash": "utils",
+    "calculate_hash": "utils",
+    "calculate_optimal_chunk_size": "utils",
+    "copy_chunk": "utils",
+    "copy_range": "utils",
+    "create_empty_file": "utils",
+    "has_free_space": "utils",
+    "hash_file_chunks": "utils",
+    "parallel_write_chunks": "utils",
+    "pwrite_all": "utils",
+    "write_chunk": "utils",
+    "write_chunk_to_position": "utils",
+}
 
 __all__ = [
     "write_chunk_to_position",
     "calculate_hash",
+    "calculate_chunk_hash",
     "create_empty_file",
+    "has_free_space",
     "calculate_optimal_chunk_size",
+    "copy_chunk",
+    "copy_range",
+    "hash_file_chunks",
     "parallel_write_chunks",
+    "ParallelWriter",
+    "pwrite_all",
+    "buffer_stream",
     "write_chunk",
+    "ChunkWriter",
     "setup_file_and_chunk_map",
     "BinaryChunkMapManager",
+    "read_chunk_map",
+    "ChunkMap",
+    "ChunkHashManifest",
+    "METRICS_CONTENT_TYPE",
+    "count_received",
+    "count_upload_started",
+    "active_uploads",
+    "count_evicted",
+    "count_coalesced",
+    "record_admission",
+    "track_admitted",
+    "record",
+    "render_metrics",
+    "timed",
+    "upload_session",
+    "ChunkIndex",
+    "UploadIndex",
+    "UPLOAD_INCOMPLETE",
+    "UPLOAD_COMPLETED",
+    "UPLOAD_BAD_FILE",
+    "UPLOAD_UNVERIFIED",
+    "fanout_dir",
+    "index_uploads",
+    "migrate_layout",
+    "prepare_upload_dir",
+    "verify_upload",
+    "verify_uploads",
+    "GarbageCollector",
+    "SingleFlight",
+    "AdmissionController",
+    "AdmissionMiddleware",
+    "coalesce",
+    "invalidate_upload",
+    "ChunkClaims",
+    "claim_chunk",
+    "Scrubber",
+    "Throttle",
+    "merkle_root",
+    "VerifiedDigestRecord",
+    "verified_file_hash",
+    "digest_record_type",
+    "apply_delta",
+    "compute_delta",
+    "encode_delta",
+    "file_signature",
+    "signature_block_size",
+    "settings",
+    "GroupCommit",
+    "fdatasync_file",
+    "sync_data",
+    "run_io",
+    "run_hash",
+    "shutdown_executors",
+    "FrameReader",
+    "FramingError",
+    "encode_frame",
+    "encode_frame_header",
+    "FileRangeResponse",
+    "RangeNotSatisfiable",
+    "file_validators",
+    "parse_range_header",
 ]
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_exports[name]}", __name__), name)
+    globals()[name] = value
+    return value
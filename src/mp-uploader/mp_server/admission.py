@@ -0,0 +1,186 @@
+import asyncio
+import functools
+import time
+from urllib.parse import parse_qs
+
+from starlette.responses import JSONResponse
+
+from . import CHUNK_SIZE
+from .config import settings
+from .metrics import record_admission, track_admitted
+
+# requests that write chunk data, and are admitted by AdmissionController
+ADMITTED_PATHS = frozenset(
+    ["/upload/chunk", "/upload/chunk/raw", "/upload/chunks", "/upload/delta"]
+)
+
+
+class AdmissionController:
+    """Limit the chunk writes running at once, over all uploads and per upload
+
+    A write holds one slot and its Content-Length in bytes (CHUNK_SIZE when
+    the body is streamed without one) until its response is sent. A request
+    larger than a byte limit is charged the limit, so it still runs once
+    alone. A write over a limit waits up to `wait` seconds for room, woken
+    as others finish, before it is turned away. A limit of 0 is no limit.
+    """
+
+    def __init__(self, max_writes, max_bytes, max_file_writes, max_file_bytes, wait):
+        self.max_writes = max_writes
+        self.max_bytes = max_bytes
+        self.max_file_writes = max_file_writes
+        self.max_file_bytes = max_file_bytes
+        self.wait = wait
+        self.writes = 0
+        self.bytes = 0
+        # file hash: [writes, bytes] of its admitted writes
+        self.files = {}
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.loop = None
+        self.changed = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            settings.admission_max_writes,
+            settings.admission_max_bytes,
+            settings.admission_max_file_writes,
+            settings.admission_max_file_bytes,
+            settings.admission_wait,
+        )
+
+    def charge(self, size):
+        """Bytes a write of `size` (None when unknown) is counted for"""
+        size = CHUNK_SIZE if size is None else size
+        for limit in (self.max_bytes, self.max_file_bytes):
+            if limit:
+                size = min(size, limit)
+        return size
+
+    def fits(self, file_hash, size):
+        writes, used = self.files.get(file_hash, (0, 0))
+        return (
+            (not self.max_writes or self.writes < self.max_writes)
+            and (not self.max_bytes or self.bytes + size <= self.max_bytes)
+            and (not self.max_file_writes or writes < self.max_file_writes)
+            and (not self.max_file_bytes or used + size <= self.max_file_bytes)
+        )
+
+    def condition(self):
+        """The Condition waiters sleep on, one per event loop"""
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.changed = asyncio.Condition()
+        return self.changed
+
+    def take(self, file_hash, size):
+        self.writes += 1
+        self.bytes += size
+        usage = self.files.setdefault(file_hash, [0, 0])
+        usage[0] += 1
+        usage[1] += size
+
+    async def acquire(self, file_hash, size):
+        """Admit a write of `size` bytes, returns the bytes charged for it,
+        or None when there was no room within `wait` seconds"""
+        size = self.charge(size)
+        start = time.perf_counter()
+        # with writes already waiting, a new one queues behind them
+        if self.waiting or not self.fits(file_hash, size):
+            changed = self.condition()
+            self.waiting += 1
+            try:
+                async with changed:
+                    await asyncio.wait_for(
+                        changed.wait_for(functools.partial(self.fits, file_hash, size)),
+                        self.wait,
+                    )
+                    self.take(file_hash, size)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                record_admission("rejected", time.perf_counter() - start)
+                return None
+            finally:
+                self.waiting -= 1
+        else:
+            self.take(file_hash, size)
+        self.admitted += 1
+        record_admission("admitted", time.perf_counter() - start)
+        track_admitted(1, size)
+        return size
+
+    async def release(self, file_hash, size):
+        # counted back before any await, so a cancelled release loses no room
+        self.writes -= 1
+        self.bytes -= size
+        usage = self.files[file_hash]
+        usage[0] -= 1
+        usage[1] -= size
+        if not usage[0]:
+            del self.files[file_hash]
+        track_admitted(-1, -size)
+        if self.waiting:
+            changed = self.condition()
+            async with changed:
+                changed.notify_all()
+
+    def stats(self):
+        return {
+            "writes": self.writes,
+            "bytes": self.bytes,
+            "uploads": len(self.files),
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "max_writes": self.max_writes or None,
+            "max_bytes": self.max_bytes or None,
+            "max_file_writes": self.max_file_writes or None,
+            "max_file_bytes": self.max_file_bytes or None,
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting chunk writes through an AdmissionController
+
+    Runs before the body is read, so a write turned away costs no spooling.
+    It is answered 503 with Retry-After (settings.admission_retry_after), which
+    mp_client retries after the given delay.
+    """
+
+    def __init__(self, app, controller):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] not in ADMITTED_PATHS
+        ):
+            await self.app(scope, receive, send)
+            return
+        query = parse_qs(scope["query_string"].decode("latin-1"))
+        file_hash = query.get("file_hash", [""])[0]
+        size = None
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit():
+                size = int(value)
+        charged = await self.controller.acquire(file_hash, size)
+        if charged is None:
+            response = JSONResponse(
+                {
+                    "status": "error",
+                    "message": "Too many chunk writes in progress, retry later",
+                },
+                status_code=503,
+                headers={"Retry-After": str(settings.admission_retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await self.controller.release(file_hash, charged)
@@ -0,0 +1,113 @@
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class SQLiteIndex:
+    """A small SQLite database next to the uploads, `schema` is a list of
+    CREATE ... IF NOT EXISTS statements"""
+
+    schema = ()
+    # bumped on schema changes, see current
+    version = 0
+
+    def __init__(self, index_file):
+        self.index_file = Path(index_file)
+
+    def current(self):
+        """Whether the index file exists and has this schema version"""
+        if not self.index_file.exists():
+            return False
+        connection = sqlite3.connect(self.index_file, timeout=30)
+        try:
+            return connection.execute("PRAGMA user_version").fetchone()[0] == (
+                self.version
+            )
+        finally:
+            connection.close()
+
+    def reset(self):
+        """Delete the index file, the next connect starts an empty one"""
+        for suffix in ("", "-wal", "-shm"):
+            self.index_file.with_name(f"{self.index_file.name}{suffix}").unlink(
+                missing_ok=True
+            )
+
+    @contextmanager
+    def connect(self):
+        """A short-lived connection in one transaction, safe from any I/O pool
+        thread and from several worker processes (WAL journal)"""
+        connection = sqlite3.connect(self.index_file, timeout=30)
+        try:
+            # cheap no-ops once the schema exists, and an index file deleted
+            # under a running server is simply recreated
+            connection.execute("PRAGMA journal_mode=WAL")
+            for statement in self.schema:
+                connection.execute(statement)
+            if connection.execute("PRAGMA user_version").fetchone()[0] != self.version:
+                connection.execute(f"PRAGMA user_version = {self.version}")
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+
+class ChunkIndex(SQLiteIndex):
+    """Content address of every verified chunk in the upload directory
+
+    Maps (hash_type, chunk hash, length) to the stored files and offsets that
+    hold those bytes, so a chunk another upload already sent is copied on the
+    server instead of being sent again. Entries are hints, a copied chunk is
+    always rehashed before it is marked complete.
+    """
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS chunks ("
+        " hash_type TEXT, chunk_hash TEXT, length INTEGER,"
+        " file_hash TEXT, offset INTEGER,"
+        " PRIMARY KEY (hash_type, chunk_hash, length, file_hash, offset)"
+        ") WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS chunks_by_file ON chunks (file_hash, offset)",
+    )
+
+    def add(self, hash_type, file_hash, chunks):
+        """Record {offset: (chunk_hash, length)} of one file"""
+        with self.connect() as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO chunks VALUES (?, ?, ?, ?, ?)",
+                [
+                    (hash_type, chunk_hash, length, file_hash, offset)
+                    for offset, (chunk_hash, length) in chunks.items()
+                ],
+            )
+
+    def remove(self, locations):
+        """Drop entries by (file_hash, offset), e.g. chunks that failed to verify"""
+        with self.connect() as connection:
+            connection.executemany(
+                "DELETE FROM chunks WHERE file_hash = ? AND offset = ?", locations
+            )
+
+    def forget_file(self, file_hash):
+        """Drop every entry of a file that is being replaced or deleted"""
+        with self.connect() as connection:
+            connection.execute("DELETE FROM chunks WHERE file_hash = ?", (file_hash,))
+
+    def lookup(self, hash_type, chunks, exclude=None):
+        """Find a stored copy of each {offset: (chunk_hash, length)}
+
+        Returns {offset: (file_hash, source_offset)} for the chunks found,
+        entries of the file `exclude` are skipped.
+        """
+        found = {}
+        with self.connect() as connection:
+            for offset, (chunk_hash, length) in chunks.items():
+                row = connection.execute(
+                    "SELECT file_hash, offset FROM chunks"
+                    " WHERE hash_type = ? AND chunk_hash = ? AND length = ?"
+                    " AND file_hash != ? LIMIT 1",
+                    (hash_type, chunk_hash, length, exclude or ""),
+                ).fetchone()
+                if row is not None:
+                    found[offset] = row
+        return found
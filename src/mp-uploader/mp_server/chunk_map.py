@@ -0,0 +1,199 @@
+import math
+import os
+import re
+import struct
+from pathlib import Path
+
+from . import HASH_METHOD
+
+# The `.bmap` format, with nothing beyond the standard library, so the
+# download client can keep its progress in it without loading the server:
+# a header, then one bit per chunk (least significant first), set once the
+# chunk is stored. The server maps it shared, see chunk_map_manager.
+
+MAP_MAGIC_NUMBER = 0xB17CCB  # Binary MAP identifier, v2 header
+# magic_number, total_chunks, chunk_size, hash_mode, hash_type
+MAP_HEADER_FORMAT = "QQQ16s16s"
+MAP_HEADER_SIZE = struct.calcsize(MAP_HEADER_FORMAT)
+# v1 maps only carry magic_number, total_chunks, chunk_size
+LEGACY_MAP_MAGIC_NUMBER = 0xB17CCA
+LEGACY_MAP_HEADER_FORMAT = "QQQ"
+LEGACY_MAP_HEADER_SIZE = struct.calcsize(LEGACY_MAP_HEADER_FORMAT)
+
+# runs of fully incomplete bytes, or a single partly complete byte;
+# fully complete (0xFF) bytes are skipped by the regex engine in C
+__incomplete_bytes__ = re.compile(rb"\x00+|[^\xff]")
+
+
+def pack_map_header(total_chunks, chunk_size, hash_mode="file", hash_type=HASH_METHOD):
+    return struct.pack(
+        MAP_HEADER_FORMAT,
+        MAP_MAGIC_NUMBER,
+        total_chunks,
+        chunk_size,
+        hash_mode.encode(),
+        hash_type.encode(),
+    )
+
+
+def parse_map_header(data):
+    """(header_size, total_chunks, chunk_size, hash_mode, hash_type) of a `.bmap`"""
+    (magic,) = struct.unpack_from("Q", data)
+    if magic == LEGACY_MAP_MAGIC_NUMBER:
+        _, total_chunks, chunk_size = struct.unpack_from(LEGACY_MAP_HEADER_FORMAT, data)
+        return LEGACY_MAP_HEADER_SIZE, total_chunks, chunk_size, "file", HASH_METHOD
+    assert magic == MAP_MAGIC_NUMBER, Exception(
+        "Invalid binary chunk map file. Please check the file."
+    )
+    _, total_chunks, chunk_size, hash_mode, hash_type = struct.unpack_from(
+        MAP_HEADER_FORMAT, data
+    )
+    return (
+        MAP_HEADER_SIZE,
+        total_chunks,
+        chunk_size,
+        hash_mode.rstrip(b"\0").decode(),
+        hash_type.rstrip(b"\0").decode(),
+    )
+
+
+def iter_incomplete_runs(bitmap, total_chunks):
+    """Yield [start, end) chunk index runs of the clear bits of `bitmap`"""
+    run_start = run_end = None
+    for match in __incomplete_bytes__.finditer(bitmap):
+        byte_index = match.start()
+        if bitmap[byte_index] == 0:
+            runs = [(byte_index * 8, match.end() * 8)]
+        else:
+            # partly complete byte, look at its bits one by one
+            runs = [
+                (byte_index * 8 + bit_index, byte_index * 8 + bit_index + 1)
+                for bit_index in range(8)
+                if not (bitmap[byte_index] >> bit_index) & 1
+            ]
+        for start, end in runs:
+            # padding bits after the last chunk are never set
+            end = min(end, total_chunks)
+            if start >= end:
+                continue
+            if start == run_end:
+                run_end = end
+                continue
+            if run_end is not None:
+                yield run_start, run_end
+            run_start, run_end = start, end
+    if run_end is not None:
+        yield run_start, run_end
+
+
+def read_chunk_map(map_file):
+    """Header of a `.bmap` read with plain file I/O instead of a shared mapping,
+    as a dict with whether every chunk is marked, None when there is no map
+
+    For scans over every upload, which would otherwise map them all at once.
+    """
+    try:
+        with open(map_file, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    header_size, total_chunks, chunk_size, hash_mode, hash_type = parse_map_header(data)
+    bitmap_size = math.ceil(total_chunks / 8)
+    bitmap = data[header_size : header_size + bitmap_size]
+    return {
+        "total_chunks": total_chunks,
+        "chunk_size": chunk_size,
+        "hash_mode": hash_mode,
+        "hash_type": hash_type,
+        "complete": len(bitmap) == bitmap_size
+        and next(iter_incomplete_runs(bitmap, total_chunks), None) is None,
+    }
+
+
+class ChunkMap:
+    """A `.bmap` read and written with plain file I/O
+
+    For a single process owning the file, such as a download in progress:
+    unlike the server's BinaryChunkMapManager there is no shared mapping and
+    no lock between processes.
+    """
+
+    def __init__(self, filename, dir):
+        self.map_file = Path(dir) / f"{filename}.bmap"
+        self.header_size = MAP_HEADER_SIZE
+        self.total_chunks = None
+        self.chunk_size = None
+        self.hash_mode = "file"
+        self.hash_type = HASH_METHOD
+        try:
+            with open(self.map_file, "rb") as f:
+                header = f.read(MAP_HEADER_SIZE)
+        except FileNotFoundError:
+            return
+        (
+            self.header_size,
+            self.total_chunks,
+            self.chunk_size,
+            self.hash_mode,
+            self.hash_type,
+        ) = parse_map_header(header)
+
+    def initialize_map(
+        self, file_size, chunk_size, hash_mode="file", hash_type=HASH_METHOD
+    ):
+        """Start over with every chunk incomplete"""
+        total_chunks = math.ceil(file_size / chunk_size)
+        tmp_file = self.map_file.with_name(f"{self.map_file.name}.tmp")
+        with open(tmp_file, "wb") as f:
+            f.write(pack_map_header(total_chunks, chunk_size, hash_mode, hash_type))
+            f.write(bytes(math.ceil(total_chunks / 8)))
+        os.replace(tmp_file, self.map_file)
+        self.header_size = MAP_HEADER_SIZE
+        self.total_chunks = total_chunks
+        self.chunk_size = chunk_size
+        self.hash_mode = hash_mode
+        self.hash_type = hash_type
+
+    def mark_chunk(self, offset, complete=True):
+        chunk_index = offset // self.chunk_size
+        position = self.header_size + chunk_index // 8
+        fd = os.open(self.map_file, os.O_RDWR)
+        try:
+            (current_byte,) = os.pread(fd, 1, position)
+            if complete:
+                current_byte |= 1 << chunk_index % 8
+            else:
+                current_byte &= ~(1 << chunk_index % 8)
+            os.pwrite(fd, bytes([current_byte]), position)
+        finally:
+            os.close(fd)
+
+    def mark_all(self, complete=True):
+        bitmap_size = math.ceil(self.total_chunks / 8)
+        fd = os.open(self.map_file, os.O_WRONLY)
+        try:
+            os.pwrite(
+                fd, bytes([0xFF if complete else 0]) * bitmap_size, self.header_size
+            )
+        finally:
+            os.close(fd)
+
+    def iter_incomplete_runs(self):
+        with open(self.map_file, "rb") as f:
+            bitmap = os.pread(
+                f.fileno(), math.ceil(self.total_chunks / 8), self.header_size
+            )
+        return iter_incomplete_runs(bitmap, self.total_chunks)
+
+    def get_incomplete_chunks(self):
+        """Get list of incomplete chunk offsets"""
+        return [
+            i * self.chunk_size
+            for start, end in self.iter_incomplete_runs()
+            for i in range(start, end)
+        ]
+
+    def is_complete(self):
+        if self.chunk_size is None:
+            return False
+        return next(self.iter_incomplete_runs(), None) is None
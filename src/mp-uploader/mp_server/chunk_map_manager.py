@@ -0,0 +1,324 @@
+import fcntl
+import math
+import mmap
+import os
+import resource
+import threading
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+
+from . import HASH_METHOD
+from .chunk_map import (
+    MAP_HEADER_SIZE,
+    iter_incomplete_runs,
+    pack_map_header,
+    parse_map_header,
+)
+from .config import settings
+from .manifest import ChunkHashManifest
+from .metrics import timed
+from .utils import calculate_optimal_chunk_size, create_empty_file
+
+
+class SharedBitmap:
+    """A `.bmap` file mapped once per process and shared by every manager
+
+    Bit updates take the process-wide thread lock and an fcntl lock on the
+    single byte being changed, so read-modify-write is safe across threads
+    and across uvicorn worker processes mapping the same file.
+
+    The header is parsed once here, a map is never rewritten in place but
+    replaced, and then mapped again, so managers built per request copy it.
+    """
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDWR)
+        st = os.fstat(self.fd)
+        self.ino = st.st_ino
+        self.mm = mmap.mmap(self.fd, st.st_size)
+        self.lock = threading.Lock()
+        try:
+            (
+                self.header_size,
+                self.total_chunks,
+                self.chunk_size,
+                self.hash_mode,
+                self.hash_type,
+            ) = parse_map_header(self.mm)
+        except BaseException:
+            self.close()
+            raise
+
+    def update_byte(self, position, set_mask=0, clear_mask=0):
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, position, os.SEEK_SET)
+            try:
+                self.mm[position] = (self.mm[position] & ~clear_mask) | set_mask
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, position, os.SEEK_SET)
+
+    def update_bytes(self, masks):
+        """Apply {position: (set_mask, clear_mask)} under one lock on the span"""
+        if not masks:
+            return
+        first, last = min(masks), max(masks)
+        size = last - first + 1
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, size, first, os.SEEK_SET)
+            try:
+                for position, (set_mask, clear_mask) in masks.items():
+                    self.mm[position] = (self.mm[position] & ~clear_mask) | set_mask
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, size, first, os.SEEK_SET)
+
+    def fill(self, position, size, value):
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, size, position, os.SEEK_SET)
+            try:
+                self.mm[position : position + size] = bytes([value]) * size
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, size, position, os.SEEK_SET)
+
+    def close(self):
+        try:
+            self.mm.close()
+            os.close(self.fd)
+        except Exception:
+            pass
+
+    def __del__(self):
+        self.close()
+
+
+# most recently used mappings, kept open after their last manager is gone
+__shared_bitmaps__ = OrderedDict()
+# every mapping still held by a manager, so a file is never mapped twice
+__live_bitmaps__ = weakref.WeakValueDictionary()
+__shared_bitmaps_lock__ = threading.Lock()
+__shared_bitmaps_size__ = max(
+    1,
+    min(
+        settings.bitmap_cache_size,
+        resource.getrlimit(resource.RLIMIT_NOFILE)[0] // 8,
+    ),
+)
+
+
+def open_shared_bitmap(path):
+    """Get the process-wide mapping of `path`, remapping it if the file was replaced
+
+    Only the most recently used mappings are kept (settings.bitmap_cache_size),
+    an older one is closed (fd and mmap) as soon as no manager holds it.
+    """
+    key = str(path)
+    ino = os.stat(path).st_ino
+    with __shared_bitmaps_lock__:
+        bitmap = __live_bitmaps__.get(key)
+        if bitmap is None or bitmap.ino != ino:
+            # managers still holding the old mapping keep it alive until they finish
+            bitmap = SharedBitmap(path)
+            __live_bitmaps__[key] = bitmap
+        __shared_bitmaps__[key] = bitmap
+        __shared_bitmaps__.move_to_end(key)
+        while len(__shared_bitmaps__) > __shared_bitmaps_size__:
+            __shared_bitmaps__.popitem(last=False)
+        return bitmap
+
+
+def forget_shared_bitmap(path):
+    """Drop the mapping of a deleted `.bmap`, it is closed once unused"""
+    key = str(path)
+    with __shared_bitmaps_lock__:
+        __shared_bitmaps__.pop(key, None)
+        __live_bitmaps__.pop(key, None)
+
+
+class BinaryChunkMapManager:
+    def __init__(self, filename, dir):
+        dir = Path(dir)
+        self.map_file = dir / f"{filename}.bmap"
+        self.data_file = dir / filename
+        self.bitmap = None
+        self.lock = None
+        self.chunk_size = None
+        self.total_chunks = None
+        # "file": identity is the hash of the whole file,
+        # "tree": identity is the Merkle root of the chunk hashes
+        self.hash_mode = "file"
+        self.hash_type = HASH_METHOD
+        self.header_size = MAP_HEADER_SIZE
+        self.init()
+
+    def check_init(self):
+        assert self.chunk_size != None, Exception(
+            "Chunk size not initialized. Please call initialize_map() first."
+        )
+        return True
+
+    def init(self):
+        # if map file exists, then read chuck_size info from it
+        try:
+            self.bitmap = open_shared_bitmap(self.map_file)
+        except FileNotFoundError:
+            return
+        self.lock = self.bitmap.lock
+        # parsed once per mapping, not per manager
+        self.header_size = self.bitmap.header_size
+        self.total_chunks = self.bitmap.total_chunks
+        self.chunk_size = self.bitmap.chunk_size
+        self.hash_mode = self.bitmap.hash_mode
+        self.hash_type = self.bitmap.hash_type
+
+    def initialize_map(
+        self,
+        file_size,
+        chunk_size,
+        reinit=False,
+        hash_mode="file",
+        hash_type=HASH_METHOD,
+    ):
+        if self.map_file.exists() and not reinit:
+            return
+        """Initialize binary chunk map file with bitmap structure"""
+
+        total_chunks = math.ceil(file_size / chunk_size)
+        bitmap_size = math.ceil(total_chunks / 8)  # 8 bits per byte
+
+        # Create header
+        header = pack_map_header(total_chunks, chunk_size, hash_mode, hash_type)
+
+        # Create empty bitmap
+        bitmap = bytearray(bitmap_size)
+
+        # Write to a temporary file and swap it in, so processes that still
+        # map the old file never see it truncated under them
+        tmp_file = self.map_file.with_name(f"{self.map_file.name}.tmp")
+        with open(tmp_file, "wb") as f:
+            f.write(header)
+            f.write(bitmap)
+        os.replace(tmp_file, self.map_file)
+        self.init()
+
+    @timed("mark_chunk")
+    def mark_chunk(self, offset, complete=True):
+        self.check_init()
+        """Mark specific chunk as completed or incompleted in bitmap using direct offset writing"""
+        chunk_index = offset // self.chunk_size
+
+        # Calculate exact position of the bit in the bitmap
+        byte_index = chunk_index // 8
+        bit_index = chunk_index % 8
+
+        if complete:
+            # Set the specific bit to 1 (completed)
+            self.bitmap.update_byte(
+                self.header_size + byte_index, set_mask=1 << bit_index
+            )
+        else:
+            # Incomplete
+            self.bitmap.update_byte(
+                self.header_size + byte_index, clear_mask=1 << bit_index
+            )
+
+    @timed("mark_chunks")
+    def mark_chunks(self, offsets, complete=True):
+        self.check_init()
+        """Mark several chunks at once, each bitmap byte is written once"""
+        masks = {}
+        for offset in offsets:
+            chunk_index = offset // self.chunk_size
+            position = self.header_size + chunk_index // 8
+            masks[position] = masks.get(position, 0) | 1 << chunk_index % 8
+        self.bitmap.update_bytes(
+            {
+                position: (mask, 0) if complete else (0, mask)
+                for position, mask in masks.items()
+            }
+        )
+
+    def mark_all(self, complete=True):
+        self.check_init()
+        """Mark every chunk as completed or incompleted at once"""
+        bitmap_size = math.ceil(self.total_chunks / 8)
+        self.bitmap.fill(self.header_size, bitmap_size, 0xFF if complete else 0)
+
+    def get_chunk_status(self, offset):
+        self.check_init()
+        """Get chunk status (completed or incomplete)"""
+        chunk_index = offset // self.chunk_size
+
+        # Calculate exact position of the bit in the bitmap
+        byte_index = chunk_index // 8
+        bit_index = chunk_index % 8
+
+        # a single byte read from the shared mapping needs no lock
+        current_byte = self.bitmap.mm[self.header_size + byte_index]
+        return (current_byte >> bit_index) & 1
+
+    def iter_incomplete_runs(self):
+        self.check_init()
+        """Yield [start, end) chunk index runs of incomplete chunks"""
+        bitmap_size = math.ceil(self.total_chunks / 8)
+        return iter_incomplete_runs(
+            self.bitmap.mm[self.header_size : self.header_size + bitmap_size],
+            self.total_chunks,
+        )
+
+    @timed("get_incomplete_ranges")
+    def get_incomplete_ranges(self, file_size=None):
+        """Get incomplete chunks as [start_offset, end_offset) byte runs,
+        a run with the last chunk ends at file_size (the data file size
+        unless given)"""
+        chunk_size = self.chunk_size
+        if file_size is None:
+            try:
+                file_size = os.stat(self.data_file).st_size
+            except FileNotFoundError:
+                file_size = self.total_chunks * chunk_size
+        return [
+            [start * chunk_size, min(end * chunk_size, file_size)]
+            for start, end in self.iter_incomplete_runs()
+        ]
+
+    @timed("get_incomplete_chunks")
+    def get_incomplete_chunks(self):
+        """Get list of incomplete chunk offsets from bitmap"""
+        chunk_size = self.chunk_size
+        return [
+            i * chunk_size
+            for start, end in self.iter_incomplete_runs()
+            for i in range(start, end)
+        ]
+
+    def is_complete(self):
+        if self.chunk_size is None:
+            return False
+        """Check if all chunks are completed"""
+        return next(self.iter_incomplete_runs(), None) is None
+
+
+def setup_file_and_chunk_map(
+    filename, dir, size, chunk_size=None, hash_mode="file", hash_type=HASH_METHOD
+):
+    """Create the file, its chunk map and its chunk hash manifest simultaneously"""
+    if chunk_size is None:
+        chunk_size = calculate_optimal_chunk_size(size)
+
+    # Create sparse file
+    create_empty_file(filename, dir, size)
+
+    # Create chunk map manager
+    chunk_manager = BinaryChunkMapManager(filename, dir)
+
+    # # Initialize chunk map
+    chunk_manager.initialize_map(
+        size, chunk_size, hash_mode=hash_mode, hash_type=hash_type
+    )
+
+    # Initialize chunk hash manifest
+    ChunkHashManifest(filename, dir).initialize(
+        chunk_manager.total_chunks, hash_type=hash_type, reinit=True
+    )
+
+    return chunk_manager
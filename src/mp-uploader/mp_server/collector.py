@@ -0,0 +1,160 @@
+import asyncio
+import fcntl
+import logging
+import os
+import time
+from pathlib import Path
+
+from .chunk_map_manager import forget_shared_bitmap
+from .config import settings
+from .executor import run_io
+from .layout import fanout_dir
+from .metrics import active_uploads, count_evicted
+from .single_flight import invalidate_upload
+from .upload_index import UPLOAD_COMPLETED
+from .utils import has_free_space
+
+logger = logging.getLogger(__name__)
+
+# seconds between two last_active writes for one upload from one worker
+TOUCH_INTERVAL = 30
+
+
+class GarbageCollector:
+    """Evict abandoned uploads and account for the space uploads hold
+
+    Every upload commits its full file_size at /upload/init (preallocated or
+    sparse), completed uploads use it, the others reserve it. An incomplete
+    upload is removed with its sidecars once idle for settings.upload_ttl,
+    and when a new upload does not fit settings.upload_quota or the free
+    space of the volume, the least recently active incomplete uploads idle
+    for settings.gc_min_idle are removed first. Completed uploads are never
+    evicted, nor uploads with a chunk request running in this worker.
+
+    Collections hold `.gc.lock` in the upload directory, so workers never
+    evict at the same time.
+    """
+
+    def __init__(self, root, upload_index, chunk_index=None):
+        self.root = Path(root)
+        self.upload_index = upload_index
+        self.chunk_index = chunk_index
+        self.lock_file = self.root / ".gc.lock"
+        # file hash: time.monotonic() of its last last_active write
+        self.touched = {}
+        self.last_collect = None
+
+    async def touch(self, file_hash):
+        """Record activity on an upload, at most every TOUCH_INTERVAL"""
+        now = time.monotonic()
+        if now - self.touched.get(file_hash, -TOUCH_INTERVAL) < TOUCH_INTERVAL:
+            return
+        self.touched[file_hash] = now
+        await run_io(self.upload_index.touch, [file_hash])
+
+    def remove(self, file_hash):
+        """Delete an upload with its sidecars and index entries"""
+        dir = fanout_dir(self.root, file_hash)
+        for suffix in ("", ".bmap", ".manifest", ".digest"):
+            (dir / f"{file_hash}{suffix}").unlink(missing_ok=True)
+        forget_shared_bitmap(dir / f"{file_hash}.bmap")
+        self.upload_index.remove(file_hash)
+        if self.chunk_index is not None:
+            self.chunk_index.forget_file(file_hash)
+        self.touched.pop(file_hash, None)
+        invalidate_upload(file_hash)
+
+    def usage(self):
+        """Bytes used by completed uploads and reserved by the others"""
+        usage = self.upload_index.usage()
+        used = sum(
+            size for state, (_, size) in usage.items() if state == UPLOAD_COMPLETED
+        )
+        reserved = sum(
+            size for state, (_, size) in usage.items() if state != UPLOAD_COMPLETED
+        )
+        st = os.statvfs(self.root)
+        return {
+            "uploads": {state: count for state, (count, _) in usage.items()},
+            "used_bytes": used,
+            "reserved_bytes": reserved,
+            "committed_bytes": used + reserved,
+            "quota_bytes": settings.upload_quota or None,
+            "free_bytes": st.f_bavail * st.f_frsize,
+            "free_space_reserve": settings.free_space_reserve,
+            "upload_ttl": settings.upload_ttl or None,
+            "last_collect": self.last_collect,
+        }
+
+    def committed(self):
+        return sum(size for _, size in self.upload_index.usage().values())
+
+    def fits(self, size):
+        """Whether a new upload of `size` bytes fits the quota and the volume"""
+        if settings.upload_quota and self.committed() + size > settings.upload_quota:
+            return False
+        return has_free_space(self.root, size)
+
+    def make_room(self, size):
+        """Evict what is needed for a new upload of `size` bytes,
+        False when it still does not fit"""
+        if self.fits(size):
+            return True
+        self.collect(size)
+        return self.fits(size)
+
+    def collect(self, size=0):
+        """Evict expired uploads, then idle ones until `size` more bytes fit,
+        returns the evicted file hashes"""
+        evicted = []
+        with open(self.lock_file, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            now = time.time()
+            active = active_uploads()
+            if settings.upload_ttl:
+                for upload in self.upload_index.idle(now - settings.upload_ttl):
+                    if upload["file_hash"] not in active:
+                        self.remove(upload["file_hash"])
+                        evicted.append(upload["file_hash"])
+            if not self.fits(size):
+                candidates = [
+                    upload
+                    for upload in self.upload_index.idle(now - settings.gc_min_idle)
+                    if upload["file_hash"] not in active
+                ]
+                # evicting is pointless when all of them would not be enough
+                if self.room_after(candidates, size):
+                    for upload in candidates:
+                        self.remove(upload["file_hash"])
+                        evicted.append(upload["file_hash"])
+                        if self.fits(size):
+                            break
+        # forget uploads not written to lately, they are touched again if needed
+        for file_hash, touched in list(self.touched.items()):
+            if time.monotonic() - touched >= TOUCH_INTERVAL:
+                self.touched.pop(file_hash, None)
+        self.last_collect = {"time": now, "evicted": len(evicted)}
+        count_evicted(len(evicted))
+        if evicted:
+            logger.info(f"{self.root}: evicted {len(evicted)} uploads")
+        return evicted
+
+    def room_after(self, candidates, size):
+        freed = sum(upload["file_size"] for upload in candidates)
+        if (
+            settings.upload_quota
+            and self.committed() - freed + size > settings.upload_quota
+        ):
+            return False
+        st = os.statvfs(self.root)
+        # sparse uploads free less than their size, this is an upper bound
+        return st.f_bavail * st.f_frsize + freed >= size + settings.free_space_reserve
+
+    async def run_forever(self, interval):
+        """Collect every `interval` seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_io(self.collect)
+            except Exception:
+                logger.exception(f"{self.root}: garbage collection failed")
@@ -0,0 +1,109 @@
+import os
+
+from pydantic_settings import BaseSettings
+
+from . import PROJ_ROOT
+
+
+class Settings(BaseSettings):
+    # where uploads, chunk maps and manifests are stored
+    upload_dir: str = os.getenv("MP_UPLOAD_DIR", str(PROJ_ROOT / "upload"))
+    # uploads are stored under ab/cd/<hash>, levels x width leading hash
+    # characters, changing these migrates the directory on the next start
+    fanout_levels: int = int(os.getenv("MP_FANOUT_LEVELS", 2))
+    fanout_width: int = int(os.getenv("MP_FANOUT_WIDTH", 2))
+
+    # thread pool for blocking file and bitmap I/O
+    io_workers: int = int(os.getenv("MP_IO_WORKERS", 8))
+    # `.bmap` files kept mapped once unused, each holds two fds (mmap dups
+    # its own) so at most an eighth of the open file limit is used
+    bitmap_cache_size: int = int(os.getenv("MP_BITMAP_CACHE_SIZE", 64))
+
+    # pool for hashing, "thread" or "process"
+    # hashlib releases the GIL for large buffers, so threads already scale
+    hash_pool: str = os.getenv("MP_HASH_POOL", "thread")
+    hash_workers: int = int(os.getenv("MP_HASH_WORKERS", os.cpu_count() or 4))
+
+    # per-upload chunk size, see calculate_optimal_chunk_size
+    min_chunk_size: int = int(os.getenv("MP_MIN_CHUNK_SIZE", 1024 * 1024))
+    max_chunk_size: int = int(os.getenv("MP_MAX_CHUNK_SIZE", 512 * 1024 * 1024))
+    target_chunks: int = int(os.getenv("MP_TARGET_CHUNKS", 1024))
+    chunk_seconds: float = float(os.getenv("MP_CHUNK_SECONDS", 10))
+
+    # hash types a client may pick at /upload/init, from hashlib;
+    # benchmark.hash_bench measures them, sha1 and sha256 (SHA-NI) hash about
+    # equally fast in memory, sha256 is a little faster from disk, blake2b
+    # and blake2s run at half that or less, so sha256 is the default
+    allowed_hash_types: list[str] = os.getenv(
+        "MP_ALLOWED_HASH_TYPES", "sha256,blake2b,blake2s,sha1"
+    ).split(",")
+
+    # look up chunks already stored by other uploads when a client sends
+    # its chunk hashes to /upload/init, see ChunkIndex
+    chunk_dedup: bool = os.getenv("MP_CHUNK_DEDUP", "true").lower() == "true"
+
+    # smallest block of a delta upload signature, see signature_block_size
+    min_delta_block_size: int = int(os.getenv("MP_MIN_DELTA_BLOCK_SIZE", 4096))
+
+    # bytes buffered from a streamed body before one write is handed to the pool
+    write_buffer_size: int = int(os.getenv("MP_WRITE_BUFFER_SIZE", 1024 * 1024))
+
+    # record hot-path timings and byte counts for /metrics
+    metrics: bool = os.getenv("MP_METRICS", "true").lower() == "true"
+
+    # how upload targets are created, "fallocate" (posix_fallocate, sparse
+    # where unsupported) or "sparse", see create_empty_file
+    preallocate: str = os.getenv("MP_PREALLOCATE", "fallocate")
+    # bytes that must stay free on the upload volume after an /upload/init
+    free_space_reserve: int = int(os.getenv("MP_FREE_SPACE_RESERVE", 64 * 1024 * 1024))
+
+    # when chunk data is made durable before its bit is set in the `.bmap`,
+    # "none" (left to the page cache), "chunk" (fdatasync per chunk request)
+    # or "group" (one fdatasync per file every group_commit_ms)
+    durability: str = os.getenv("MP_DURABILITY", "group")
+    group_commit_ms: float = float(os.getenv("MP_GROUP_COMMIT_MS", 5))
+
+    # incomplete uploads idle for upload_ttl seconds are removed (0 keeps
+    # them), and the least recently active ones make room when a new upload
+    # would pass upload_quota bytes of all uploads (0 for none) or the free
+    # space, see GarbageCollector
+    upload_ttl: float = float(os.getenv("MP_UPLOAD_TTL", 7 * 24 * 60 * 60))
+    upload_quota: int = int(os.getenv("MP_UPLOAD_QUOTA", 0))
+    # seconds an upload must be idle before it is evicted to make room
+    gc_min_idle: float = float(os.getenv("MP_GC_MIN_IDLE", 5 * 60))
+    # seconds between collections of expired uploads
+    gc_interval: float = float(os.getenv("MP_GC_INTERVAL", 10 * 60))
+
+    # seconds /download/init and /download/chunk-hashes results are kept
+    # for identical requests (0 only shares computations in flight), and
+    # how many are kept, see SingleFlight
+    coalesce_ttl: float = float(os.getenv("MP_COALESCE_TTL", 2))
+    coalesce_max_entries: int = int(os.getenv("MP_COALESCE_MAX_ENTRIES", 1024))
+
+    # chunk writes (/upload/chunk, /upload/chunk/raw, /upload/chunks and
+    # /upload/delta) running at once and their Content-Length bytes, over
+    # all uploads and per file_hash, 0 for no limit, see AdmissionController
+    admission_max_writes: int = int(os.getenv("MP_ADMISSION_MAX_WRITES", 64))
+    admission_max_bytes: int = int(
+        os.getenv("MP_ADMISSION_MAX_BYTES", 1024 * 1024 * 1024)
+    )
+    admission_max_file_writes: int = int(os.getenv("MP_ADMISSION_MAX_FILE_WRITES", 16))
+    admission_max_file_bytes: int = int(
+        os.getenv("MP_ADMISSION_MAX_FILE_BYTES", 256 * 1024 * 1024)
+    )
+    # seconds a write over the limits waits for room before it is answered
+    # 503, and the Retry-After seconds sent with it
+    admission_wait: float = float(os.getenv("MP_ADMISSION_WAIT", 0.25))
+    admission_retry_after: int = int(os.getenv("MP_ADMISSION_RETRY_AFTER", 1))
+
+    # background re-verification of completed uploads, see Scrubber
+    # seconds between passes (0 runs only on POST /scrub/start), chunks
+    # hashed at once, and bytes read per second (0 for no limit)
+    scrub_interval: float = float(os.getenv("MP_SCRUB_INTERVAL", 24 * 60 * 60))
+    scrub_workers: int = int(os.getenv("MP_SCRUB_WORKERS", os.cpu_count() or 4))
+    scrub_bytes_per_second: int = int(
+        os.getenv("MP_SCRUB_BYTES_PER_SECOND", 64 * 1024 * 1024)
+    )
+
+
+settings = Settings()
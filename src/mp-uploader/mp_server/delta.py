@@ -0,0 +1,153 @@
+import hashlib
+import math
+import os
+import struct
+import zlib
+
+from . import HASH_METHOD
+from .config import settings
+from .executor import run_io
+from .framing import FrameReader, FramingError
+from .utils import HASH_BUFFER_SIZE, buffer_stream, copy_range, pwrite_all
+
+ADLER_MOD = 65521
+
+# op, first base block (copy) or 0 (data), block count (copy) or payload length
+DELTA_OP = struct.Struct("!BQQ")
+DELTA_COPY = 0
+DELTA_DATA = 1
+
+
+def signature_block_size(file_size):
+    """rsync's rule of thumb, about sqrt(file_size), as a power of two"""
+    block_size = 1 << max(math.isqrt(file_size) - 1, 0).bit_length()
+    return max(settings.min_delta_block_size, min(block_size, HASH_BUFFER_SIZE))
+
+
+def file_signature(filename, block_size, hash_type=HASH_METHOD):
+    """[weak, strong] checksums of each block of a file, the last one may be short
+
+    The weak checksum is adler32, which the client can roll over its data one
+    byte at a time, the strong one confirms a weak match.
+    """
+    signature = []
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            signature.append(
+                [zlib.adler32(block), hashlib.new(hash_type, block).hexdigest()]
+            )
+    return signature
+
+
+def compute_delta(data, signature, block_size, hash_type=HASH_METHOD):
+    """Client side: describe `data` as base blocks to copy and literal bytes
+
+    Returns ops, ("copy", first_block, count) or ("data", bytes).
+    A pure-Python reference, it rolls the checksum one byte at a time.
+    """
+    blocks = {}
+    for index, (weak, strong) in enumerate(signature):
+        blocks.setdefault(weak, []).append((index, strong))
+    last_block = len(signature) - 1
+
+    def match(start, end):
+        candidates = blocks.get(zlib.adler32(data[start:end]))
+        if not candidates:
+            return None
+        strong = hashlib.new(hash_type, data[start:end]).hexdigest()
+        for index, block_strong in candidates:
+            # only the last base block may be shorter than block_size
+            if block_strong == strong and (
+                end - start == block_size or index == last_block
+            ):
+                return index
+        return None
+
+    ops, literal_start, position, size = [], 0, 0, len(data)
+
+    def emit(op):
+        if op[0] == "copy" and ops and ops[-1][0] == "copy":
+            _, first, count = ops[-1]
+            if first + count == op[1]:
+                ops[-1] = ("copy", first, count + op[2])
+                return
+        ops.append(op)
+
+    weak = None
+    while position + block_size <= size:
+        if weak is None:
+            weak = zlib.adler32(data[position : position + block_size])
+        index = None
+        if weak in blocks:
+            index = match(position, position + block_size)
+        if index is not None:
+            if literal_start < position:
+                emit(("data", data[literal_start:position]))
+            emit(("copy", index, 1))
+            position += block_size
+            literal_start, weak = position, None
+            continue
+        if position + block_size == size:
+            break
+        # roll the window one byte forward
+        a, b = weak & 0xFFFF, weak >> 16
+        out_byte, in_byte = data[position], data[position + block_size]
+        a = (a - out_byte + in_byte) % ADLER_MOD
+        b = (b - block_size * out_byte + a - 1) % ADLER_MOD
+        weak = (b << 16) | a
+        position += 1
+
+    # the tail may still be the short last block of the base
+    tail = size - literal_start
+    if 0 < tail < block_size and match(literal_start, size) == last_block:
+        emit(("copy", last_block, 1))
+        literal_start = size
+    if literal_start < size:
+        emit(("data", data[literal_start:]))
+    return ops
+
+
+def encode_delta(ops):
+    """Delta body of ops from compute_delta, ops are simply concatenated"""
+    for op in ops:
+        if op[0] == "copy":
+            yield DELTA_OP.pack(DELTA_COPY, op[1], op[2])
+        else:
+            yield DELTA_OP.pack(DELTA_DATA, 0, len(op[1]))
+            yield op[1]
+
+
+async def apply_delta(stream, base_file, filename, block_size, file_size):
+    """Server side: write `filename` from the base file and a delta body,
+    returns the size of the rebuilt file
+
+    Raises FramingError before writing anything past `file_size`, so a
+    delta can never use more space than was made room for."""
+    reader = FrameReader(stream)
+    base_size = (await run_io(os.stat, base_file)).st_size
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    position = 0
+    try:
+        while await reader.fill(1):
+            op, first, length = DELTA_OP.unpack(await reader.read_exact(DELTA_OP.size))
+            if op == DELTA_COPY:
+                start = first * block_size
+                if not length or start >= base_size:
+                    raise FramingError("Copy outside the base file")
+                size = min(length * block_size, base_size - start)
+            elif op == DELTA_DATA:
+                size = length
+            else:
+                raise FramingError(f"Unknown delta op {op}")
+            if position + size > file_size:
+                raise FramingError("Delta larger than the file")
+            if op == DELTA_COPY:
+                await run_io(copy_range, base_file, start, filename, position, size)
+                position += size
+            else:
+                async for pieces, size in buffer_stream(reader.iter_payload(length)):
+                    await run_io(pwrite_all, fd, pieces, position)
+                    position += size
+    finally:
+        os.close(fd)
+    return position
@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from . import HASH_METHOD
+from .chunk_map import read_chunk_map
+from .manifest import ChunkHashManifest
+from .utils import calculate_hash
+
+
+class VerifiedDigestRecord:
+    """Persistent whole-file digest stored next to the `.bmap`
+
+    The record is keyed on (inode, size, mtime) of the data file, so it stays
+    valid until the file is replaced or written to again.
+    """
+
+    def __init__(self, filename, dir):
+        self.record_file = Path(dir) / f"{filename}.digest"
+        self.data_file = Path(dir) / filename
+
+    def stat_key(self):
+        st = os.stat(self.data_file)
+        return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+    def load(self, hash_type=HASH_METHOD):
+        """Return the recorded digest if it still matches the data file, else None"""
+        try:
+            with open(self.record_file, "r") as f:
+                record = json.load(f)
+            key = self.stat_key()
+        except (OSError, ValueError):
+            return None
+        if record.get("key") != key or record.get("hash_type") != hash_type:
+            return None
+        return record.get("digest")
+
+    def store(self, digest, hash_type=HASH_METHOD, key=None):
+        """Write the record atomically, `key` defaults to the current file stat"""
+        record = {
+            "key": key if key is not None else self.stat_key(),
+            "hash_type": hash_type,
+            "digest": digest,
+        }
+        # a temp file of its own, concurrent stores of one record must not
+        # replace each other's temp file
+        fd, tmp_file = tempfile.mkstemp(
+            prefix=f"{self.record_file.name}.",
+            suffix=".tmp",
+            dir=self.record_file.parent,
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(record, f)
+            os.replace(tmp_file, self.record_file)
+        except BaseException:
+            os.unlink(tmp_file)
+            raise
+
+    def invalidate(self):
+        self.record_file.unlink(missing_ok=True)
+
+
+def digest_record_type(hash_type=HASH_METHOD, hash_mode="file"):
+    """What a digest record holds, so a tree root is never taken for a file hash"""
+    return hash_type if hash_mode == "file" else f"{hash_mode}:{hash_type}"
+
+
+def verified_file_hash(filename, dir, hash_type=HASH_METHOD, hash_mode="file"):
+    """Get the whole-file digest, only rehashing when no valid record exists
+
+    In "tree" mode the digest is the Merkle root of the chunk hash manifest,
+    so nothing is reread from the data file, and None is returned while a
+    chunk digest is still missing.
+    """
+    record = VerifiedDigestRecord(filename, dir)
+    record_type = digest_record_type(hash_type, hash_mode)
+    digest = record.load(record_type)
+    if digest is None:
+        # take the key before hashing, so a write during hashing invalidates it
+        key = record.stat_key()
+        if hash_mode == "tree":
+            header = read_chunk_map(Path(dir) / f"{filename}.bmap")
+            if header is None:
+                return None
+            digest = ChunkHashManifest(filename, dir).merkle_root(
+                key[1], header["chunk_size"]
+            )
+            if digest is None:
+                return None
+        else:
+            digest = calculate_hash(record.data_file, hash_type=hash_type)
+        record.store(digest, record_type, key=key)
+    return digest
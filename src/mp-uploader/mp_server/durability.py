@@ -0,0 +1,65 @@
+import asyncio
+import os
+import time
+
+from .config import settings
+from .executor import run_io
+from .metrics import record
+
+
+def fdatasync_file(filename):
+    """Flush the data of a file to disk, whoever wrote it and through which fd"""
+    start = time.perf_counter()
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fdatasync(fd)
+    finally:
+        os.close(fd)
+    record("fdatasync", time.perf_counter() - start)
+
+
+class GroupCommit:
+    """Share one fdatasync per file between every caller of a time window
+
+    The first caller opens a group and the sync runs `interval` seconds later.
+    A group is detached before its sync starts, so the writes of everyone
+    waiting on it were finished before the fdatasync began, later callers
+    open the next group.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.groups = {}
+
+    async def sync(self, filename):
+        key = str(filename)
+        future = self.groups.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self.groups[key] = loop.create_future()
+            loop.call_later(
+                self.interval, lambda: asyncio.ensure_future(self.commit(key))
+            )
+        # a cancelled waiter must not cancel the sync of the others
+        await asyncio.shield(future)
+
+    async def commit(self, key):
+        future = self.groups.pop(key)
+        try:
+            await run_io(fdatasync_file, key)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+
+
+__group_commit__ = GroupCommit(settings.group_commit_ms / 1000)
+
+
+async def sync_data(filename):
+    """Make written chunks of `filename` durable before their bits are set,
+    as settings.durability asks"""
+    if settings.durability == "chunk":
+        await run_io(fdatasync_file, filename)
+    elif settings.durability == "group":
+        await __group_commit__.sync(filename)
@@ -0,0 +1,38 @@
+import asyncio
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .config import settings
+
+io_executor = ThreadPoolExecutor(
+    max_workers=settings.io_workers, thread_name_prefix="mp-io"
+)
+
+if settings.hash_pool == "process":
+    # arguments and results must be picklable, so pass file names, not file objects
+    hash_executor = ProcessPoolExecutor(max_workers=settings.hash_workers)
+else:
+    hash_executor = ThreadPoolExecutor(
+        max_workers=settings.hash_workers, thread_name_prefix="mp-hash"
+    )
+
+
+async def run_io(func, *args, **kwargs):
+    """Run blocking file or bitmap I/O on the I/O thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        io_executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+async def run_hash(func, *args, **kwargs):
+    """Run hashing on the hash pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        hash_executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+def shutdown_executors(wait=True):
+    io_executor.shutdown(wait=wait)
+    hash_executor.shutdown(wait=wait)
@@ -0,0 +1,88 @@
+import struct
+
+# offset, payload length, chunk hash length, all big-endian,
+# followed by the ascii chunk hash and then the payload
+FRAME_HEADER = struct.Struct("!QQB")
+
+
+class FramingError(Exception):
+    pass
+
+
+def encode_frame_header(offset, chunk_hash, length):
+    chunk_hash = chunk_hash.encode()
+    return FRAME_HEADER.pack(offset, length, len(chunk_hash)) + chunk_hash
+
+
+def encode_frame(offset, chunk_hash, data):
+    """One chunk of a batch upload body, frames are simply concatenated"""
+    return encode_frame_header(offset, chunk_hash, len(data)) + data
+
+
+class FrameReader:
+    """Read chunk frames from an async stream of byte pieces
+
+    Only a frame header is ever buffered as a whole, payloads are handed on
+    piece by piece, so a batch body is never held in memory.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream.__aiter__()
+        # unread bytes are self.buffer[self.position:], kept as an index so a
+        # large body piece is not copied again for every frame taken from it
+        self.buffer = b""
+        self.position = 0
+        self.eof = False
+
+    def buffered(self):
+        return len(self.buffer) - self.position
+
+    async def fill(self, size):
+        """Buffer at least `size` bytes, False if the stream ends first"""
+        while self.buffered() < size and not self.eof:
+            try:
+                data = await self.stream.__anext__()
+            except StopAsyncIteration:
+                self.eof = True
+                break
+            if self.position:
+                self.buffer = self.buffer[self.position :]
+                self.position = 0
+            self.buffer = self.buffer + data if self.buffer else data
+        return self.buffered() >= size
+
+    def take(self, size):
+        data = self.buffer[self.position : self.position + size]
+        self.position += len(data)
+        return data
+
+    async def read_exact(self, size):
+        if not await self.fill(size):
+            raise FramingError("Body ended inside a frame header")
+        return self.take(size)
+
+    async def next_frame(self):
+        """Return (offset, chunk_hash, length) of the next frame, None at the end"""
+        if not await self.fill(1):
+            return None
+        offset, length, hash_length = FRAME_HEADER.unpack(
+            await self.read_exact(FRAME_HEADER.size)
+        )
+        try:
+            chunk_hash = (await self.read_exact(hash_length)).decode()
+        except UnicodeDecodeError:
+            raise FramingError("Chunk hash is not ascii")
+        return offset, chunk_hash, length
+
+    async def iter_payload(self, length):
+        """Yield the `length` payload bytes of the current frame"""
+        while length:
+            if not self.buffered() and not await self.fill(1):
+                raise FramingError("Body ended inside a frame payload")
+            data = self.take(length)
+            length -= len(data)
+            yield data
+
+    async def skip_payload(self, length):
+        async for _ in self.iter_payload(length):
+            pass
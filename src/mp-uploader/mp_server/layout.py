@@ -0,0 +1,224 @@
+import fcntl
+import json
+import logging
+import os
+from pathlib import Path
+
+from . import HASH_METHOD
+from .chunk_map import read_chunk_map
+from .chunk_map_manager import BinaryChunkMapManager
+from .config import settings
+from .digest_record import (
+    VerifiedDigestRecord,
+    digest_record_type,
+    verified_file_hash,
+)
+from .manifest import ChunkHashManifest
+from .upload_index import (
+    UPLOAD_BAD_FILE,
+    UPLOAD_COMPLETED,
+    UPLOAD_INCOMPLETE,
+    UPLOAD_UNVERIFIED,
+)
+from .utils import calculate_optimal_chunk_size
+
+logger = logging.getLogger(__name__)
+
+# records the layout of an upload directory, see prepare_upload_dir
+LAYOUT_FILE = ".layout"
+# held by the worker running verify_uploads
+VERIFY_LOCK_FILE = ".verify.lock"
+
+# databases kept at the top of the upload directory, never fanned out
+INDEX_NAMES = ("chunk_index", "upload_index")
+
+
+def fanout_dir(root, name, levels=None, width=None):
+    """Directory of an upload under `root`, `ab/cd/` for a name starting with
+    abcd, so no directory grows past 16**(2*width) entries"""
+    levels = settings.fanout_levels if levels is None else levels
+    width = settings.fanout_width if width is None else width
+    parts = [name[level * width : (level + 1) * width] for level in range(levels)]
+    return Path(root, *(part for part in parts if part))
+
+
+def current_layout():
+    return {
+        "fanout_levels": settings.fanout_levels,
+        "fanout_width": settings.fanout_width,
+    }
+
+
+def upload_files(root):
+    """Yield (directory, file name) of every data file and sidecar under `root`"""
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            # temporary files of writes in progress start with a dot
+            if filename.startswith(".") or filename.split(".")[0] in INDEX_NAMES:
+                continue
+            yield Path(dirpath), filename
+
+
+def migrate_layout(root):
+    """Move every data file with its `.bmap`, `.manifest` and `.digest` to its
+    fan-out directory, from the flat layout or an older fan-out, returns the
+    number of files moved"""
+    root = Path(root)
+    moved = 0
+    for dir, filename in list(upload_files(root)):
+        target = fanout_dir(root, filename.split(".")[0])
+        if dir == target:
+            continue
+        target.mkdir(parents=True, exist_ok=True)
+        try:
+            # a rename keeps the inode, so digest records stay valid
+            os.rename(dir / filename, target / filename)
+            moved += 1
+        except FileNotFoundError:
+            pass
+    # drop directories the move left empty
+    for dirpath, _, _ in os.walk(root, topdown=False):
+        if Path(dirpath) != root:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
+    return moved
+
+
+def index_uploads(root, upload_index):
+    """Rebuild the upload index from the chunk maps under `root`
+
+    Map headers are read with struct rather than through shared mappings,
+    and nothing is hashed, as this runs at import: a complete upload is
+    completed or bad_file when its digest record says so, else unverified,
+    like a file stored without a chunk map, until verify_uploads hashes it.
+    """
+    uploads = []
+    for dir, filename in upload_files(root):
+        if "." in filename:
+            continue
+        st = os.stat(dir / filename)
+        file_size = st.st_size
+        map_file = dir / f"{filename}.bmap"
+        header = read_chunk_map(map_file)
+        if header is None:
+            uploads.append(
+                (
+                    filename,
+                    file_size,
+                    calculate_optimal_chunk_size(file_size),
+                    HASH_METHOD,
+                    "file",
+                    UPLOAD_UNVERIFIED,
+                    st.st_mtime,
+                )
+            )
+            continue
+        if not header["complete"]:
+            state = UPLOAD_INCOMPLETE
+        else:
+            digest = VerifiedDigestRecord(filename, dir).load(
+                digest_record_type(header["hash_type"], header["hash_mode"])
+            )
+            if digest is None:
+                state = UPLOAD_UNVERIFIED
+            elif digest == filename:
+                state = UPLOAD_COMPLETED
+            else:
+                state = UPLOAD_BAD_FILE
+        uploads.append(
+            (
+                filename,
+                file_size,
+                header["chunk_size"],
+                header["hash_type"],
+                header["hash_mode"],
+                state,
+                # last written, the chunk map changes with every chunk
+                max(st.st_mtime, os.stat(map_file).st_mtime),
+            )
+        )
+    upload_index.put_many(uploads)
+    return len(uploads)
+
+
+def verify_upload(root, upload_index, upload):
+    """Hash an unverified upload and settle its state, returns the state
+
+    A file stored without a chunk map is taken in as init_download used to:
+    once its hash is verified it gets a complete chunk map and manifest.
+    """
+    file_hash = upload["file_hash"]
+    dir = fanout_dir(root, file_hash)
+    current = upload_index.get(file_hash)
+    if current is None or current["state"] != UPLOAD_UNVERIFIED:
+        # restarted or removed since it was listed
+        return None if current is None else current["state"]
+    digest = verified_file_hash(
+        file_hash, dir, upload["hash_type"], upload["hash_mode"]
+    )
+    if digest != file_hash:
+        state = UPLOAD_BAD_FILE
+    else:
+        state = UPLOAD_COMPLETED
+        if read_chunk_map(dir / f"{file_hash}.bmap") is None:
+            chunk_manager = BinaryChunkMapManager(file_hash, dir)
+            chunk_manager.initialize_map(upload["file_size"], upload["chunk_size"])
+            chunk_manager.mark_all(complete=True)
+            ChunkHashManifest(file_hash, dir).initialize(
+                chunk_manager.total_chunks, reinit=True
+            )
+    upload_index.set_state(file_hash, state)
+    return state
+
+
+def verify_uploads(root, upload_index):
+    """Verify every unverified upload, returns how many were verified, or
+    None when another worker is at it"""
+    root = Path(root)
+    with open(root / VERIFY_LOCK_FILE, "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        verified = 0
+        for upload in upload_index.list(UPLOAD_UNVERIFIED):
+            try:
+                verify_upload(root, upload_index, upload)
+            except FileNotFoundError:
+                # removed since it was indexed
+                continue
+            verified += 1
+    if verified:
+        logger.info(f"{root}: verified {verified} uploads")
+    return verified
+
+
+def prepare_upload_dir(root, upload_index):
+    """Bring an upload directory to the configured layout, once
+
+    Runs at startup under an exclusive lock, so of several workers one
+    migrates and the others wait and find the layout already current. The
+    upload index is rebuilt after a migration, or when it is missing or of
+    an older schema.
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    layout_file = root / LAYOUT_FILE
+    with open(root / f"{LAYOUT_FILE}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            layout = json.loads(layout_file.read_text())
+        except (OSError, ValueError):
+            layout = None
+        if layout != current_layout():
+            moved = migrate_layout(root)
+            logger.info(f"{root}: moved {moved} files to {current_layout()}")
+        if layout != current_layout() or not upload_index.current():
+            upload_index.reset()
+            indexed = index_uploads(root, upload_index)
+            logger.info(f"{root}: indexed {indexed} uploads")
+        tmp_file = layout_file.with_name(f"{LAYOUT_FILE}.tmp")
+        tmp_file.write_text(json.dumps(current_layout()))
+        os.replace(tmp_file, layout_file)
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import struct
+from pathlib import Path
+
+from . import HASH_METHOD
+
+# RFC 6962 domain separation, so no chunk can pass for an inner node, and a
+# last prefix for the file identity over the root
+MERKLE_LEAF, MERKLE_NODE, MERKLE_FILE = b"\x00", b"\x01", b"\x02"
+
+
+def merkle_root(digests, file_size, chunk_size, hash_type=HASH_METHOD) -> str:
+    """File identity from raw chunk digests, over an RFC 6962 Merkle tree
+
+    A leaf hashes 0x00 and a chunk digest, a node 0x01 and its two children,
+    and the left child of a node spans the largest power of two of leaves
+    below its count. The root is hashed with 0x02, the file size and the
+    chunk size, so the same digests cut another way are another file.
+    """
+    leaves = [
+        hashlib.new(hash_type, MERKLE_LEAF + digest).digest() for digest in digests
+    ]
+
+    def node(first, last):
+        if last - first == 1:
+            return leaves[first]
+        split = first + (1 << (last - first - 1).bit_length() - 1)
+        return hashlib.new(
+            hash_type, MERKLE_NODE + node(first, split) + node(split, last)
+        ).digest()
+
+    root = node(0, len(leaves)) if leaves else hashlib.new(hash_type).digest()
+    return hashlib.new(
+        hash_type, MERKLE_FILE + struct.pack(">QQ", file_size, chunk_size) + root
+    ).hexdigest()
+
+
+class ChunkHashManifest:
+    """Binary manifest of per-chunk digests stored next to the `.bmap`
+
+    A fixed header is followed by one digest slot per chunk, so a digest is
+    read or written with a single pread/pwrite. An all-zero slot means the
+    chunk digest was not recorded yet.
+    """
+
+    def __init__(self, filename, dir):
+        self.manifest_file = Path(dir) / f"{filename}.manifest"
+        self.magic_number = 0xC4A5F1  # Chunk hASh maniFest identifier
+        # magic_number, total_chunks, digest_size, hash_type
+        self.header_format = "QQQ16s"
+        self.header_size = struct.calcsize(self.header_format)
+        self.total_chunks = None
+        self.digest_size = None
+        self.hash_type = None
+        self.init()
+
+    def init(self):
+        try:
+            with open(self.manifest_file, "rb") as f:
+                header_data = f.read(self.header_size)
+        except FileNotFoundError:
+            return
+        magic, total_chunks, digest_size, hash_type = struct.unpack(
+            self.header_format, header_data
+        )
+        assert magic == self.magic_number, Exception(
+            "Invalid chunk hash manifest file. Please check the file."
+        )
+        self.total_chunks = total_chunks
+        self.digest_size = digest_size
+        self.hash_type = hash_type.rstrip(b"\0").decode()
+
+    def exists(self):
+        return self.total_chunks is not None
+
+    def initialize(self, total_chunks, hash_type=HASH_METHOD, reinit=False):
+        """Create an empty manifest with one zeroed slot per chunk"""
+        if self.manifest_file.exists() and not reinit:
+            return
+        digest_size = hashlib.new(hash_type).digest_size
+        header = struct.pack(
+            self.header_format,
+            self.magic_number,
+            total_chunks,
+            digest_size,
+            hash_type.encode(),
+        )
+        tmp_file = self.manifest_file.with_name(f"{self.manifest_file.name}.tmp")
+        with open(tmp_file, "wb") as f:
+            f.write(header)
+            f.truncate(self.header_size + total_chunks * digest_size)
+        os.replace(tmp_file, self.manifest_file)
+        self.init()
+
+    def slot_position(self, index):
+        assert 0 <= index < self.total_chunks, Exception(
+            f"Chunk index {index} out of range"
+        )
+        return self.header_size + index * self.digest_size
+
+    def set_digest(self, index, hexdigest):
+        """Record the digest of one chunk, slots never overlap so no lock is needed"""
+        digest = bytes.fromhex(hexdigest)
+        assert len(digest) == self.digest_size, Exception("Digest size mismatch")
+        fd = os.open(self.manifest_file, os.O_WRONLY)
+        try:
+            os.pwrite(fd, digest, self.slot_position(index))
+        finally:
+            os.close(fd)
+
+    def set_digests(self, digests):
+        """Record {index: hexdigest} for several chunks with one open"""
+        fd = os.open(self.manifest_file, os.O_WRONLY)
+        try:
+            for index, hexdigest in digests.items():
+                digest = bytes.fromhex(hexdigest)
+                assert len(digest) == self.digest_size, Exception(
+                    "Digest size mismatch"
+                )
+                os.pwrite(fd, digest, self.slot_position(index))
+        finally:
+            os.close(fd)
+
+    def clear_digest(self, index):
+        fd = os.open(self.manifest_file, os.O_WRONLY)
+        try:
+            os.pwrite(fd, bytes(self.digest_size), self.slot_position(index))
+        finally:
+            os.close(fd)
+
+    def read_slots(self, first=0, last=None):
+        """Read digest slots [first, last] with one read, missing digests are None"""
+        last = self.total_chunks - 1 if last is None else last
+        if last < first:
+            return []
+        size = (last - first + 1) * self.digest_size
+        with open(self.manifest_file, "rb") as f:
+            table = os.pread(f.fileno(), size, self.slot_position(first))
+        empty = bytes(self.digest_size)
+        slots = []
+        for position in range(0, size, self.digest_size):
+            digest = table[position : position + self.digest_size]
+            slots.append(None if digest == empty or not digest else digest)
+        return slots
+
+    def get_digests(self, indexes=None):
+        """Map chunk index to hex digest, for all chunks or the given indexes"""
+        if indexes is None:
+            indexes = range(self.total_chunks)
+        indexes = [index for index in indexes if 0 <= index < self.total_chunks]
+        if not indexes:
+            return {}
+        # one read spanning the requested slots
+        first = min(indexes)
+        slots = self.read_slots(first, max(indexes))
+        return {
+            index: (
+                slots[index - first].hex() if slots[index - first] is not None else None
+            )
+            for index in indexes
+        }
+
+    def merkle_root(self, file_size, chunk_size):
+        """merkle_root of the recorded digests, None while any chunk is missing"""
+        slots = self.read_slots()
+        if any(digest is None for digest in slots):
+            return None
+        return merkle_root(slots, file_size, chunk_size, self.hash_type)
@@ -0,0 +1,293 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from .config import settings
+
+# upper bounds in seconds, from a bitmap byte update to hashing a large chunk
+DURATION_BUCKETS = (
+    0.00001,
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+    30.0,
+)
+# upper bounds in bytes, 4 KiB to 1 GiB by powers of four
+SIZE_BUCKETS = tuple(4**exponent for exponent in range(6, 16))
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Prometheus histogram with one child per label set
+
+    observe() only bisects the buckets and bumps a few numbers under a
+    lock, cumulative counts are built when /metrics is scraped.
+    """
+
+    def __init__(self, name, help, buckets, label="op"):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label = label
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, value):
+        child = self.children.get(value)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(
+                    value, [[0] * (len(self.buckets) + 1), 0.0]
+                )
+        return child
+
+    def observe(self, value, amount):
+        child = self.labels(value)
+        index = bisect.bisect_left(self.buckets, amount)
+        with self.lock:
+            child[0][index] += 1
+            child[1] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            children = [
+                (value, list(counts), total)
+                for value, (counts, total) in sorted(self.children.items())
+            ]
+        for value, counts, total in children:
+            labels = [(self.label, value)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else format_value(float(bound))
+                lines.append(
+                    f"{self.name}_bucket{format_labels(labels + [('le', le)])}"
+                    f" {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total!r}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Prometheus counter (or gauge, which may also go down)"""
+
+    def __init__(self, name, help, type="counter"):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type}",
+            f"{self.name} {format_value(self.value)}",
+        ]
+
+
+operation_seconds = Histogram(
+    "mp_operation_duration_seconds",
+    "Duration of hot-path hashing, write and chunk map operations",
+    DURATION_BUCKETS,
+)
+operation_bytes = Histogram(
+    "mp_operation_bytes",
+    "Bytes processed by one hashing or write operation",
+    SIZE_BUCKETS,
+)
+received_bytes = Counter(
+    "mp_received_bytes_total", "Chunk payload bytes received from clients"
+)
+upload_sessions_started = Counter(
+    "mp_upload_sessions_started_total", "Uploads started at /upload/init"
+)
+upload_sessions_active = Counter(
+    "mp_upload_sessions_active",
+    "Uploads with at least one chunk request in progress",
+    type="gauge",
+)
+uploads_evicted = Counter(
+    "mp_uploads_evicted_total",
+    "Incomplete uploads removed by the garbage collector",
+)
+coalesced_cached = Counter(
+    "mp_coalesced_cached_total",
+    "Download requests answered from the single-flight cache",
+)
+coalesced_shared = Counter(
+    "mp_coalesced_shared_total",
+    "Download requests that joined a computation already in flight",
+)
+admission_wait_seconds = Histogram(
+    "mp_admission_wait_seconds",
+    "Time a chunk write waited for admission, by outcome",
+    DURATION_BUCKETS,
+    label="result",
+)
+admission_rejected = Counter(
+    "mp_admission_rejected_total",
+    "Chunk writes answered 503 by admission control",
+)
+admission_writes = Counter(
+    "mp_admission_writes_in_flight",
+    "Chunk writes admitted and still running",
+    type="gauge",
+)
+admission_bytes = Counter(
+    "mp_admission_bytes_in_flight",
+    "Content-Length bytes of the admitted chunk writes still running",
+    type="gauge",
+)
+
+registry = [
+    operation_seconds,
+    operation_bytes,
+    received_bytes,
+    upload_sessions_started,
+    upload_sessions_active,
+    uploads_evicted,
+    coalesced_cached,
+    coalesced_shared,
+    admission_wait_seconds,
+    admission_rejected,
+    admission_writes,
+    admission_bytes,
+]
+
+__active_sessions__ = {}
+__active_sessions_lock__ = threading.Lock()
+
+
+def record(op, seconds, size=None):
+    """Record one hot-path operation, a no-op with settings.metrics off"""
+    if not settings.metrics:
+        return
+    operation_seconds.observe(op, seconds)
+    if size is not None:
+        operation_bytes.observe(op, size)
+
+
+def timed(op):
+    """Decorator recording the duration of every call as `op`"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(op, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def count_received(size):
+    if settings.metrics:
+        received_bytes.inc(size)
+
+
+def count_upload_started():
+    if settings.metrics:
+        upload_sessions_started.inc()
+
+
+@contextmanager
+def upload_session(file_hash):
+    """Count `file_hash` as an active upload while a chunk request runs,
+    concurrent requests for the same upload count once"""
+    with __active_sessions_lock__:
+        count = __active_sessions__.get(file_hash, 0)
+        __active_sessions__[file_hash] = count + 1
+        if not count:
+            upload_sessions_active.inc()
+    try:
+        yield
+    finally:
+        with __active_sessions_lock__:
+            count = __active_sessions__.pop(file_hash) - 1
+            if count:
+                __active_sessions__[file_hash] = count
+            else:
+                upload_sessions_active.dec()
+
+
+def active_uploads():
+    """File hashes with a chunk request running in this process"""
+    with __active_sessions_lock__:
+        return set(__active_sessions__)
+
+
+def count_evicted(count):
+    if settings.metrics:
+        uploads_evicted.inc(count)
+
+
+def count_coalesced(kind):
+    """Count a request SingleFlight answered from its cache ("cached") or
+    from a computation in flight ("shared")"""
+    if settings.metrics:
+        (coalesced_cached if kind == "cached" else coalesced_shared).inc()
+
+
+def record_admission(result, seconds):
+    """Record how long a chunk write waited for admission and whether it
+    was "admitted" or "rejected"
+    """
+    if not settings.metrics:
+        return
+    admission_wait_seconds.observe(result, seconds)
+    if result == "rejected":
+        admission_rejected.inc()
+
+
+def track_admitted(writes, size):
+    """Add (or remove, with negative values) admitted writes and their bytes"""
+    if settings.metrics:
+        admission_writes.inc(writes)
+        admission_bytes.inc(size)
+
+
+def render_metrics():
+    """All metrics of this process in the Prometheus text format
+
+    Each uvicorn worker keeps its own numbers, a scrape sees the worker that
+    answered it. Hashing on a "process" hash pool is recorded in the pool
+    processes and is not exported.
+    """
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,122 @@
+import os
+from email.utils import formatdate
+
+from starlette.responses import Response
+
+from .executor import run_io
+
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(http_range: str, file_size: int):
+    """Parse a single `bytes=` range into [start, end)
+
+    Returns None when the header should be ignored (other units, several ranges
+    or malformed), in which case the whole file is sent, as RFC 9110 allows.
+    """
+    unit, _, spec = http_range.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = (part.strip() for part in spec.partition("-"))
+    if not sep or not (first or last):
+        return None
+    if (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if first:
+        start = int(first)
+        end = int(last) + 1 if last else file_size
+        if last and end <= start:
+            # reversed range, malformed
+            return None
+    else:
+        # suffix range, the last N bytes
+        start = max(file_size - int(last), 0)
+        end = file_size
+    if start >= file_size or start >= end:
+        raise RangeNotSatisfiable()
+    return start, min(end, file_size)
+
+
+class FileRangeResponse(Response):
+    """Send bytes [start, end) of a file as application/octet-stream
+
+    Uses the ASGI zero-copy send extension (sendfile) when the server offers
+    it, otherwise reads blocks with os.pread on the I/O pool.
+    """
+
+    block_size = 1024 * 1024
+
+    def __init__(
+        self,
+        path,
+        start: int,
+        end: int,
+        file_size: int,
+        status_code: int = 200,
+        headers=None,
+    ):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.status_code = status_code
+        self.media_type = "application/octet-stream"
+        self.background = None
+        self.init_headers(headers)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["content-length"] = str(end - start)
+        if status_code == 206:
+            self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+
+    async def __call__(self, scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if scope["method"].upper() == "HEAD" or self.start == self.end:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        with open(self.path, "rb") as f:
+            if ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+                await send(
+                    {
+                        "type": ZEROCOPY_EXTENSION,
+                        "file": f,
+                        "offset": self.start,
+                        "count": self.end - self.start,
+                        "more_body": False,
+                    }
+                )
+                return
+
+            position = self.start
+            while position < self.end:
+                size = min(self.block_size, self.end - position)
+                data = await run_io(os.pread, f.fileno(), size, position)
+                if not data:
+                    raise RuntimeError(
+                        f"File at path {self.path} is shorter than expected."
+                    )
+                position += len(data)
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": data,
+                        "more_body": position < self.end,
+                    }
+                )
+
+
+def file_validators(file_hash: str, stat_result: os.stat_result):
+    """ETag and Last-Modified of a stored file, its name is already its hash"""
+    return {
+        "etag": f'"{file_hash}"',
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+    }
@@ -0,0 +1,281 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from .chunk_map_manager import BinaryChunkMapManager
+from .config import settings
+from .digest_record import VerifiedDigestRecord
+from .executor import run_hash, run_io
+from .layout import fanout_dir
+from .manifest import ChunkHashManifest
+from .single_flight import invalidate_upload
+from .upload_index import UPLOAD_COMPLETED, UPLOAD_INCOMPLETE
+from .utils import calculate_chunk_hash, hash_file_chunks
+
+logger = logging.getLogger(__name__)
+
+# progress of the running or last pass, readable by every worker
+SCRUB_FILE = ".scrub"
+# bad chunk offsets listed in the report, the counters go on past it
+MAX_REPORTED_CHUNKS = 1000
+# seconds between progress writes while a pass runs
+REPORT_INTERVAL = 1.0
+
+
+class Throttle:
+    """Pace reads to `rate` bytes per second from its creation, 0 for no limit"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.start = time.monotonic()
+        self.consumed = 0
+
+    async def acquire(self, size):
+        if not self.rate:
+            return
+        self.consumed += size
+        delay = self.start + self.consumed / self.rate - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Scrubber:
+    """Re-verify stored uploads against their recorded chunk digests
+
+    A pass walks the completed uploads of the upload index and rehashes
+    their chunks on the hash pool, settings.scrub_workers chunks at a time
+    and settings.scrub_bytes_per_second overall. A chunk that no longer
+    matches its manifest digest has its bit cleared, its digest and chunk
+    index entry dropped and the upload marked incomplete, so the next
+    /upload/init asks the client for it again. An upload without recorded
+    digests (indexed from an older layout) is checked against its file hash
+    in one read and gets its digests recorded.
+
+    A pass holds `.scrub.lock` in the upload directory, so of several
+    workers one scrubs at a time, and writes its progress to `.scrub`.
+    """
+
+    def __init__(self, root, upload_index, chunk_index=None):
+        self.root = Path(root)
+        self.upload_index = upload_index
+        self.chunk_index = chunk_index
+        self.report_file = self.root / SCRUB_FILE
+        self.lock_file = self.root / f"{SCRUB_FILE}.lock"
+        self.task = None
+
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def start(self):
+        """Start a pass in the background, unless this worker already runs one"""
+        if not self.running():
+            self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def run_forever(self, interval):
+        """Start a pass every `interval` seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.start()
+            except Exception:
+                logger.exception(f"{self.root}: scrub failed")
+
+    async def run(self):
+        """One pass, returns its report, or None when another worker scrubs"""
+        with open(self.lock_file, "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            return await self.scrub()
+
+    async def scrub(self):
+        uploads = await run_io(self.upload_index.list, UPLOAD_COMPLETED)
+        self.report = {
+            "status": "running",
+            "started": time.time(),
+            "finished": None,
+            "bytes_per_second": settings.scrub_bytes_per_second,
+            "uploads_total": len(uploads),
+            "uploads_checked": 0,
+            "bytes_total": sum(upload["file_size"] for upload in uploads),
+            "bytes_checked": 0,
+            "chunks_checked": 0,
+            "bad_chunks": 0,
+            # file hash: offsets of its bad chunks
+            "bad_uploads": {},
+        }
+        self.saved = 0
+        self.failed = set()
+        self.pending = {}
+        await run_io(self.save_report)
+
+        throttle = Throttle(settings.scrub_bytes_per_second)
+        queue = asyncio.Queue(settings.scrub_workers * 2)
+        workers = [
+            asyncio.create_task(self.worker(queue, throttle))
+            for _ in range(settings.scrub_workers)
+        ]
+        try:
+            for upload in uploads:
+                jobs = await run_io(self.upload_jobs, upload)
+                if not jobs:
+                    self.report["uploads_checked"] += 1
+                    continue
+                self.pending[upload["file_hash"]] = len(jobs)
+                for job in jobs:
+                    await queue.put(job)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        except BaseException as e:
+            for worker in workers:
+                worker.cancel()
+            self.report["status"] = "failed"
+            self.report["error"] = repr(e)
+            raise
+        else:
+            self.report["status"] = "finished"
+        finally:
+            self.report["finished"] = time.time()
+            await asyncio.shield(run_io(self.save_report))
+        logger.info(
+            f"{self.root}: scrubbed {self.report['uploads_checked']} uploads,"
+            f" {self.report['bad_chunks']} bad chunks"
+        )
+        return self.report
+
+    def upload_jobs(self, upload):
+        """(upload, chunk index, recorded digest) per chunk of an upload,
+        one (upload, None, None) job when digests are missing"""
+        file_hash = upload["file_hash"]
+        manifest = ChunkHashManifest(file_hash, fanout_dir(self.root, file_hash))
+        digests = manifest.get_digests() if manifest.exists() else {}
+        if len(digests) == upload["total_chunks"] and None not in digests.values():
+            return [(upload, index, digest) for index, digest in digests.items()]
+        if upload["hash_mode"] == "file":
+            return [(upload, None, None)]
+        # a tree upload is only completed once every digest is recorded
+        return []
+
+    async def worker(self, queue, throttle):
+        while (job := await queue.get()) is not None:
+            upload, index, digest = job
+            try:
+                if index is None:
+                    await self.check_file(upload, throttle)
+                else:
+                    await self.check_chunk(upload, index, digest, throttle)
+            except OSError as e:
+                # removed or replaced since the pass started
+                logger.warning(f"{upload['file_hash']}: not scrubbed, {e}")
+            self.pending[upload["file_hash"]] -= 1
+            if not self.pending[upload["file_hash"]]:
+                del self.pending[upload["file_hash"]]
+                self.report["uploads_checked"] += 1
+            if time.monotonic() - self.saved >= REPORT_INTERVAL:
+                self.saved = time.monotonic()
+                await run_io(self.save_report)
+
+    async def check_chunk(self, upload, index, digest, throttle):
+        file_hash = upload["file_hash"]
+        offset = index * upload["chunk_size"]
+        size = min(upload["chunk_size"], upload["file_size"] - offset)
+        await throttle.acquire(size)
+        actual = await run_hash(
+            calculate_chunk_hash,
+            fanout_dir(self.root, file_hash) / file_hash,
+            offset,
+            size,
+            upload["hash_type"],
+        )
+        self.report["bytes_checked"] += size
+        self.report["chunks_checked"] += 1
+        if actual != digest:
+            await self.fail_chunks(upload, [index])
+
+    async def check_file(self, upload, throttle):
+        file_hash = upload["file_hash"]
+        await throttle.acquire(upload["file_size"])
+        digest, chunk_digests = await run_hash(
+            hash_file_chunks,
+            fanout_dir(self.root, file_hash) / file_hash,
+            upload["chunk_size"],
+            upload["hash_type"],
+        )
+        self.report["bytes_checked"] += upload["file_size"]
+        self.report["chunks_checked"] += len(chunk_digests)
+        if digest == file_hash:
+            await run_io(self.record_digests, upload, chunk_digests)
+        else:
+            # which chunk went bad is unknown without digests
+            await self.fail_chunks(upload, range(upload["total_chunks"]))
+
+    def record_digests(self, upload, chunk_digests):
+        file_hash = upload["file_hash"]
+        manifest = ChunkHashManifest(file_hash, fanout_dir(self.root, file_hash))
+        if not manifest.exists():
+            manifest.initialize(upload["total_chunks"], upload["hash_type"])
+        manifest.set_digests(dict(enumerate(chunk_digests)))
+
+    async def fail_chunks(self, upload, indexes):
+        file_hash = upload["file_hash"]
+        if file_hash not in self.failed:
+            # an upload removed or restarted since the pass began is left alone
+            current = await run_io(self.upload_index.get, file_hash)
+            if current is None or current["state"] != UPLOAD_COMPLETED:
+                return
+            self.failed.add(file_hash)
+        offsets = [index * upload["chunk_size"] for index in indexes]
+        await run_io(self.reset_chunks, file_hash, indexes, offsets)
+        logger.warning(f"{file_hash}: {len(offsets)} chunks failed the scrub")
+
+        self.report["bad_chunks"] += len(offsets)
+        reported = sum(len(bad) for bad in self.report["bad_uploads"].values())
+        self.report["bad_uploads"].setdefault(file_hash, []).extend(
+            offsets[: max(MAX_REPORTED_CHUNKS - reported, 0)]
+        )
+
+    def reset_chunks(self, file_hash, indexes, offsets):
+        """Clear the bits of bad chunks so they are uploaded again"""
+        dir = fanout_dir(self.root, file_hash)
+        chunk_manager = BinaryChunkMapManager(file_hash, dir)
+        manifest = ChunkHashManifest(file_hash, dir)
+        for index, offset in zip(indexes, offsets):
+            chunk_manager.mark_chunk(offset, complete=False)
+            if manifest.exists():
+                manifest.clear_digest(index)
+        # the data file kept its stat, so the record would still vouch for it
+        VerifiedDigestRecord(file_hash, dir).invalidate()
+        self.upload_index.set_state(file_hash, UPLOAD_INCOMPLETE)
+        invalidate_upload(file_hash)
+        if self.chunk_index is not None:
+            # a bad chunk must not be copied into other uploads either
+            self.chunk_index.remove([(file_hash, offset) for offset in offsets])
+
+    def save_report(self):
+        tmp_file = self.report_file.with_name(f"{SCRUB_FILE}.tmp")
+        tmp_file.write_text(json.dumps(self.report))
+        os.replace(tmp_file, self.report_file)
+
+    def load_report(self):
+        """Report of the running or last pass of any worker"""
+        try:
+            report = json.loads(self.report_file.read_text())
+        except (OSError, ValueError):
+            return {"status": "idle"}
+        if report["status"] == "running":
+            with open(self.lock_file, "w") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    pass
+                else:
+                    # nobody holds the lock, the worker died mid-pass
+                    report["status"] = "interrupted"
+        return report
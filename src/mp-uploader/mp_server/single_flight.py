@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+from .config import settings
+from .metrics import count_coalesced
+
+
+class SingleFlight:
+    """Share one in-flight computation between concurrent identical calls
+
+    Callers asking for the same (file_hash, key) while a computation runs
+    await its result instead of starting their own, and the result is kept
+    for `ttl` seconds in an LRU of at most `max_entries`. Exceptions are
+    shared with the waiting callers but never cached. invalidate drops the
+    results of an upload, and detaches its running computations so later
+    callers start fresh ones. Safe to invalidate from I/O pool threads.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.flights = {}
+        # key: (expiry on time.monotonic(), result)
+        self.cache = OrderedDict()
+        # file hash: its keys in flights or cache, for invalidate
+        self.keys = defaultdict(set)
+        self.lock = threading.Lock()
+
+    async def run(self, file_hash, key, func):
+        """The result of `await func()` for (file_hash, key)"""
+        key = (file_hash, key)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.cache.move_to_end(key)
+                count_coalesced("cached")
+                return entry[1]
+            future = self.flights.get(key)
+            if future is None:
+                # a task of its own, so a disconnecting caller cancels nobody
+                future = asyncio.ensure_future(func())
+                self.flights[key] = future
+                self.keys[file_hash].add(key)
+                future.add_done_callback(lambda future: self.landed(key, future))
+            else:
+                count_coalesced("shared")
+        return await asyncio.shield(future)
+
+    def landed(self, key, future):
+        with self.lock:
+            if self.flights.get(key) is not future:
+                # invalidated while in flight, the result is already stale
+                return
+            del self.flights[key]
+            if future.cancelled() or future.exception() is not None or not self.ttl:
+                self.forget(key)
+                return
+            self.cache[key] = (time.monotonic() + self.ttl, future.result())
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_entries:
+                oldest, _ = self.cache.popitem(last=False)
+                self.forget(oldest)
+
+    def forget(self, key):
+        """Drop `key` from keys once it is neither in flight nor cached"""
+        if key in self.flights or key in self.cache:
+            return
+        keys = self.keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys[key[0]]
+
+    def invalidate(self, file_hash):
+        """Forget every result and computation of an upload that changed"""
+        with self.lock:
+            for key in self.keys.pop(file_hash, ()):
+                self.cache.pop(key, None)
+                self.flights.pop(key, None)
+
+
+class ChunkClaims:
+    """Chunks being written by a request, so no other request writes them too
+
+    A request claims a chunk before writing it and keeps the claim until the
+    chunk is marked or failed, a second request for it meanwhile is turned
+    away rather than overwriting it, and finds it marked when it retries.
+    Claims are only taken and released on the event loop.
+    """
+
+    def __init__(self):
+        self.claimed = set()
+
+    @contextmanager
+    def claim(self, file_hash, offset):
+        """Yields whether the chunk at `offset` was claimed"""
+        key = (file_hash, offset)
+        if key in self.claimed:
+            yield False
+            return
+        self.claimed.add(key)
+        try:
+            yield True
+        finally:
+            self.claimed.discard(key)
+
+
+__single_flight__ = SingleFlight(settings.coalesce_ttl, settings.coalesce_max_entries)
+
+
+async def coalesce(file_hash, key, func):
+    """Run `func` once for concurrent (file_hash, key) callers, see SingleFlight"""
+    return await __single_flight__.run(file_hash, key, func)
+
+
+def invalidate_upload(file_hash):
+    """Forget coalesced results of an upload, call it whenever it changes"""
+    __single_flight__.invalidate(file_hash)
+
+
+__chunk_claims__ = ChunkClaims()
+
+
+def claim_chunk(file_hash, offset):
+    """Claim a chunk for writing, see ChunkClaims"""
+    return __chunk_claims__.claim(file_hash, offset)
@@ -0,0 +1,157 @@
+import time
+
+from .chunk_index import SQLiteIndex
+
+# what init_upload would answer for the upload
+UPLOAD_INCOMPLETE = "incomplete"
+UPLOAD_COMPLETED = "completed"
+UPLOAD_BAD_FILE = "bad_file"
+# every chunk is stored but the file hash was not checked yet,
+# see mp_server.layout.verify_uploads
+UPLOAD_UNVERIFIED = "unverified"
+
+UPLOAD_COLUMNS = (
+    "file_hash",
+    "file_size",
+    "chunk_size",
+    "total_chunks",
+    "hash_type",
+    "hash_mode",
+    "state",
+    "created",
+    "last_active",
+)
+
+
+class UploadIndex(SQLiteIndex):
+    """State and size of every upload in the upload directory
+
+    init_upload, init_download and the stored file checks answer from one
+    primary key lookup here instead of stat calls on the data file, chunk map
+    and digest record. The state is written where it changes: at
+    /upload/init, once the last chunk is verified, and when a chunk fails
+    verification. `created` and `last_active` (unix time) are what
+    GarbageCollector evicts abandoned uploads by.
+    """
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS uploads ("
+        " file_hash TEXT PRIMARY KEY, file_size INTEGER, chunk_size INTEGER,"
+        " total_chunks INTEGER, hash_type TEXT, hash_mode TEXT, state TEXT,"
+        " created REAL, last_active REAL"
+        ") WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS uploads_by_activity"
+        " ON uploads (state, last_active)",
+    )
+    version = 1
+
+    def put(
+        self,
+        file_hash,
+        file_size,
+        chunk_size,
+        hash_type,
+        hash_mode="file",
+        state=UPLOAD_INCOMPLETE,
+    ):
+        self.put_many(
+            [
+                (
+                    file_hash,
+                    file_size,
+                    chunk_size,
+                    hash_type,
+                    hash_mode,
+                    state,
+                    time.time(),
+                )
+            ]
+        )
+
+    def put_many(self, uploads):
+        """Insert or replace (file_hash, file_size, chunk_size, hash_type,
+        hash_mode, state, last_active) rows, created at last_active"""
+        with self.connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        file_hash,
+                        file_size,
+                        chunk_size,
+                        -(-file_size // chunk_size),
+                        hash_type,
+                        hash_mode,
+                        state,
+                        last_active,
+                        last_active,
+                    )
+                    for file_hash, file_size, chunk_size, hash_type, hash_mode, state, last_active in uploads
+                ],
+            )
+
+    def get(self, file_hash):
+        """The upload as a dict of UPLOAD_COLUMNS, None if it is not stored"""
+        with self.connect() as connection:
+            row = connection.execute(
+                f"SELECT {', '.join(UPLOAD_COLUMNS)} FROM uploads WHERE file_hash = ?",
+                (file_hash,),
+            ).fetchone()
+        return dict(zip(UPLOAD_COLUMNS, row)) if row is not None else None
+
+    def list(self, state=None):
+        """Every upload as a dict of UPLOAD_COLUMNS, or those in `state`"""
+        query = f"SELECT {', '.join(UPLOAD_COLUMNS)} FROM uploads"
+        with self.connect() as connection:
+            if state is None:
+                rows = connection.execute(query).fetchall()
+            else:
+                rows = connection.execute(
+                    f"{query} WHERE state = ?", (state,)
+                ).fetchall()
+        return [dict(zip(UPLOAD_COLUMNS, row)) for row in rows]
+
+    def set_state(self, file_hash, state):
+        with self.connect() as connection:
+            connection.execute(
+                "UPDATE uploads SET state = ? WHERE file_hash = ?", (state, file_hash)
+            )
+
+    def touch(self, file_hashes, when=None):
+        """Record activity on uploads"""
+        when = time.time() if when is None else when
+        with self.connect() as connection:
+            connection.executemany(
+                "UPDATE uploads SET last_active = ? WHERE file_hash = ?",
+                [(when, file_hash) for file_hash in file_hashes],
+            )
+
+    def usage(self):
+        """{state: (uploads, bytes)} of every state with an upload"""
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT state, COUNT(*), SUM(file_size) FROM uploads GROUP BY state"
+            ).fetchall()
+        return {state: (count, size) for state, count, size in rows}
+
+    def idle(self, before=None):
+        """Uploads not completed nor awaiting verification, least recently
+        active first, only those inactive since `before` when given"""
+        query = (
+            f"SELECT {', '.join(UPLOAD_COLUMNS)} FROM uploads"
+            " WHERE state NOT IN (?, ?) AND last_active < ? ORDER BY last_active"
+        )
+        with self.connect() as connection:
+            rows = connection.execute(
+                query,
+                (
+                    UPLOAD_COMPLETED,
+                    UPLOAD_UNVERIFIED,
+                    float("inf") if before is None else before,
+                ),
+            ).fetchall()
+        return [dict(zip(UPLOAD_COLUMNS, row)) for row in rows]
+
+    def remove(self, file_hash):
+        with self.connect() as connection:
+            connection.execute("DELETE FROM uploads WHERE file_hash = ?", (file_hash,))
@@ -1,25 +1,61 @@
+import errno
 import hashlib
 import json
 import os
 import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path, PosixPath
 from typing import BinaryIO
 
 from . import HASH_METHOD
+from .config import settings
+from .metrics import count_received, record
 
+# read size for hashing, large reads keep hashlib outside the GIL most of the time
+HASH_BUFFER_SIZE = 1024 * 1024
 
-def create_empty_file(filename: str, dir: str | PosixPath, size: int):
-    """Create sparse file of specified size"""
+
+def create_empty_file(
+    filename: str, dir: str | PosixPath, size: int, preallocate: str = None
+):
+    """Create file of specified size, see settings.preallocate
+
+    "fallocate" reserves every block up front, so out-of-order chunk writes
+    land in few extents and a full disk fails here rather than mid-upload.
+    File systems without fallocate support, and "sparse", get a sparse file.
+    """
+    preallocate = preallocate or settings.preallocate
     with open(Path(dir) / filename, "wb") as f:
+        if not size:
+            return
+        if preallocate == "fallocate" and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError as e:
+                # ENOSPC and friends are real failures, only fall back when
+                # the file system can not preallocate
+                if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                    raise
         f.seek(size - 1)
         f.write(b"\0")
 
 
+def has_free_space(dir: str | PosixPath, size: int) -> bool:
+    """Whether the volume of `dir` can take `size` more bytes and still keep
+    settings.free_space_reserve free"""
+    st = os.statvfs(dir)
+    return st.f_bavail * st.f_frsize >= size + settings.free_space_reserve
+
+
 def write_chunk_to_position(filename, offset: int, data: bytes):
     """Write chunk data to specific file position"""
+    start = time.perf_counter()
     with open(filename, "r+b") as f:
         f.seek(offset)
         f.write(data)
+    record("write_chunk_to_position", time.perf_counter() - start, len(data))
 
 
 def calculate_hash(
@@ -34,22 +70,153 @@ def calculate_hash(
         f"Hash method {hash_type} not available. Available methods: {hashlib.algorithms_available}"
     )
     hash = getattr(hashlib, hash_type)()
+    start, size = time.perf_counter(), 0
 
     if filename:
         with open(filename, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
+            for chunk in iter(lambda: f.read(HASH_BUFFER_SIZE), b""):
                 hash.update(chunk)
+                size += len(chunk)
+        record("calculate_hash", time.perf_counter() - start, size)
         return hash.hexdigest()
     else:
         try:
             assert hasattr(fileIO, "read"), Exception("fileIO is not readable")
-            for chunk in iter(lambda: fileIO.read(4096), b""):
+            for chunk in iter(lambda: fileIO.read(HASH_BUFFER_SIZE), b""):
                 hash.update(chunk)
+                size += len(chunk)
+            record("calculate_hash", time.perf_counter() - start, size)
             return hash.hexdigest()
         except Exception as e:
             raise Exception(f"Error calculating hash: {e}")
 
 
+class ChunkWriter:
+    """Write one chunk at a fixed file offset with os.pwrite, hashing it on the way
+
+    Data is written as it arrives, so a chunk is received, hashed and stored
+    in a single pass without ever being held in memory as a whole.
+    """
+
+    def __init__(self, filename, offset: int, hash_type=HASH_METHOD):
+        self.fd = os.open(filename, os.O_WRONLY)
+        self.offset = offset
+        self.size = 0
+        self.hash = hashlib.new(hash_type)
+
+    def write(self, data):
+        """Write bytes, or a list of buffers from buffer_stream"""
+        pieces = [data] if isinstance(data, (bytes, bytearray, memoryview)) else data
+        # timed separately, so slow disks and slow hashing can be told apart
+        start = time.perf_counter()
+        size = pwrite_all(self.fd, pieces, self.offset + self.size)
+        self.size += size
+        written = time.perf_counter()
+        for piece in pieces:
+            self.hash.update(piece)
+        record("chunk_writer_write", written - start, size)
+        record("chunk_writer_hash", time.perf_counter() - written, size)
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def calculate_chunk_hash(filename, offset: int, size: int, hash_type=HASH_METHOD):
+    """Calculate hash of `size` bytes of a file starting at `offset`"""
+    hash = hashlib.new(hash_type)
+    start, remaining = time.perf_counter(), size
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        while remaining > 0:
+            data = f.read(min(remaining, HASH_BUFFER_SIZE))
+            if not data:
+                break
+            hash.update(data)
+            remaining -= len(data)
+    record("calculate_chunk_hash", time.perf_counter() - start, size - remaining)
+    return hash.hexdigest()
+
+
+def copy_range(source, source_offset: int, filename, offset: int, size: int) -> int:
+    """Copy `size` bytes between files, returns the number of bytes copied
+
+    os.copy_file_range keeps the copy inside the kernel, and on file systems
+    with reflinks (btrfs, XFS) the two files share the blocks on disk.
+    """
+    with open(source, "rb") as src, open(filename, "r+b") as dst:
+        copied = 0
+        if hasattr(os, "copy_file_range"):
+            try:
+                while copied < size:
+                    written = os.copy_file_range(
+                        src.fileno(),
+                        dst.fileno(),
+                        size - copied,
+                        source_offset + copied,
+                        offset + copied,
+                    )
+                    if not written:
+                        break
+                    copied += written
+            except OSError:
+                # e.g. EXDEV on old kernels, finish with plain reads and writes
+                pass
+        while copied < size:
+            data = os.pread(
+                src.fileno(),
+                min(size - copied, HASH_BUFFER_SIZE),
+                source_offset + copied,
+            )
+            if not data:
+                break
+            os.pwrite(dst.fileno(), data, offset + copied)
+            copied += len(data)
+    return copied
+
+
+def copy_chunk(
+    source, source_offset: int, filename, offset: int, size: int, hash_type=HASH_METHOD
+):
+    """Copy a chunk between files and return the hash of what was written,
+    it is hashed from the destination, so a stale source is detected"""
+    if copy_range(source, source_offset, filename, offset, size) < size:
+        return None
+    return calculate_chunk_hash(filename, offset, size, hash_type)
+
+
+def hash_file_chunks(filename, chunk_size: int, hash_type=HASH_METHOD):
+    """Hash a whole file and each of its chunks in a single read pass,
+    returns (file hexdigest, [chunk hexdigest, ...])"""
+    file_hash = hashlib.new(hash_type)
+    chunk_hashes = []
+    with open(filename, "rb") as f:
+        while True:
+            chunk_hash = hashlib.new(hash_type)
+            size = chunk_size
+            while size > 0:
+                data = f.read(min(size, HASH_BUFFER_SIZE))
+                if not data:
+                    break
+                file_hash.update(data)
+                chunk_hash.update(data)
+                size -= len(data)
+            if size == chunk_size:
+                break
+            chunk_hashes.append(chunk_hash.hexdigest())
+            if size:
+                break
+    return file_hash.hexdigest(), chunk_hashes
+
+
 # Write chunk at specific position
 def write_chunk(filename, position, data, lock):
     with lock:  # Ensure thread-safe file access
@@ -58,25 +225,126 @@ def write_chunk(filename, position, data, lock):
             f.write(data)
 
 
-# Multithreaded writing example
-def parallel_write_chunks(filename, chunks_data):
-    lock = threading.Lock()
-    threads = []
+# most buffers one pwritev call takes
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else 1024
+
+
+async def buffer_stream(stream):
+    """Group small network reads into (pieces, size) batches of about
+    settings.write_buffer_size bytes, each written with one call on the I/O pool"""
+    pending, pending_size = [], 0
+    async for data in stream:
+        pending.append(data)
+        pending_size += len(data)
+        count_received(len(data))
+        if pending_size >= settings.write_buffer_size:
+            yield pending, pending_size
+            pending, pending_size = [], 0
+    if pending:
+        yield pending, pending_size
+
+
+def pwrite_all(fd: int, data, offset: int) -> int:
+    """Write bytes, or a list of buffers with os.pwritev, at `offset` until
+    all of it is written, returns the number of bytes written"""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data)
+        written = 0
+        while written < len(view):
+            written += os.pwrite(fd, view[written:], offset + written)
+        return written
+    buffers = [memoryview(buffer) for buffer in data if len(buffer)]
+    written = 0
+    while buffers:
+        size = os.pwritev(fd, buffers[:IOV_MAX], offset + written)
+        written += size
+        # drop what was written, a partial write leaves part of a buffer
+        while buffers and size >= len(buffers[0]):
+            size -= len(buffers.pop(0))
+        if size:
+            buffers[0] = buffers[0][size:]
+    return written
+
+
+class ParallelWriter:
+    """Write chunks of one file at their offsets from a bounded thread pool
+
+    All writes share one file descriptor and go through os.pwrite (or
+    os.pwritev for a list of buffers), which takes no file position, so
+    writes at separate offsets need no lock and run in parallel. At most
+    `max_pending` chunks are queued, so a large batch is not held in memory
+    as a whole. `written` maps each offset to the bytes written there.
+    """
+
+    def __init__(self, filename, max_workers: int = None, max_pending: int = None):
+        self.fd = os.open(filename, os.O_WRONLY)
+        max_workers = max_workers or settings.io_workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="mp-pwrite"
+        )
+        self.pending = threading.BoundedSemaphore(max_pending or 2 * max_workers)
+        self.written = {}
+        self.lock = threading.Lock()
+
+    def write_at(self, offset: int, data) -> int:
+        """Write one chunk in the calling thread"""
+        start = time.perf_counter()
+        size = pwrite_all(self.fd, data, offset)
+        record("parallel_writer_write", time.perf_counter() - start, size)
+        with self.lock:
+            self.written[offset] = self.written.get(offset, 0) + size
+        return size
+
+    def submit(self, offset: int, data) -> Future:
+        """Queue one chunk, blocks while `max_pending` chunks are queued"""
+        self.pending.acquire()
+        try:
+            future = self.executor.submit(self.write_at, offset, data)
+        except BaseException:
+            self.pending.release()
+            raise
+        future.add_done_callback(lambda _: self.pending.release())
+        return future
+
+    def write_all(self, chunks) -> dict:
+        """Write (offset, data) pairs, returns {offset: bytes written}"""
+        futures = [self.submit(offset, data) for offset, data in chunks]
+        for future in futures:
+            # raise the first failed write
+            future.result()
+        return dict(self.written)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        os.close(self.fd)
 
-    for position, data in chunks_data:
-        t = threading.Thread(target=write_chunk, args=(filename, position, data, lock))
-        threads.append(t)
-        t.start()
+    def __enter__(self):
+        return self
 
-    for t in threads:
-        t.join()
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parallel_write_chunks(filename, chunks_data, max_workers: int = None):
+    """Write (position, data) pairs on a bounded pool of pwrite workers,
+    returns {position: bytes written}"""
+    with ParallelWriter(filename, max_workers=max_workers) as writer:
+        return writer.write_all(chunks_data)
 
 
 # calculate_optimal_chunk_size
-def calculate_optimal_chunk_size(file_size):
-    """Calculate optimal chunk size based on file size"""
-    # Example: 1MB chunks for files smaller than 10MB, 5MB chunks for larger files
-    if file_size < 10 * 1024 * 1024:
-        return 1024 * 1024
-    else:
-        return 5 * 1024 * 1024
+def calculate_optimal_chunk_size(file_size, bandwidth=None):
+    """Calculate optimal chunk size based on file size and a bandwidth hint
+
+    Aims for about settings.target_chunks chunks per file, so huge archives do
+    not drown in per-request overhead, and if the client reports its
+    bandwidth (bytes/s), keeps one chunk within settings.chunk_seconds of
+    transfer, so a flaky link does not lose much on a retry. The result is a
+    power of two clamped to [min_chunk_size, max_chunk_size].
+    """
+    chunk_size = max(file_size // settings.target_chunks, 1)
+    if bandwidth:
+        chunk_size = min(chunk_size, int(bandwidth * settings.chunk_seconds))
+    # round up to a power of two
+    chunk_size = 1 << max(chunk_size - 1, 0).bit_length()
+    return max(settings.min_chunk_size, min(chunk_size, settings.max_chunk_size))
@@ -1,73 +1,542 @@
+import asyncio
+import errno
+import functools
 import os
+import tempfile
+from contextlib import ExitStack, asynccontextmanager
 from pathlib import Path
-from typing import List
+from typing import List, Literal
 
-from fastapi import FastAPI, File, Query, UploadFile
+from fastapi import (
+    Body,
+    Depends,
+    FastAPI,
+    File,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import JSONResponse
 from mp_server import (
     CHUNK_SIZE,
     HASH_METHOD,
-    PROJ_ROOT,
+    METRICS_CONTENT_TYPE,
+    UPLOAD_COMPLETED,
+    UPLOAD_INCOMPLETE,
+    UPLOAD_UNVERIFIED,
+    AdmissionController,
+    AdmissionMiddleware,
     BinaryChunkMapManager,
+    ChunkHashManifest,
+    ChunkIndex,
+    ChunkWriter,
+    FileRangeResponse,
+    FrameReader,
+    FramingError,
+    GarbageCollector,
+    RangeNotSatisfiable,
+    Scrubber,
+    UploadIndex,
+    VerifiedDigestRecord,
+    apply_delta,
+    buffer_stream,
+    calculate_chunk_hash,
     calculate_hash,
+    calculate_optimal_chunk_size,
+    claim_chunk,
+    coalesce,
+    copy_chunk,
+    count_received,
+    count_upload_started,
+    digest_record_type,
+    fanout_dir,
+    file_signature,
+    file_validators,
+    hash_file_chunks,
+    invalidate_upload,
+    merkle_root,
+    parse_range_header,
+    prepare_upload_dir,
+    render_metrics,
+    run_hash,
+    run_io,
+    settings,
     setup_file_and_chunk_map,
+    shutdown_executors,
+    signature_block_size,
+    sync_data,
+    upload_session,
+    verify_upload,
+    verify_uploads,
     write_chunk_to_position,
 )
 
-app = FastAPI()
 
-__UPLOAD_DIR__ = PROJ_ROOT / "upload"
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tasks = []
+    if settings.gc_interval > 0:
+        tasks.append(
+            asyncio.create_task(upload_collector().run_forever(settings.gc_interval))
+        )
+    if settings.scrub_interval > 0:
+        tasks.append(
+            asyncio.create_task(upload_scrubber().run_forever(settings.scrub_interval))
+        )
+    # hash what prepare_upload_dir indexed without verifying
+    tasks.append(
+        asyncio.create_task(run_hash(verify_uploads, __UPLOAD_DIR__, upload_index()))
+    )
+    yield
+    for task in tasks:
+        task.cancel()
+    if upload_scrubber().running():
+        upload_scrubber().task.cancel()
+    shutdown_executors()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# chunk writes over the limits of settings.admission_* are answered 503
+__admission__ = AdmissionController.from_settings()
+app.add_middleware(AdmissionMiddleware, controller=__admission__)
+
+__UPLOAD_DIR__ = Path(settings.upload_dir)
 __UPLOAD_DIR__.mkdir(parents=True, exist_ok=True)
 
 
+def upload_chunk_index():
+    return ChunkIndex(__UPLOAD_DIR__ / "chunk_index.db")
+
+
+def upload_index():
+    return UploadIndex(__UPLOAD_DIR__ / "upload_index.db")
+
+
+def upload_dir(file_hash: str, create=False):
+    """Fan-out directory of an upload, see mp_server.layout"""
+    dir = fanout_dir(__UPLOAD_DIR__, file_hash)
+    if create:
+        dir.mkdir(parents=True, exist_ok=True)
+    return dir
+
+
+__collector__ = None
+__scrubber__ = None
+
+
+def upload_collector():
+    """The GarbageCollector of the upload directory, one per worker"""
+    global __collector__
+    if __collector__ is None or __collector__.root != __UPLOAD_DIR__:
+        __collector__ = GarbageCollector(
+            __UPLOAD_DIR__,
+            upload_index(),
+            upload_chunk_index() if settings.chunk_dedup else None,
+        )
+    return __collector__
+
+
+def upload_scrubber():
+    """The Scrubber of the upload directory, one per worker"""
+    global __scrubber__
+    if __scrubber__ is None or __scrubber__.root != __UPLOAD_DIR__:
+        __scrubber__ = Scrubber(
+            __UPLOAD_DIR__,
+            upload_index(),
+            upload_chunk_index() if settings.chunk_dedup else None,
+        )
+    return __scrubber__
+
+
+# move uploads of an older layout and build the upload index, once
+prepare_upload_dir(__UPLOAD_DIR__, upload_index())
+
+# "list" returns one offset per chunk, "ranges" returns [start, end) offset runs
+ChunkFormat = Literal["list", "ranges"]
+
+# "file": file_hash is the hash of the whole file,
+# "tree": file_hash is the Merkle root of the chunk hashes (see merkle_root),
+#         so completion is confirmed from the manifest without rereading the file
+HashMode = Literal["file", "tree"]
+
+
+def incomplete_chunks(chunk_manager: BinaryChunkMapManager, chunk_format: ChunkFormat):
+    if chunk_format == "ranges":
+        return chunk_manager.get_incomplete_ranges()
+    return chunk_manager.get_incomplete_chunks()
+
+
+async def indexed_upload(file_hash: str):
+    """The upload index row of an upload, None if it is not stored
+
+    An upload indexed at startup without a usable digest record is verified
+    here on first use, unless verify_uploads got to it first.
+    """
+    upload = await run_io(upload_index().get, file_hash)
+    if upload is not None and upload["state"] == UPLOAD_UNVERIFIED:
+        state = await coalesce(
+            file_hash,
+            "verify",
+            functools.partial(
+                run_hash, verify_upload, __UPLOAD_DIR__, upload_index(), upload
+            ),
+        )
+        upload = None if state is None else {**upload, "state": state}
+    return upload
+
+
+async def stored_file_matches(file_hash: str):
+    """Whether a finished file with this hash is already stored
+
+    answered by the upload index, which marks an upload completed only once
+    its last chunk is verified and its digest matches the hash
+    """
+    upload = await indexed_upload(file_hash)
+    return upload is not None and upload["state"] == UPLOAD_COMPLETED
+
+
+def file_chunk_size(chunk_manager: BinaryChunkMapManager, file_size: int):
+    """Chunk size of a stored file, from its chunk map header,
+    a file without a chunk map is split as init_download would split it"""
+    if chunk_manager.chunk_size is not None:
+        return chunk_manager.chunk_size
+    return calculate_optimal_chunk_size(file_size)
+
+
+async def completed_upload(file_hash: str):
+    """The upload index row of a file that may be downloaded, 404 when it is
+    not stored and 409 while it is incomplete or failed verification"""
+    upload = await indexed_upload(file_hash)
+    if upload is None or not (upload_dir(file_hash) / f"{file_hash}").is_file():
+        raise HTTPException(status_code=404, detail="File not found")
+    if upload["state"] != UPLOAD_COMPLETED:
+        raise HTTPException(status_code=409, detail="File hash mismatch")
+    return upload
+
+
+async def remove_upload(file_hash: str):
+    """Delete an upload with its sidecars and index entries"""
+    await run_io(upload_collector().remove, file_hash)
+
+
+def insufficient_storage(file_size: int):
+    return JSONResponse(
+        {
+            "status": "error",
+            "message": "Not enough free space for this upload",
+            "file_size": file_size,
+            "quota_bytes": settings.upload_quota or None,
+        },
+        status_code=507,
+    )
+
+
+def chunk_in_progress():
+    # the client retries it, and then finds it marked or free again
+    return {
+        "status": "chunk_failed",
+        "message": "Chunk upload in progress",
+    }
+
+
+async def active_upload(file_hash: str):
+    """Count the upload as active while one of its chunk requests runs,
+    and record the activity for the garbage collector"""
+    await upload_collector().touch(file_hash)
+    with upload_session(file_hash):
+        yield
+
+
+async def record_chunks(
+    file_hash: str, chunk_manager: BinaryChunkMapManager, chunks: dict
+):
+    """Mark verified {offset: chunk_hash} complete, and once the upload is
+    complete settle its state in the upload index, see finish_upload"""
+    chunk_size = chunk_manager.chunk_size
+    invalidate_upload(file_hash)
+    # record the digests before the bits, a marked chunk always has its digest
+    manifest = ChunkHashManifest(f"{file_hash}", upload_dir(file_hash))
+    if manifest.exists():
+        await run_io(
+            manifest.set_digests,
+            {offset // chunk_size: digest for offset, digest in chunks.items()},
+        )
+    if settings.chunk_dedup:
+        file_size = (await run_io(os.stat, chunk_manager.data_file)).st_size
+        await run_io(
+            upload_chunk_index().add,
+            chunk_manager.hash_type,
+            file_hash,
+            {
+                offset: (digest, min(chunk_size, file_size - offset))
+                for offset, digest in chunks.items()
+            },
+        )
+    # a bit may only be set once its data is on disk, see settings.durability
+    await sync_data(chunk_manager.data_file)
+    await run_io(chunk_manager.mark_chunks, chunks)
+    if chunk_manager.is_complete():
+        await finish_upload(file_hash)
+
+
+async def finish_upload(file_hash: str):
+    """Settle the state of an upload whose every chunk is stored, returns its
+    upload index row
+
+    The row is unverified while the file is hashed, so a request failing
+    meanwhile leaves it to indexed_upload and verify_uploads to settle rather
+    than incomplete with every bit set.
+    """
+    invalidate_upload(file_hash)
+    await run_io(upload_index().set_state, file_hash, UPLOAD_UNVERIFIED)
+    return await indexed_upload(file_hash)
+
+
+def finished_upload_status(upload: dict):
+    if upload is not None and upload["state"] == UPLOAD_COMPLETED:
+        return {
+            "status": "completed",
+            "message": "File already exists",
+        }
+    return {
+        "status": "bad_file",
+        "message": "File hash mismatch",
+    }
+
+
+async def deduplicate_chunks(
+    file_hash: str, chunk_manager: BinaryChunkMapManager, chunk_hashes: List[str]
+):
+    """Copy chunks that other stored files already hold instead of receiving
+    them again, every copy is rehashed before it is marked complete
+
+    Returns the number of chunks copied.
+    """
+    file_path = upload_dir(file_hash) / f"{file_hash}"
+    chunk_size = chunk_manager.chunk_size
+    file_size = (await run_io(os.stat, file_path)).st_size
+    wanted = {
+        index
+        * chunk_size: (chunk_hash, min(chunk_size, file_size - index * chunk_size))
+        for index, chunk_hash in enumerate(chunk_hashes)
+    }
+    chunk_index = upload_chunk_index()
+    found = await run_io(
+        chunk_index.lookup, chunk_manager.hash_type, wanted, exclude=file_hash
+    )
+    digests = await asyncio.gather(
+        *(
+            run_io(
+                copy_chunk,
+                upload_dir(source) / source,
+                source_offset,
+                file_path,
+                offset,
+                wanted[offset][1],
+                chunk_manager.hash_type,
+            )
+            for offset, (source, source_offset) in found.items()
+        ),
+        return_exceptions=True,
+    )
+    copied, stale = {}, []
+    for (offset, location), digest in zip(found.items(), digests):
+        if digest == wanted[offset][0]:
+            copied[offset] = digest
+        else:
+            # the source was replaced or damaged since it was indexed
+            stale.append(location)
+    if stale:
+        await run_io(chunk_index.remove, stale)
+    if copied:
+        await record_chunks(file_hash, chunk_manager, copied)
+    return len(copied)
+
+
+async def write_stream(writer: ChunkWriter, stream, limit: int):
+    """Write a stream through a ChunkWriter in batches of buffer_stream,
+    returns False as soon as more than `limit` bytes were received"""
+    async for pieces, size in buffer_stream(stream):
+        if writer.size + size > limit:
+            return False
+        await run_io(writer.write, pieces)
+    return True
+
+
+async def read_chunk_digests(file_hash: str, offsets: List[int], chunk_size: int):
+    """Map chunk offsets to hashes from the manifest, only chunks without a
+    recorded digest are hashed from disk (and recorded once verified)"""
+    file_path = upload_dir(file_hash) / f"{file_hash}"
+    chunk_manager = BinaryChunkMapManager(f"{file_hash}", upload_dir(file_hash))
+    manifest = ChunkHashManifest(f"{file_hash}", upload_dir(file_hash))
+    if not manifest.exists() and chunk_manager.chunk_size is not None:
+        # uploads from before the manifest existed get one on first use
+        await run_io(
+            manifest.initialize, chunk_manager.total_chunks, chunk_manager.hash_type
+        )
+
+    digests = {}
+    if manifest.exists():
+        recorded = await run_io(
+            manifest.get_digests, [offset // chunk_size for offset in offsets]
+        )
+        digests = {offset: recorded.get(offset // chunk_size) for offset in offsets}
+
+    missing = [offset for offset in offsets if digests.get(offset) is None]
+    hashes = await asyncio.gather(
+        *(
+            run_hash(
+                calculate_chunk_hash,
+                file_path,
+                offset,
+                chunk_size,
+                chunk_manager.hash_type,
+            )
+            for offset in missing
+        )
+    )
+    for offset, chunk_hash in zip(missing, hashes):
+        digests[offset] = chunk_hash
+        if manifest.exists() and chunk_manager.get_chunk_status(offset):
+            manifest.set_digest(offset // chunk_size, chunk_hash)
+    return digests
+
+
 @app.post("/upload/init")
 async def init_upload(
     file_size: int,
     file_hash: str,
+    chunk_format: ChunkFormat = "list",
+    hash_mode: HashMode = "file",
+    hash_type: str = HASH_METHOD,
+    chunk_size: int = None,
+    bandwidth: int = None,
+    chunk_hashes: List[str] = Body(None),
 ):
-    file_path = __UPLOAD_DIR__ / f"{file_hash}"
-    # Check if file already exists with matching hash
+    """Start or resume an upload
+
+    hash_type is negotiated from settings.allowed_hash_types and applies to the
+    file hash and every chunk hash, a resumed upload keeps the hash type and
+    hash mode recorded in its chunk map header.
+
+    chunk_size is picked per upload from file_size and the optional client
+    bandwidth hint (bytes/s), unless the client asks for one, and is kept in
+    the chunk map header too. A "tree" file_hash, or a chunk_hashes body, is
+    built over chunks the client already cut, so then CHUNK_SIZE is used
+    unless told otherwise.
+
+    chunk_hashes (JSON body, in chunk order) lets chunks already stored by
+    other uploads be copied on the server instead of being sent again.
+    """
+    # Check if file already exists with matching hash, from the upload index
     # Not support dir yet
-    if file_path.is_file():
-        # there is no need to repleace a file with another file having the same hash
-        if calculate_hash(file_path) == file_hash:
+    upload = await indexed_upload(file_hash)
+    if upload is not None:
+        chunk_manager = BinaryChunkMapManager(f"{file_hash}", upload_dir(file_hash))
+        if upload["state"] == UPLOAD_COMPLETED:
+            # there is no need to repleace a file with another file having the same hash
             return {
                 "status": "completed",
                 "message": "File already exists",
             }
         else:
             # check if there is a incomplete upload task
-            chunk_manager = BinaryChunkMapManager(f"{file_hash}", __UPLOAD_DIR__)
             try:
                 chunk_manager.check_init()
+                if chunk_manager.is_complete():
+                    # every chunk is stored but the upload was never settled
+                    return finished_upload_status(await finish_upload(file_hash))
+                await upload_collector().touch(file_hash)
+                # a resumed upload keeps the hash mode it was started with
                 return {
                     "status": "incomplete",
                     "message": "Upload not finish",
-                    "chunk_size": CHUNK_SIZE,
-                    "hash": HASH_METHOD,
-                    "chunks": chunk_manager.get_incomplete_chunks(),
+                    "chunk_size": chunk_manager.chunk_size,
+                    "hash": chunk_manager.hash_type,
+                    "hash_mode": chunk_manager.hash_mode,
+                    "chunk_format": chunk_format,
+                    "chunks": incomplete_chunks(chunk_manager, chunk_format),
                 }
             except Exception:
                 # there is not a valid chunk map, so this is a new upload task
                 pass
+    if hash_type not in settings.allowed_hash_types:
+        return {
+            "status": "error",
+            "message": f"Hash method {hash_type} not allowed",
+            "hash_types": settings.allowed_hash_types,
+        }
+    if chunk_size is None:
+        if hash_mode == "tree" or chunk_hashes is not None:
+            chunk_size = CHUNK_SIZE
+        else:
+            chunk_size = calculate_optimal_chunk_size(file_size, bandwidth)
+    elif not settings.min_chunk_size <= chunk_size <= settings.max_chunk_size:
+        return {
+            "status": "error",
+            "message": f"Chunk size {chunk_size} out of range",
+            "min_chunk_size": settings.min_chunk_size,
+            "max_chunk_size": settings.max_chunk_size,
+        }
+    if chunk_hashes is not None and len(chunk_hashes) != -(-file_size // chunk_size):
+        return {
+            "status": "error",
+            "message": "One chunk hash per chunk expected",
+        }
+
+    # reject up front rather than run out of space mid-upload
+    if not await run_io(upload_collector().make_room, file_size):
+        return insufficient_storage(file_size)
+
     # Create empty file with hash as name
-    chunk_manager = setup_file_and_chunk_map(
-        f"{file_hash}",
-        __UPLOAD_DIR__,
-        file_size,
-        CHUNK_SIZE,
+    VerifiedDigestRecord(f"{file_hash}", upload_dir(file_hash)).invalidate()
+    invalidate_upload(file_hash)
+    if settings.chunk_dedup:
+        await run_io(upload_chunk_index().forget_file, file_hash)
+    try:
+        chunk_manager = await run_io(
+            setup_file_and_chunk_map,
+            f"{file_hash}",
+            upload_dir(file_hash, create=True),
+            file_size,
+            chunk_size,
+            hash_mode,
+            hash_type,
+        )
+    except OSError as e:
+        if e.errno != errno.ENOSPC:
+            raise
+        # another upload took the space since the check
+        await remove_upload(file_hash)
+        return insufficient_storage(file_size)
+    await run_io(
+        upload_index().put, file_hash, file_size, chunk_size, hash_type, hash_mode
     )
+    count_upload_started()
+    deduplicated = 0
+    if chunk_hashes and settings.chunk_dedup:
+        deduplicated = await deduplicate_chunks(file_hash, chunk_manager, chunk_hashes)
+    if file_size == 0:
+        # an empty file has no chunk to send, so it is settled right away
+        return finished_upload_status(await finish_upload(file_hash))
 
     # Generate chunk ranges map and return
     return {
         "status": "incomplete",
         "message": "multi-part upload task ready",
-        "chunk_size": CHUNK_SIZE,
-        "hash": HASH_METHOD,
-        "chunks": chunk_manager.get_incomplete_chunks(),
+        "chunk_size": chunk_manager.chunk_size,
+        "hash": hash_type,
+        "hash_mode": hash_mode,
+        "deduplicated_chunks": deduplicated,
+        "chunk_format": chunk_format,
+        "chunks": incomplete_chunks(chunk_manager, chunk_format),
     }
 
 
-@app.post("/upload/chunk")
+@app.post("/upload/chunk", dependencies=[Depends(active_upload)])
 async def upload_chunk(
     file_hash: str,
     chunk_hash: str,
@@ -84,179 +553,616 @@ async def upload_chunk(
         offset (int): the offset of current chunk
         chunk (UploadFile, optional): _description_. Defaults to File(...).
     """
-    file_path = __UPLOAD_DIR__ / f"{file_hash}"
-    chunk_manager = BinaryChunkMapManager(f"{file_hash}", __UPLOAD_DIR__)
+    file_path = upload_dir(file_hash) / f"{file_hash}"
+    chunk_manager = BinaryChunkMapManager(f"{file_hash}", upload_dir(file_hash))
+    if chunk_manager.chunk_size is None:
+        return {
+            "status": "error",
+            "message": "Upload not initialized",
+        }
     if chunk_manager.is_complete():
         return {
             "status": "completed",
-            "message": "Upload ",
+            "message": "Upload already finished",
         }
-    if chunk_hash == calculate_hash(fileIO=chunk.file):
-        chunk.file.seek(0)
-        write_chunk_to_position(file_path, offset, chunk.file.read())
-        chunk_manager.mark_chunk(offset, complete=True)
+    count_received(chunk.size or 0)
+    # checked before anything is written, like the raw and batch endpoints,
+    # an offset past the end would grow the file and a short chunk leave a hole
+    chunk_size = chunk_manager.chunk_size
+    file_end = (await run_io(os.stat, file_path)).st_size
+    if offset % chunk_size or not 0 <= offset < file_end:
+        raise HTTPException(status_code=400, detail="Invalid chunk offset")
+    length = min(chunk_size, file_end - offset)
+    if chunk.size != length:
+        raise HTTPException(
+            status_code=400, detail=f"Chunk of {chunk.size} bytes, {length} expected"
+        )
+    with claim_chunk(file_hash, offset) as claimed:
+        if not claimed:
+            return chunk_in_progress()
+        if chunk_manager.get_chunk_status(offset):
+            # never overwrite a verified chunk with data that is not verified yet
+            return {
+                "status": "chunk_completed",
+                "message": "Chunk already uploaded",
+            }
+        if chunk_hash != await run_io(
+            calculate_hash, fileIO=chunk.file, hash_type=chunk_manager.hash_type
+        ):
+            return {
+                "status": "chunk_failed",
+                "message": "Chunk upload failed",
+            }
+        await chunk.seek(0)
+        await run_io(write_chunk_to_position, file_path, offset, await chunk.read())
+        await record_chunks(file_hash, chunk_manager, {offset: chunk_hash})
+    return {
+        "status": "chunk_completed",
+        "message": "Chunk upload finished",
+    }
+
+
+@app.post("/upload/chunk/raw", dependencies=[Depends(active_upload)])
+async def upload_chunk_raw(
+    file_hash: str,
+    chunk_hash: str,
+    offset: int,
+    request: Request,
+):
+    """stream the raw request body (application/octet-stream) into the file at
+        offset with os.pwrite, hashing it on the way,
+        the chunk is only marked in the bitmap if the digest matches
+
+    Args:
+        file_hash (str): the hash of total file
+        chunk_hash (str): the hash of current chunk
+        offset (int): the offset of current chunk
+        request (Request): the request whose body is the chunk data
+    """
+    file_path = upload_dir(file_hash) / f"{file_hash}"
+    chunk_manager = BinaryChunkMapManager(f"{file_hash}", upload_dir(file_hash))
+    if chunk_manager.chunk_size is None:
         return {
-            "status": "chunk_completed",
-            "message": "Chunk upload finished",
+            "status": "error",
+            "message": "Upload not initialized",
         }
-    else:
+    if chunk_manager.is_complete():
+        return {
+            "status": "completed",
+            "message": "Upload already finished",
+        }
+    if offset % chunk_manager.chunk_size or not (
+        0 <= offset < chunk_manager.total_chunks * chunk_manager.chunk_size
+    ):
         return {
             "status": "chunk_failed",
-            "message": "Chunk upload failed",
+            "message": "Invalid chunk offset",
         }
-    pass
+    with claim_chunk(file_hash, offset) as claimed:
+        if not claimed:
+            return chunk_in_progress()
+        if chunk_manager.get_chunk_status(offset):
+            # never overwrite a verified chunk with data that is not verified yet
+            return {
+                "status": "chunk_completed",
+                "message": "Chunk already uploaded",
+            }
+        file_end = (await run_io(os.stat, file_path)).st_size
+        length = min(chunk_manager.chunk_size, file_end - offset)
 
+        with ChunkWriter(file_path, offset, chunk_manager.hash_type) as writer:
+            if not await write_stream(writer, request.stream(), length):
+                return {
+                    "status": "chunk_failed",
+                    "message": "Chunk larger than expected",
+                }
+        if writer.size != length:
+            # a short chunk would complete the upload with a hole in it
+            return {
+                "status": "chunk_failed",
+                "message": f"Chunk of {writer.size} bytes, {length} expected",
+            }
 
-@app.get("/upload/status/{file_hash}")
-async def get_upload_status(file_hash: str):
-    file_path = __UPLOAD_DIR__ / f"{file_hash}"
+        if writer.hexdigest() != chunk_hash:
+            return {
+                "status": "chunk_failed",
+                "message": "Chunk upload failed",
+            }
+        await record_chunks(file_hash, chunk_manager, {offset: chunk_hash})
+    return {
+        "status": "chunk_completed",
+        "message": "Chunk upload finished",
+    }
 
-    chunk_manager = BinaryChunkMapManager(f"{file_hash}", __UPLOAD_DIR__)
-    if not chunk_manager.is_complete():
+
+@app.post("/upload/chunks", dependencies=[Depends(active_upload)])
+async def upload_chunks(file_hash: str, request: Request):
+    """stream many chunks in one request body, each as a frame of
+        offset, length and chunk hash followed by the chunk data
+        (see mp_server.framing), every verified chunk is written with
+        os.pwrite and the bitmap is updated once for the whole batch
+
+    Args:
+        file_hash (str): the hash of total file
+        request (Request): the request whose body is the chunk frames
+
+    Returns:
+        dict: batch status and one result per frame, in body order
+    """
+    file_path = upload_dir(file_hash) / f"{file_hash}"
+    chunk_manager = BinaryChunkMapManager(f"{file_hash}", upload_dir(file_hash))
+    if chunk_manager.chunk_size is None:
         return {
-            "status": "incomplete",
-            "message": "Upload not finish",
-            "chunk_size": CHUNK_SIZE,
-            "hash": HASH_METHOD,
-            "chunks": chunk_manager.get_incomplete_chunks(),
+            "status": "error",
+            "message": "Upload not initialized",
         }
-    else:
-        # check hash of the total file
-        if calculate_hash(file_path) == file_hash:
+    if chunk_manager.is_complete():
+        return {
+            "status": "completed",
+            "message": "Upload already finished",
+        }
+    chunk_size = chunk_manager.chunk_size
+    file_end = (await run_io(os.stat, file_path)).st_size
+
+    reader = FrameReader(request.stream())
+    results, completed, claimed = [], {}, set()
+    status, message = "batch_completed", "Chunk batch finished"
+    # the written chunks stay claimed until the batch is marked
+    with ExitStack() as claims:
+        try:
+            while (frame := await reader.next_frame()) is not None:
+                offset, chunk_hash, length = frame
+                if (
+                    offset % chunk_size
+                    or not 0 <= offset < file_end
+                    or length != min(chunk_size, file_end - offset)
+                ):
+                    await reader.skip_payload(length)
+                    results.append(
+                        (offset, "chunk_failed", "Invalid chunk offset or size")
+                    )
+                    continue
+                if offset in completed:
+                    await reader.skip_payload(length)
+                    results.append(
+                        (offset, "chunk_completed", "Chunk already uploaded")
+                    )
+                    continue
+                if offset not in claimed and not claims.enter_context(
+                    claim_chunk(file_hash, offset)
+                ):
+                    await reader.skip_payload(length)
+                    results.append((offset, "chunk_failed", "Chunk upload in progress"))
+                    continue
+                claimed.add(offset)
+                if chunk_manager.get_chunk_status(offset):
+                    # never overwrite a verified chunk with data that is not verified yet
+                    await reader.skip_payload(length)
+                    results.append(
+                        (offset, "chunk_completed", "Chunk already uploaded")
+                    )
+                    continue
+                with ChunkWriter(file_path, offset, chunk_manager.hash_type) as writer:
+                    await write_stream(writer, reader.iter_payload(length), length)
+                if writer.hexdigest() != chunk_hash:
+                    results.append((offset, "chunk_failed", "Chunk upload failed"))
+                    continue
+                completed[offset] = chunk_hash
+                results.append((offset, "chunk_completed", "Chunk upload finished"))
+        except FramingError as e:
+            # chunks verified before the broken frame are still kept
+            status, message = "error", str(e)
+
+        if completed:
+            await record_chunks(file_hash, chunk_manager, completed)
+    return {
+        "status": status,
+        "message": message,
+        "results": [
+            {"offset": offset, "status": chunk_status, "message": chunk_message}
+            for offset, chunk_status, chunk_message in results
+        ],
+    }
+
+
+@app.get("/upload/delta/signature")
+async def get_delta_signature(base_hash: str, block_size: int = None):
+    """
+    Rolling checksum signature of a stored file, for a delta upload against it.
+
+    Args:
+        base_hash (str): The hash of the stored base file
+        block_size (int, optional): Signature block size, about sqrt(file size)
+                                    by default
+
+    Returns:
+        dict: Status, block size and one [adler32, strong hash] per block
+    """
+    file_path = upload_dir(base_hash) / f"{base_hash}"
+    if not await stored_file_matches(base_hash):
+        return {
+            "status": "error",
+            "message": "Base file not found",
+        }
+    file_size = (await run_io(os.stat, file_path)).st_size
+    if block_size is None:
+        block_size = signature_block_size(file_size)
+    elif block_size <= 0:
+        return {
+            "status": "error",
+            "message": "Invalid block size",
+        }
+    hash_type = BinaryChunkMapManager(f"{base_hash}", upload_dir(base_hash)).hash_type
+    return {
+        "status": "success",
+        "file_size": file_size,
+        "block_size": block_size,
+        "hash": hash_type,
+        "signature": await run_hash(file_signature, file_path, block_size, hash_type),
+    }
+
+
+@app.post("/upload/delta", dependencies=[Depends(active_upload)])
+async def upload_delta(
+    file_hash: str,
+    file_size: int,
+    base_hash: str,
+    block_size: int,
+    request: Request,
+    hash_mode: HashMode = "file",
+    hash_type: str = HASH_METHOD,
+):
+    """rebuild a new version of a stored file from a delta body,
+        a stream of ops to copy base blocks or insert literal bytes
+        (see mp_server.delta), computed against /upload/delta/signature
+
+    The rebuilt file is verified against file_hash before it is moved to its
+    hash path, then it gets a complete chunk map and chunk hash manifest, as
+    if every chunk had been uploaded.
+
+    Args:
+        file_hash (str): the hash of the new file
+        file_size (int): the size of the new file
+        base_hash (str): the hash of the stored base file
+        block_size (int): the block size of the signature the delta was built on
+        request (Request): the request whose body is the delta
+    """
+    file_path = upload_dir(file_hash) / f"{file_hash}"
+    if await stored_file_matches(file_hash):
+        return {
+            "status": "completed",
+            "message": "File already exists",
+        }
+    if hash_type not in settings.allowed_hash_types:
+        return {
+            "status": "error",
+            "message": f"Hash method {hash_type} not allowed",
+            "hash_types": settings.allowed_hash_types,
+        }
+    if block_size <= 0 or not await stored_file_matches(base_hash):
+        return {
+            "status": "error",
+            "message": "Base file not found",
+        }
+
+    if not await run_io(upload_collector().make_room, file_size):
+        return insufficient_storage(file_size)
+
+    # rebuild next to the upload, so the final move is a rename
+    fd, tmp_file = tempfile.mkstemp(
+        dir=upload_dir(file_hash, create=True), prefix=f".{file_hash}.", suffix=".delta"
+    )
+    os.close(fd)
+    try:
+        try:
+            size = await apply_delta(
+                request.stream(),
+                upload_dir(base_hash) / f"{base_hash}",
+                tmp_file,
+                block_size,
+                file_size,
+            )
+        except FramingError as e:
             return {
-                "status": "completed",
-                "message": "File already exists",
+                "status": "error",
+                "message": str(e),
             }
-        else:
+        if size != file_size:
+            return {
+                "status": "bad_file",
+                "message": "File size mismatch",
+            }
+
+        chunk_size = (
+            CHUNK_SIZE
+            if hash_mode == "tree"
+            else calculate_optimal_chunk_size(file_size)
+        )
+        digest, chunk_digests = await run_hash(
+            hash_file_chunks, tmp_file, chunk_size, hash_type
+        )
+        if hash_mode == "tree":
+            digest = merkle_root(
+                [bytes.fromhex(chunk_digest) for chunk_digest in chunk_digests],
+                file_size,
+                chunk_size,
+                hash_type,
+            )
+        if digest != file_hash:
             return {
                 "status": "bad_file",
                 "message": "File hash mismatch",
             }
 
+        record = VerifiedDigestRecord(f"{file_hash}", upload_dir(file_hash))
+        record.invalidate()
+        if settings.chunk_dedup:
+            await run_io(upload_chunk_index().forget_file, file_hash)
+        await run_io(os.replace, tmp_file, file_path)
+    finally:
+        if os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+
+    chunk_manager = BinaryChunkMapManager(f"{file_hash}", upload_dir(file_hash))
+    await run_io(
+        chunk_manager.initialize_map, file_size, chunk_size, True, hash_mode, hash_type
+    )
+    manifest = ChunkHashManifest(f"{file_hash}", upload_dir(file_hash))
+    await run_io(manifest.initialize, chunk_manager.total_chunks, hash_type, True)
+    # the file was hashed above, so the record is filled before the chunks
+    # are marked and completion does not hash it again
+    await run_io(record.store, digest, digest_record_type(hash_type, hash_mode))
+    await run_io(
+        upload_index().put, file_hash, file_size, chunk_size, hash_type, hash_mode
+    )
+    await record_chunks(
+        file_hash,
+        chunk_manager,
+        {
+            index * chunk_size: chunk_digest
+            for index, chunk_digest in enumerate(chunk_digests)
+        },
+    )
+    return {
+        "status": "completed",
+        "message": "File rebuilt from delta",
+        "chunk_size": chunk_size,
+        "hash": hash_type,
+        "hash_mode": hash_mode,
+    }
+
+
+@app.get("/upload/status/{file_hash}")
+async def get_upload_status(file_hash: str, chunk_format: ChunkFormat = "list"):
+    """State of an upload, from the upload index
+
+    A finished upload is hashed once, by record_chunks or indexed_upload,
+    never per status poll.
+    """
+    upload = await indexed_upload(file_hash)
+    if upload is not None and upload["state"] != UPLOAD_INCOMPLETE:
+        return finished_upload_status(upload)
+    chunk_manager = BinaryChunkMapManager(f"{file_hash}", upload_dir(file_hash))
+    return {
+        "status": "incomplete",
+        "message": "Upload not finish",
+        "chunk_size": chunk_manager.chunk_size,
+        "hash": chunk_manager.hash_type,
+        "hash_mode": chunk_manager.hash_mode,
+        "chunk_format": chunk_format,
+        "chunks": incomplete_chunks(chunk_manager, chunk_format),
+    }
+
 
 @app.post("/upload/verify-chunks")
-async def verify_chunks(file_hash: str, chunk_hashes: dict):
+async def verify_chunks(
+    file_hash: str,
+    chunk_hashes: dict,
+    chunk_format: ChunkFormat = "list",
+    deep: bool = False,
+):
     """
     Verify chunk hashes and reset bitmap for bad chunks.
 
     Args:
         file_hash (str): The hash of the total file
         chunk_hashes (dict): Dictionary mapping offset to chunk hash
+        chunk_format (str): "list" of offsets or "ranges" of [start, end) offsets
+        deep (bool): reread and rehash the chunks from disk instead of
+                     comparing against the recorded chunk hash manifest
 
     Returns:
         dict: Status and list of incomplete chunks
     """
-    chunk_manager = BinaryChunkMapManager(file_hash, __UPLOAD_DIR__)
-
-    # Check each provided chunk hash
-    for offset_str, chunk_hash in chunk_hashes.items():
-        offset = int(offset_str)
+    chunk_manager = BinaryChunkMapManager(file_hash, upload_dir(file_hash))
 
-        # Read the chunk data from file
-        file_path = __UPLOAD_DIR__ / f"{file_hash}"
-        with open(file_path, "rb") as f:
-            f.seek(offset)
-            chunk_data = f.read(CHUNK_SIZE)  # Assuming fixed chunk size
+    file_path = upload_dir(file_hash) / f"{file_hash}"
+    offsets = [int(offset_str) for offset_str in chunk_hashes]
+    chunk_size = chunk_manager.chunk_size
 
-        # Calculate actual chunk hash
-        actual_hash = calculate_hash(chunk_data)
-
-        # If hash doesn't match, mark chunk as incomplete
-        if actual_hash != chunk_hash:
-            chunk_manager.mark_chunk(offset, complete=False)
+    if deep:
+        # Calculate actual chunk hashes in parallel on the hash pool
+        actual_hashes = await asyncio.gather(
+            *(
+                run_hash(
+                    calculate_chunk_hash,
+                    file_path,
+                    offset,
+                    chunk_size,
+                    chunk_manager.hash_type,
+                )
+                for offset in offsets
+            )
+        )
+    else:
+        recorded = await read_chunk_digests(file_hash, offsets, chunk_size)
+        actual_hashes = [recorded[offset] for offset in offsets]
+    # Check each provided chunk hash
+    bad_offsets = [
+        offset
+        for offset, chunk_hash, actual_hash in zip(
+            offsets, chunk_hashes.values(), actual_hashes
+        )
+        if actual_hash != chunk_hash
+    ]
+    if bad_offsets:
+        # the same reset as for the bad chunks a scrub finds
+        await run_io(
+            upload_scrubber().reset_chunks,
+            file_hash,
+            [offset // chunk_size for offset in bad_offsets],
+            bad_offsets,
+        )
 
     # Return all incomplete chunks
     return {
         "status": "incomplete",
-        "chunk_size": CHUNK_SIZE,
-        "hash": HASH_METHOD,
-        "incomplete_chunks": chunk_manager.get_incomplete_chunks(),
+        "chunk_size": chunk_size,
+        "hash": chunk_manager.hash_type,
+        "chunk_format": chunk_format,
+        "incomplete_chunks": incomplete_chunks(chunk_manager, chunk_format),
     }
 
 
 @app.get("/download/init")
-async def init_download(file_hash: str):
-    """Initialize download by checking file existence and returning chunk information"""
-    file_path = __UPLOAD_DIR__ / f"{file_hash}"
+async def init_download(file_hash: str, chunk_format: ChunkFormat = "list"):
+    """Initialize download by checking file existence and returning chunk information,
+    answered by the upload index without touching the file, concurrent
+    identical requests share one answer (see SingleFlight)"""
+    return await coalesce(
+        file_hash,
+        ("download/init", chunk_format),
+        functools.partial(download_info, file_hash, chunk_format),
+    )
+
+
+async def download_info(file_hash: str, chunk_format: ChunkFormat):
+    upload = await indexed_upload(file_hash)
 
     # Check if file exists
-    if not file_path.is_file():
+    if upload is None:
         return {
             "status": "error",
             "message": "File not found",
         }
 
-    # Verify file integrity
-    if calculate_hash(file_path) != file_hash:
+    # Verify file integrity, settled when its last chunk was verified
+    if upload["state"] != UPLOAD_COMPLETED:
         return {
             "status": "error",
             "message": "File hash mismatch",
         }
 
-    # Get file size
-    file_size = file_path.stat().st_size
-
-    # Create chunk manager to get chunk information
-    chunk_manager = BinaryChunkMapManager(f"{file_hash}", __UPLOAD_DIR__)
-    try:
-        chunk_manager.check_init()
-    except Exception:
-        # If no chunk map exists, create one
-        setup_file_and_chunk_map(f"{file_hash}", __UPLOAD_DIR__, file_size, CHUNK_SIZE)
-        chunk_manager = BinaryChunkMapManager(f"{file_hash}", __UPLOAD_DIR__)
+    file_size = upload["file_size"]
+    chunk_size = upload["chunk_size"]
+    total_chunks = upload["total_chunks"]
+    manifest = ChunkHashManifest(f"{file_hash}", upload_dir(file_hash))
+    if chunk_format == "ranges":
+        chunks = [[0, file_size]] if total_chunks else []
+    else:
+        chunks = [i * chunk_size for i in range(total_chunks)]
 
     return {
         "status": "ready",
         "message": "Download ready",
         "file_size": file_size,
-        "chunk_size": CHUNK_SIZE,
-        "hash": HASH_METHOD,
-        "total_chunks": (file_size + CHUNK_SIZE - 1) // CHUNK_SIZE,
-        "chunks": [
-            i * CHUNK_SIZE for i in range((file_size + CHUNK_SIZE - 1) // CHUNK_SIZE)
-        ],  # All chunk offsets
+        "chunk_size": chunk_size,
+        "hash": upload["hash_type"],
+        "hash_mode": upload["hash_mode"],
+        "total_chunks": total_chunks,
+        "chunk_format": chunk_format,
+        "chunks": chunks,  # All chunk offsets
+        # None until every chunk digest is recorded in the manifest
+        "merkle_root": (
+            await run_io(manifest.merkle_root, file_size, chunk_size)
+            if manifest.exists()
+            else None
+        ),
     }
 
 
 @app.get("/download/chunk")
 async def download_chunk(file_hash: str, offset: int):
-    """Download a specific chunk of the file"""
-    file_path = __UPLOAD_DIR__ / f"{file_hash}"
+    """Download a specific chunk of the file as application/octet-stream,
+    the chunk hash is sent in the X-Chunk-Hash header"""
+    file_path = upload_dir(file_hash) / f"{file_hash}"
 
-    # Check if file exists
-    if not file_path.is_file():
-        return {
-            "status": "error",
-            "message": "File not found",
-        }
+    # Check the file exists and is verified, from the upload index
+    await completed_upload(file_hash)
 
-    try:
-        # Read chunk data from file
-        with open(file_path, "rb") as f:
-            f.seek(offset)
-            chunk_data = f.read(CHUNK_SIZE)
+    file_size = (await run_io(os.stat, file_path)).st_size
+    chunk_manager = BinaryChunkMapManager(f"{file_hash}", upload_dir(file_hash))
+    chunk_size = file_chunk_size(chunk_manager, file_size)
+    if offset % chunk_size or not 0 <= offset < file_size:
+        raise HTTPException(status_code=400, detail="Invalid chunk offset")
+    end = min(offset + chunk_size, file_size)
 
-        # Calculate chunk hash for verification
-        chunk_hash = calculate_hash(chunk_data)
+    # Chunk hash for verification, from the manifest when recorded
+    chunk_hash = (await read_chunk_digests(file_hash, [offset], chunk_size))[offset]
 
-        return {
-            "status": "chunk_ready",
-            "chunk_hash": chunk_hash,
-            "offset": offset,
-            "size": len(chunk_data),
-            "data": chunk_data,  # This would be the binary data
-        }
-    except Exception as e:
-        return {
-            "status": "error",
-            "message": f"Failed to read chunk: {str(e)}",
-        }
+    return FileRangeResponse(
+        file_path,
+        offset,
+        end,
+        file_size,
+        headers={
+            "x-chunk-hash": chunk_hash,
+            "x-hash-method": chunk_manager.hash_type,
+        },
+    )
+
+
+@app.api_route("/download/file/{file_hash}", methods=["GET", "HEAD"])
+async def download_file(file_hash: str, request: Request):
+    """Download the file, or one byte range of it with the Range header
+
+    If-Range is honored against the ETag (the file hash) or Last-Modified,
+    a range covering exactly one chunk carries its hash in X-Chunk-Hash.
+    """
+    file_path = upload_dir(file_hash) / f"{file_hash}"
+
+    # Check the file exists and is verified, from the upload index, which
+    # verify-chunks and the scrubber reset when a chunk goes bad
+    await completed_upload(file_hash)
+
+    stat_result = await run_io(os.stat, file_path)
+    file_size = stat_result.st_size
+    headers = file_validators(file_hash, stat_result)
+
+    http_range = request.headers.get("range")
+    http_if_range = request.headers.get("if-range")
+    if http_range is None or (
+        http_if_range is not None and http_if_range not in headers.values()
+    ):
+        return FileRangeResponse(file_path, 0, file_size, file_size, headers=headers)
+
+    try:
+        byte_range = parse_range_header(http_range, file_size)
+    except RangeNotSatisfiable:
+        return Response(
+            status_code=416, headers={"content-range": f"bytes */{file_size}"}
+        )
+    if byte_range is None:
+        return FileRangeResponse(file_path, 0, file_size, file_size, headers=headers)
+
+    start, end = byte_range
+    chunk_manager = BinaryChunkMapManager(f"{file_hash}", upload_dir(file_hash))
+    chunk_size = file_chunk_size(chunk_manager, file_size)
+    if start % chunk_size == 0 and end == min(start + chunk_size, file_size):
+        headers["x-chunk-hash"] = (
+            await read_chunk_digests(file_hash, [start], chunk_size)
+        )[start]
+        headers["x-hash-method"] = chunk_manager.hash_type
+    return FileRangeResponse(
+        file_path, start, end, file_size, status_code=206, headers=headers
+    )
 
 
 @app.get("/download/chunk-hashes")
 async def get_chunk_hashes(file_hash: str, offsets: List[int] = Query([])):
     """
-    Get hash values for specified chunks or all chunks of a file.
+    Get hash values for specified chunks or all chunks of a file,
+    concurrent identical requests share one answer (see SingleFlight).
 
     Args:
         file_hash (str): The hash of the file
@@ -266,7 +1172,15 @@ async def get_chunk_hashes(file_hash: str, offsets: List[int] = Query([])):
     Returns:
         dict: Status and chunk hashes mapping offset to hash
     """
-    file_path = __UPLOAD_DIR__ / f"{file_hash}"
+    return await coalesce(
+        file_hash,
+        ("download/chunk-hashes", tuple(offsets)),
+        functools.partial(chunk_hashes_info, file_hash, offsets),
+    )
+
+
+async def chunk_hashes_info(file_hash: str, offsets: List[int]):
+    file_path = upload_dir(file_hash) / f"{file_hash}"
 
     # Check if file exists
     if not file_path.is_file():
@@ -278,6 +1192,8 @@ async def get_chunk_hashes(file_hash: str, offsets: List[int] = Query([])):
     try:
         # Get file size
         file_size = file_path.stat().st_size
+        chunk_manager = BinaryChunkMapManager(f"{file_hash}", upload_dir(file_hash))
+        chunk_size = file_chunk_size(chunk_manager, file_size)
 
         # Determine which offsets to process
         # if offsets:
@@ -292,29 +1208,28 @@ async def get_chunk_hashes(file_hash: str, offsets: List[int] = Query([])):
         # ]
 
         target_offsets = (
-            [i * CHUNK_SIZE for i in range((file_size + CHUNK_SIZE - 1) // CHUNK_SIZE)]
+            [i * chunk_size for i in range((file_size + chunk_size - 1) // chunk_size)]
             if not offsets
             else offsets
         )
 
-        # Calculate hash for each requested chunk
-        chunk_hashes = {}
-        with open(file_path, "rb") as f:
-            for offset in target_offsets:
-                # Validate offset is within file bounds
-                if offset >= file_size:
-                    continue
+        # Validate offsets are within file bounds
+        target_offsets = [offset for offset in target_offsets if offset < file_size]
 
-                f.seek(offset)
-                chunk_data = f.read(CHUNK_SIZE)
-                chunk_hash = calculate_hash(chunk_data)
-                chunk_hashes[offset] = chunk_hash
+        # Hashes come from the manifest, only unrecorded chunks are rehashed
+        chunk_hashes = await read_chunk_digests(file_hash, target_offsets, chunk_size)
 
+        manifest = ChunkHashManifest(f"{file_hash}", upload_dir(file_hash))
         return {
             "status": "success",
-            "chunk_size": CHUNK_SIZE,
-            "hash": HASH_METHOD,
+            "chunk_size": chunk_size,
+            "hash": chunk_manager.hash_type,
             "chunk_hashes": chunk_hashes,
+            "merkle_root": (
+                await run_io(manifest.merkle_root, file_size, chunk_size)
+                if manifest.exists()
+                else None
+            ),
         }
     except Exception as e:
         return {
@@ -323,6 +1238,57 @@ async def get_chunk_hashes(file_hash: str, offsets: List[int] = Query([])):
         }
 
 
+@app.post("/scrub/start")
+async def start_scrub():
+    """Start re-verifying every completed upload in the background,
+    progress is reported by /scrub/status"""
+    scrubber = upload_scrubber()
+    if scrubber.running():
+        return {"status": "running", "message": "A scrub is already running"}
+    scrubber.start()
+    return {"status": "started"}
+
+
+@app.get("/scrub/status")
+async def get_scrub_status():
+    """Progress of the running scrub, or the report of the last one,
+    whichever worker ran it"""
+    return await run_io(upload_scrubber().load_report)
+
+
+@app.get("/storage")
+async def get_storage():
+    """Bytes used by completed uploads and reserved by incomplete ones,
+    against the quota and the free space of the upload volume"""
+    return await run_io(upload_collector().usage)
+
+
+@app.post("/storage/gc")
+async def collect_garbage():
+    """Remove expired incomplete uploads now, instead of on the next
+    settings.gc_interval"""
+    evicted = await run_io(upload_collector().collect)
+    return {
+        "status": "success",
+        "evicted": evicted,
+        "storage": await run_io(upload_collector().usage),
+    }
+
+
+@app.get("/admission")
+async def get_admission():
+    """Chunk writes and bytes admitted in this worker, writes waiting for
+    room, and how many were admitted or turned away with a 503"""
+    return __admission__.stats()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Hot-path timings, byte counts and upload counters of this worker
+    in the Prometheus text format"""
+    return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     import uvicorn
 
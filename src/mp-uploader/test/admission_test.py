@@ -0,0 +1,55 @@
+import asyncio
+
+from mp_server.admission import AdmissionController
+
+
+def controller(wait=0.05, **limits):
+    return AdmissionController(
+        limits.get("max_writes", 0),
+        limits.get("max_bytes", 0),
+        limits.get("max_file_writes", 0),
+        limits.get("max_file_bytes", 0),
+        wait,
+    )
+
+
+def test_write_over_the_limit_times_out():
+    async def main():
+        admission = controller(max_writes=1)
+        assert await admission.acquire("aa", 100) == 100
+        assert await admission.acquire("bb", 100) is None
+        assert admission.rejected == 1 and admission.waiting == 0
+        await admission.release("aa", 100)
+        assert await admission.acquire("bb", 100) == 100
+        assert admission.stats()["writes"] == 1
+
+    asyncio.run(main())
+
+
+def test_waiting_write_is_woken_by_release():
+    async def main():
+        admission = controller(wait=5, max_file_writes=1)
+        await admission.acquire("aa", 100)
+        # another upload is not held back by the per upload limit
+        assert await admission.acquire("bb", 100) == 100
+        waiting = asyncio.create_task(admission.acquire("aa", 100))
+        await asyncio.sleep(0.01)
+        assert admission.waiting == 1
+        await admission.release("aa", 100)
+        assert await asyncio.wait_for(waiting, 1) == 100
+        assert admission.rejected == 0
+
+    asyncio.run(main())
+
+
+def test_bytes_are_charged_up_to_the_limit():
+    async def main():
+        admission = controller(max_bytes=1000)
+        # larger than the limit, still admitted alone
+        assert await admission.acquire("aa", 5000) == 1000
+        assert await admission.acquire("bb", 1) is None
+        await admission.release("aa", 1000)
+        stats = admission.stats()
+        assert (stats["writes"], stats["bytes"], stats["uploads"]) == (0, 0, 0)
+
+    asyncio.run(main())
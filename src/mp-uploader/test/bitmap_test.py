@@ -0,0 +1,79 @@
+import struct
+
+import pytest
+from mp_server.chunk_map import (
+    LEGACY_MAP_HEADER_FORMAT,
+    LEGACY_MAP_MAGIC_NUMBER,
+    read_chunk_map,
+)
+from mp_server.chunk_map_manager import BinaryChunkMapManager
+
+CHUNK = 1024
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = BinaryChunkMapManager("f", tmp_path)
+    # 21 chunks, the last one short, so the last bitmap byte is padded
+    manager.initialize_map(20 * CHUNK + 10, CHUNK)
+    return manager
+
+
+def test_runs_of_incomplete_chunks(manager):
+    assert list(manager.iter_incomplete_runs()) == [(0, 21)]
+    manager.mark_chunks([0, CHUNK, 2 * CHUNK, 9 * CHUNK, 16 * CHUNK])
+    manager.mark_chunk(17 * CHUNK)
+    manager.mark_chunk(2 * CHUNK, complete=False)
+    assert list(manager.iter_incomplete_runs()) == [(2, 9), (10, 16), (18, 21)]
+    assert manager.get_incomplete_ranges(20 * CHUNK + 10) == [
+        [2 * CHUNK, 9 * CHUNK],
+        [10 * CHUNK, 16 * CHUNK],
+        [18 * CHUNK, 20 * CHUNK + 10],
+    ]
+    assert manager.get_incomplete_chunks()[:3] == [2 * CHUNK, 3 * CHUNK, 4 * CHUNK]
+    assert manager.get_chunk_status(CHUNK) and not manager.get_chunk_status(2 * CHUNK)
+
+
+def test_complete_ignores_padding_bits(manager, tmp_path):
+    manager.mark_chunks([i * CHUNK for i in range(20)])
+    assert not manager.is_complete()
+    assert not read_chunk_map(manager.map_file)["complete"]
+    manager.mark_chunk(20 * CHUNK)
+    assert manager.is_complete()
+    assert read_chunk_map(manager.map_file) == {
+        "total_chunks": 21,
+        "chunk_size": CHUNK,
+        "hash_mode": "file",
+        "hash_type": "sha256",
+        "complete": True,
+    }
+    # every manager of the file shares the mapping
+    assert BinaryChunkMapManager("f", tmp_path).is_complete()
+
+
+def test_replaced_map_is_mapped_again(manager, tmp_path):
+    manager.mark_all()
+    other = BinaryChunkMapManager("f", tmp_path)
+    other.initialize_map(4 * CHUNK, 2 * CHUNK, reinit=True, hash_type="blake2b")
+    fresh = BinaryChunkMapManager("f", tmp_path)
+    assert (fresh.total_chunks, fresh.chunk_size, fresh.hash_type) == (
+        2,
+        2 * CHUNK,
+        "blake2b",
+    )
+    assert not fresh.is_complete()
+
+
+def test_legacy_map_header(tmp_path):
+    header = struct.pack(LEGACY_MAP_HEADER_FORMAT, LEGACY_MAP_MAGIC_NUMBER, 3, CHUNK)
+    (tmp_path / "f.bmap").write_bytes(header + b"\x05")
+    manager = BinaryChunkMapManager("f", tmp_path)
+    assert (manager.total_chunks, manager.hash_mode) == (3, "file")
+    assert manager.get_incomplete_chunks() == [CHUNK]
+    assert read_chunk_map(tmp_path / "f.bmap")["total_chunks"] == 3
+
+
+def test_missing_map_is_not_initialized(tmp_path):
+    manager = BinaryChunkMapManager("f", tmp_path)
+    assert manager.chunk_size is None and not manager.is_complete()
+    assert read_chunk_map(manager.map_file) is None
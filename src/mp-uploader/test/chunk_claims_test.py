@@ -0,0 +1,70 @@
+import asyncio
+import hashlib
+import os
+
+import httpx
+import server
+from mp_server.single_flight import ChunkClaims
+
+CHUNK = 64 * 1024
+
+
+def test_a_claimed_chunk_is_turned_away_until_released():
+    claims = ChunkClaims()
+    with claims.claim("aa", 0) as claimed:
+        assert claimed
+        with claims.claim("aa", 0) as again:
+            assert not again
+        with claims.claim("aa", CHUNK) as other, claims.claim("bb", 0) as upload:
+            assert other and upload
+    with claims.claim("aa", 0) as claimed:
+        assert claimed
+
+
+def test_duplicate_chunk_never_overwrites_a_verified_one(api):
+    data = os.urandom(2 * CHUNK)
+    file_hash = hashlib.sha256(data).hexdigest()
+    api(
+        "POST",
+        "/upload/init",
+        params={"file_size": len(data), "file_hash": file_hash, "chunk_size": CHUNK},
+    )
+    chunk = data[:CHUNK]
+    params = {
+        "file_hash": file_hash,
+        "chunk_hash": hashlib.sha256(chunk).hexdigest(),
+        "offset": 0,
+    }
+
+    async def main():
+        sending = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_body():
+            yield chunk[:100]
+            sending.set()
+            await release.wait()
+            yield chunk[100:]
+
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as c:
+            first = asyncio.create_task(
+                c.post("/upload/chunk/raw", params=params, content=slow_body())
+            )
+            await sending.wait()
+            # same offset while the first one is still being written
+            garbage = os.urandom(CHUNK)
+            second = await c.post(
+                "/upload/chunk/raw",
+                params={**params, "chunk_hash": hashlib.sha256(garbage).hexdigest()},
+                content=garbage,
+            )
+            assert second.json()["message"] == "Chunk upload in progress"
+            release.set()
+            assert (await first).json()["message"] == "Chunk upload finished"
+            retry = await c.post("/upload/chunk/raw", params=params, content=garbage)
+            assert retry.json()["message"] == "Chunk already uploaded"
+
+    asyncio.run(main())
+    with open(server.upload_dir(file_hash) / file_hash, "rb") as f:
+        assert f.read(CHUNK) == chunk
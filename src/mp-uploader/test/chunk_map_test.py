@@ -0,0 +1,77 @@
+import asyncio
+import hashlib
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import httpx
+import server
+from mp_client import ParallelDownloader
+from mp_server.chunk_map import ChunkMap
+from mp_server.chunk_map_manager import BinaryChunkMapManager
+from mp_server.manifest import merkle_root
+
+CHUNK = 64 * 1024
+
+
+def test_client_map_is_the_server_format(tmp_path):
+    chunk_map = ChunkMap("f", tmp_path)
+    assert chunk_map.chunk_size is None and not chunk_map.is_complete()
+    chunk_map.initialize_map(10 * CHUNK - 1, CHUNK, "tree", "blake2b")
+    for offset in (0, 3 * CHUNK, 9 * CHUNK):
+        chunk_map.mark_chunk(offset)
+    chunk_map.mark_chunk(3 * CHUNK, complete=False)
+    assert chunk_map.get_incomplete_chunks() == [i * CHUNK for i in range(1, 9)]
+    manager = BinaryChunkMapManager("f", tmp_path)
+    assert (manager.chunk_size, manager.hash_mode, manager.hash_type) == (
+        CHUNK,
+        "tree",
+        "blake2b",
+    )
+    assert manager.get_incomplete_chunks() == chunk_map.get_incomplete_chunks()
+    chunk_map.mark_all()
+    assert ChunkMap("f", tmp_path).is_complete()
+
+
+def test_client_does_not_load_the_server():
+    loaded = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, mp_client; print(' '.join(sys.modules))",
+        ],
+        cwd=Path(__file__).parent.parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    assert "pydantic_settings" not in loaded
+    assert "mp_server.config" not in loaded
+
+
+def test_download_in_tree_mode(api, tmp_path):
+    data = os.urandom(3 * CHUNK + 7)
+    offsets = range(0, len(data), CHUNK)
+    digests = [
+        hashlib.sha256(data[offset : offset + CHUNK]).digest() for offset in offsets
+    ]
+    root = merkle_root(digests, len(data), CHUNK)
+    params = {"file_size": len(data), "file_hash": root, "chunk_size": CHUNK}
+    api("POST", "/upload/init", params={**params, "hash_mode": "tree"})
+    for offset, digest in zip(offsets, digests):
+        api(
+            "POST",
+            "/upload/chunk/raw",
+            params={"file_hash": root, "chunk_hash": digest.hex(), "offset": offset},
+            content=data[offset : offset + CHUNK],
+        )
+
+    async def download():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as c:
+            return await ParallelDownloader(client=c).download(root, tmp_path / "out")
+
+    assert asyncio.run(download())["bytes"] == len(data)
+    assert (tmp_path / "out").read_bytes() == data
+    assert os.listdir(tmp_path) == ["out"]
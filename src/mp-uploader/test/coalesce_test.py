@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+from mp_server.single_flight import SingleFlight
+
+
+class Counter:
+    """An async computation counting its runs, held until `release` is set"""
+
+    def __init__(self):
+        self.runs = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.runs += 1
+        await self.release.wait()
+        return self.runs
+
+
+def test_concurrent_calls_share_one_run():
+    async def main():
+        flight, counter = SingleFlight(ttl=60, max_entries=10), Counter()
+        calls = [
+            asyncio.create_task(flight.run("aa", "key", counter)) for _ in range(5)
+        ]
+        await asyncio.sleep(0)
+        counter.release.set()
+        assert await asyncio.gather(*calls) == [1] * 5
+        # cached afterwards
+        assert await flight.run("aa", "key", counter) == 1
+        assert counter.runs == 1
+
+    asyncio.run(main())
+
+
+def test_invalidate_drops_cached_results():
+    async def main():
+        flight, counter = SingleFlight(ttl=60, max_entries=10), Counter()
+        counter.release.set()
+        assert await flight.run("aa", "key", counter) == 1
+        flight.invalidate("bb")
+        assert await flight.run("aa", "key", counter) == 1
+        flight.invalidate("aa")
+        assert await flight.run("aa", "key", counter) == 2
+        assert flight.keys["aa"] == {("aa", "key")}
+
+    asyncio.run(main())
+
+
+def test_invalidate_detaches_running_computation():
+    async def main():
+        flight, counter = SingleFlight(ttl=60, max_entries=10), Counter()
+        stale = asyncio.create_task(flight.run("aa", "key", counter))
+        await asyncio.sleep(0)
+        flight.invalidate("aa")
+        fresh = asyncio.create_task(flight.run("aa", "key", counter))
+        await asyncio.sleep(0)
+        counter.release.set()
+        assert await stale == 2 and await fresh == 2
+        assert counter.runs == 2
+        # the stale run landing late is not cached over the fresh one
+        assert flight.cache[("aa", "key")][1] == 2
+
+    asyncio.run(main())
+
+
+def test_exceptions_are_not_cached():
+    async def main():
+        flight, runs = SingleFlight(ttl=60, max_entries=10), []
+
+        async def fail():
+            runs.append(1)
+            raise ValueError("failed")
+
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await flight.run("aa", "key", fail)
+        assert len(runs) == 2
+        assert "aa" not in flight.keys
+
+    asyncio.run(main())
+
+
+def test_cache_is_bounded():
+    async def main():
+        flight = SingleFlight(ttl=60, max_entries=2)
+
+        async def compute():
+            return 1
+
+        for key in range(5):
+            await flight.run("aa", key, compute)
+        assert list(flight.cache) == [("aa", 3), ("aa", 4)]
+        assert flight.keys["aa"] == {("aa", 3), ("aa", 4)}
+
+    asyncio.run(main())
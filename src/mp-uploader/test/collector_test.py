@@ -0,0 +1,71 @@
+import time
+
+import pytest
+from mp_server.chunk_map_manager import setup_file_and_chunk_map
+from mp_server.collector import GarbageCollector
+from mp_server.config import settings
+from mp_server.layout import fanout_dir
+from mp_server.metrics import upload_session
+from mp_server.upload_index import UPLOAD_COMPLETED, UploadIndex
+
+CHUNK = 4096
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "upload_ttl", 3600)
+    monkeypatch.setattr(settings, "gc_min_idle", 60)
+    monkeypatch.setattr(settings, "upload_quota", 0)
+    monkeypatch.setattr(settings, "free_space_reserve", 0)
+    index = UploadIndex(tmp_path / "upload_index.db")
+    collector = GarbageCollector(tmp_path, index)
+
+    def add(name, idle, state=None, size=4 * CHUNK):
+        file_hash = name * 32
+        dir = fanout_dir(tmp_path, file_hash)
+        dir.mkdir(parents=True, exist_ok=True)
+        setup_file_and_chunk_map(file_hash, dir, size, CHUNK)
+        index.put(file_hash, size, CHUNK, "sha256")
+        if state is not None:
+            index.set_state(file_hash, state)
+        index.touch([file_hash], time.time() - idle)
+        return file_hash
+
+    return index, collector, add
+
+
+def test_expired_uploads_are_evicted(uploads):
+    index, collector, add = uploads
+    expired = add("aa", 7200)
+    fresh = add("bb", 10)
+    completed = add("cc", 7200, UPLOAD_COMPLETED)
+    running = add("dd", 7200)
+    with upload_session(running):
+        assert collector.collect() == [expired]
+    assert index.get(expired) is None
+    assert not any(fanout_dir(collector.root, expired).iterdir())
+    for file_hash in (fresh, completed, running):
+        assert index.get(file_hash) is not None
+
+
+def test_quota_evicts_the_least_recently_active_first(uploads, monkeypatch):
+    index, collector, add = uploads
+    older = add("aa", 600)
+    newer = add("bb", 300)
+    recent = add("cc", 10)
+    add("dd", 900, UPLOAD_COMPLETED)
+    monkeypatch.setattr(settings, "upload_quota", 17 * CHUNK)
+    assert collector.make_room(2 * CHUNK)
+    assert index.get(older) is None
+    assert index.get(newer) is not None and index.get(recent) is not None
+    assert collector.usage()["committed_bytes"] == 12 * CHUNK
+
+
+def test_nothing_is_evicted_when_it_would_not_be_enough(uploads, monkeypatch):
+    index, collector, add = uploads
+    idle = add("aa", 600)
+    add("bb", 10)
+    monkeypatch.setattr(settings, "upload_quota", 9 * CHUNK)
+    # only the idle upload could go, which leaves no room for 6 chunks
+    assert not collector.make_room(6 * CHUNK)
+    assert index.get(idle) is not None
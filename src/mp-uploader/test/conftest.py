@@ -0,0 +1,40 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# the tests import mp_server from the source tree, wherever pytest runs from
+sys.path.insert(0, str(Path(__file__).parent.parent))
+# settings are read on import, so the server gets a scratch upload directory
+# before anything imports it
+UPLOAD_DIR = tempfile.mkdtemp(prefix="mp-upload-test-")
+os.environ["MP_UPLOAD_DIR"] = UPLOAD_DIR
+# and small chunks keep test files small
+os.environ["MP_MIN_CHUNK_SIZE"] = "4096"
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(UPLOAD_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def api():
+    """Call the server app in process: api(method, url, **httpx_kwargs)"""
+    import httpx
+    import server
+
+    def call(method, url, **kwargs):
+        async def send():
+            transport = httpx.ASGITransport(app=server.app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                return await client.request(method, url, **kwargs)
+
+        return asyncio.run(send())
+
+    return call
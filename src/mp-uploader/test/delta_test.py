@@ -0,0 +1,95 @@
+import asyncio
+import os
+import random
+
+import pytest
+from mp_server.delta import (
+    DELTA_COPY,
+    DELTA_DATA,
+    DELTA_OP,
+    apply_delta,
+    compute_delta,
+    encode_delta,
+    file_signature,
+)
+from mp_server.framing import FramingError
+
+BLOCK_SIZE = 64
+
+
+async def pieces(body, size):
+    for position in range(0, len(body), size):
+        yield body[position : position + size]
+
+
+def rebuild(base_file, body, filename, file_size, size=13):
+    return asyncio.run(
+        apply_delta(pieces(body, size), base_file, filename, BLOCK_SIZE, file_size)
+    )
+
+
+@pytest.fixture
+def base(tmp_path):
+    data = random.Random(0).randbytes(BLOCK_SIZE * 40 + 17)
+    base_file = tmp_path / "base"
+    base_file.write_bytes(data)
+    return base_file, data
+
+
+@pytest.mark.parametrize(
+    "edit",
+    [
+        lambda data: data,
+        lambda data: data[:100] + b"inserted" + data[100:],
+        lambda data: data[: BLOCK_SIZE * 3] + data[BLOCK_SIZE * 7 :],
+        lambda data: data[BLOCK_SIZE * 10 :] + data[: BLOCK_SIZE * 10],
+        lambda data: data + b"appended",
+        lambda data: data[:-5],
+        lambda data: b"",
+        lambda data: os.urandom(1000),
+    ],
+)
+def test_delta_round_trip(tmp_path, base, edit):
+    base_file, data = base
+    new = edit(data)
+    signature = file_signature(base_file, BLOCK_SIZE)
+    body = b"".join(encode_delta(compute_delta(new, signature, BLOCK_SIZE)))
+    filename = tmp_path / "new"
+    assert rebuild(base_file, body, filename, len(new)) == len(new)
+    assert filename.read_bytes() == new
+
+
+def test_unchanged_file_is_copied(base):
+    base_file, data = base
+    signature = file_signature(base_file, BLOCK_SIZE)
+    ops = compute_delta(data, signature, BLOCK_SIZE)
+    assert {op[0] for op in ops} == {"copy"}
+
+
+def test_delta_larger_than_file(tmp_path, base):
+    base_file, _ = base
+    filename = tmp_path / "new"
+    body = DELTA_OP.pack(DELTA_DATA, 0, 1 << 30) + b"x" * 1000
+    with pytest.raises(FramingError):
+        rebuild(base_file, body, filename, 100)
+    # refused before anything was written
+    assert filename.stat().st_size == 0
+    body = DELTA_OP.pack(DELTA_COPY, 0, 2)
+    with pytest.raises(FramingError):
+        rebuild(base_file, body, filename, BLOCK_SIZE)
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        DELTA_OP.pack(DELTA_COPY, 1000, 1),
+        DELTA_OP.pack(DELTA_COPY, 0, 0),
+        DELTA_OP.pack(9, 0, 1),
+        DELTA_OP.pack(DELTA_DATA, 0, 10) + b"short",
+        DELTA_OP.pack(DELTA_COPY, 0, 1)[:-1],
+    ],
+)
+def test_bad_delta(tmp_path, base, body):
+    base_file, _ = base
+    with pytest.raises(FramingError):
+        rebuild(base_file, body, tmp_path / "new", 1 << 20)
@@ -0,0 +1,55 @@
+import os
+import threading
+
+from mp_server.digest_record import (
+    VerifiedDigestRecord,
+    digest_record_type,
+    verified_file_hash,
+)
+from mp_server.utils import calculate_hash
+
+
+def stored(tmp_path, data=b"data"):
+    (tmp_path / "f").write_bytes(data)
+    return VerifiedDigestRecord("f", tmp_path)
+
+
+def test_record_is_dropped_once_the_file_changes(tmp_path):
+    record = stored(tmp_path)
+    record.store("abc")
+    assert record.load() == "abc"
+    assert record.load(digest_record_type(hash_mode="tree")) is None
+    with open(tmp_path / "f", "ab") as f:
+        f.write(b"more")
+    assert record.load() is None
+
+
+def test_concurrent_stores_do_not_share_a_temp_file(tmp_path):
+    record = stored(tmp_path)
+    errors = []
+
+    def store():
+        try:
+            for _ in range(200):
+                record.store("abc")
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=store) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert record.load() == "abc"
+    assert sorted(os.listdir(tmp_path)) == ["f", "f.digest"]
+
+
+def test_verified_file_hash_hashes_once(tmp_path, monkeypatch):
+    stored(tmp_path, b"x" * 1000)
+    digest = verified_file_hash("f", tmp_path)
+    assert digest == calculate_hash(tmp_path / "f")
+    monkeypatch.setattr(
+        "mp_server.digest_record.calculate_hash", lambda *args, **kwargs: 1 / 0
+    )
+    assert verified_file_hash("f", tmp_path) == digest
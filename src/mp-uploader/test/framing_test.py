@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from mp_server.framing import (
+    FRAME_HEADER,
+    FrameReader,
+    FramingError,
+    encode_frame,
+    encode_frame_header,
+)
+
+
+async def pieces(body, size):
+    for position in range(0, len(body), size):
+        yield body[position : position + size]
+
+
+def read_frames(body, size=7):
+    """(offset, chunk_hash, payload) of every frame, the body sent in
+    pieces of `size` bytes"""
+
+    async def read():
+        reader = FrameReader(pieces(body, size))
+        frames = []
+        while (frame := await reader.next_frame()) is not None:
+            offset, chunk_hash, length = frame
+            payload = b"".join([data async for data in reader.iter_payload(length)])
+            frames.append((offset, chunk_hash, payload))
+        return frames
+
+    return asyncio.run(read())
+
+
+@pytest.mark.parametrize("size", [1, 7, 1 << 20])
+def test_frames_round_trip(size):
+    body = (
+        encode_frame(0, "aa" * 32, b"first chunk")
+        + encode_frame(1 << 40, "bb" * 32, b"")
+        + encode_frame(64, "cc", b"x" * 1000)
+    )
+    assert read_frames(body, size) == [
+        (0, "aa" * 32, b"first chunk"),
+        (1 << 40, "bb" * 32, b""),
+        (64, "cc", b"x" * 1000),
+    ]
+
+
+def test_empty_body():
+    assert read_frames(b"") == []
+
+
+def test_truncated_header():
+    body = encode_frame(0, "aa" * 32, b"data")[: FRAME_HEADER.size - 1]
+    with pytest.raises(FramingError, match="frame header"):
+        read_frames(body)
+
+
+def test_truncated_hash():
+    body = encode_frame_header(0, "aa" * 32, 4)[:-1]
+    with pytest.raises(FramingError, match="frame header"):
+        read_frames(body)
+
+
+def test_truncated_payload():
+    body = encode_frame(0, "aa" * 32, b"data")[:-1]
+    with pytest.raises(FramingError, match="frame payload"):
+        read_frames(body)
+
+
+def test_hash_not_ascii():
+    body = FRAME_HEADER.pack(0, 4, 2) + b"\xff\xfe" + b"data"
+    with pytest.raises(FramingError, match="not ascii"):
+        read_frames(body)
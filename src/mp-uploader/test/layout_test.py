@@ -0,0 +1,71 @@
+import json
+
+from mp_server.chunk_map_manager import setup_file_and_chunk_map
+from mp_server.config import settings
+from mp_server.digest_record import VerifiedDigestRecord
+from mp_server.layout import (
+    LAYOUT_FILE,
+    current_layout,
+    fanout_dir,
+    migrate_layout,
+    prepare_upload_dir,
+)
+from mp_server.upload_index import UPLOAD_INCOMPLETE, UploadIndex
+
+NAME = "abcdef" + "0" * 58
+
+
+def test_fanout_dir(tmp_path):
+    assert fanout_dir(tmp_path, NAME, 2, 2) == tmp_path / "ab" / "cd"
+    assert fanout_dir(tmp_path, NAME, 1, 3) == tmp_path / "abc"
+    assert fanout_dir(tmp_path, NAME, 0, 2) == tmp_path
+
+
+def test_flat_upload_dir_is_migrated_and_indexed(tmp_path):
+    setup_file_and_chunk_map(NAME, tmp_path, 10000, 4096)
+    record = VerifiedDigestRecord(NAME, tmp_path)
+    record.store("abc")
+    (tmp_path / "chunk_index.db").write_bytes(b"")
+    index = UploadIndex(tmp_path / "upload_index.db")
+
+    prepare_upload_dir(tmp_path, index)
+    dir = fanout_dir(tmp_path, NAME)
+    assert sorted(path.name for path in dir.iterdir()) == [
+        NAME,
+        f"{NAME}.bmap",
+        f"{NAME}.digest",
+        f"{NAME}.manifest",
+    ]
+    # databases stay at the top
+    assert (tmp_path / "chunk_index.db").exists()
+    # moved by rename, so the digest record still matches its file
+    assert VerifiedDigestRecord(NAME, dir).load() == "abc"
+    assert index.get(NAME)["state"] == UPLOAD_INCOMPLETE
+    assert json.loads((tmp_path / LAYOUT_FILE).read_text()) == current_layout()
+    # a current layout is left alone
+    assert migrate_layout(tmp_path) == 0
+
+
+def test_layout_change_moves_uploads_again(tmp_path, monkeypatch):
+    setup_file_and_chunk_map(NAME, tmp_path, 10000, 4096)
+    index = UploadIndex(tmp_path / "upload_index.db")
+    prepare_upload_dir(tmp_path, index)
+    monkeypatch.setattr(settings, "fanout_levels", 1)
+    monkeypatch.setattr(settings, "fanout_width", 3)
+    prepare_upload_dir(tmp_path, index)
+    assert (tmp_path / "abc" / NAME).is_file()
+    assert not (tmp_path / "ab").exists()
+    assert index.get(NAME) is not None
+
+
+def test_index_of_an_older_schema_is_rebuilt(tmp_path):
+    setup_file_and_chunk_map(NAME, tmp_path, 10000, 4096)
+    index = UploadIndex(tmp_path / "upload_index.db")
+    prepare_upload_dir(tmp_path, index)
+    with index.connect() as connection:
+        connection.execute("DELETE FROM uploads")
+        connection.execute(f"PRAGMA user_version = {index.version - 1}")
+    assert not index.current()
+    prepare_upload_dir(tmp_path, index)
+    assert index.current()
+    assert index.get(NAME)["total_chunks"] == 3
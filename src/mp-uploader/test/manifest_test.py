@@ -0,0 +1,105 @@
+import hashlib
+import os
+
+from mp_server.manifest import ChunkHashManifest, merkle_root
+
+CHUNK = 64 * 1024
+
+
+def sha256(data):
+    return hashlib.sha256(data).digest()
+
+
+def tree_hash(leaves):
+    # RFC 6962 section 2.1, over slices
+    if len(leaves) == 1:
+        return sha256(b"\x00" + leaves[0])
+    split = 1
+    while split * 2 < len(leaves):
+        split *= 2
+    return sha256(b"\x01" + tree_hash(leaves[:split]) + tree_hash(leaves[split:]))
+
+
+def test_merkle_root_is_rfc6962_bound_to_the_sizes():
+    for count in range(1, 12):
+        digests = [sha256(bytes([i])) for i in range(count)]
+        size = count * CHUNK
+        expected = sha256(
+            b"\x02"
+            + size.to_bytes(8, "big")
+            + CHUNK.to_bytes(8, "big")
+            + tree_hash(digests)
+        ).hex()
+        assert merkle_root(digests, size, CHUNK) == expected
+
+
+def test_inner_node_cannot_pass_for_a_chunk():
+    chunks = [os.urandom(CHUNK), os.urandom(CHUNK)]
+    digests = [sha256(chunk) for chunk in chunks]
+    root = merkle_root(digests, 2 * CHUNK, CHUNK)
+    # a file made of the two chunk digests, once hashed like the pair of them
+    forged = digests[0] + digests[1]
+    assert merkle_root([sha256(forged)], len(forged), CHUNK) != root
+    assert merkle_root(digests, 2 * CHUNK - 1, CHUNK) != root
+    assert merkle_root(digests, 2 * CHUNK, 2 * CHUNK) != root
+
+
+def test_manifest_root_waits_for_every_digest(tmp_path):
+    manifest = ChunkHashManifest("f", tmp_path)
+    assert not manifest.exists()
+    manifest.initialize(3)
+    digests = [sha256(bytes([i])) for i in range(3)]
+    manifest.set_digests({0: digests[0].hex(), 2: digests[2].hex()})
+    assert manifest.get_digests() == {0: digests[0].hex(), 1: None, 2: digests[2].hex()}
+    assert manifest.merkle_root(3 * CHUNK, CHUNK) is None
+    manifest.set_digest(1, digests[1].hex())
+    assert manifest.merkle_root(3 * CHUNK, CHUNK) == merkle_root(
+        digests, 3 * CHUNK, CHUNK
+    )
+    manifest.clear_digest(1)
+    assert manifest.get_digests([1]) == {1: None}
+
+
+def test_forged_tree_upload_is_a_bad_file(api):
+    chunks = [os.urandom(CHUNK), os.urandom(CHUNK)]
+    digests = [sha256(chunk) for chunk in chunks]
+    root = merkle_root(digests, 2 * CHUNK, CHUNK)
+    forged = digests[0] + digests[1]
+    result = api(
+        "POST",
+        "/upload/init",
+        params={
+            "file_size": len(forged),
+            "file_hash": root,
+            "hash_mode": "tree",
+            "chunk_size": CHUNK,
+        },
+    ).json()
+    assert result["chunks"] == [0]
+    response = api(
+        "POST",
+        "/upload/chunk/raw",
+        params={"file_hash": root, "chunk_hash": sha256(forged).hex(), "offset": 0},
+        content=forged,
+    )
+    assert response.json()["status"] == "chunk_completed"
+    assert api("GET", f"/upload/status/{root}").json()["status"] == "bad_file"
+
+
+def test_tree_upload_completes(api):
+    data = os.urandom(2 * CHUNK + 10)
+    offsets = range(0, len(data), CHUNK)
+    digests = [sha256(data[offset : offset + CHUNK]) for offset in offsets]
+    root = merkle_root(digests, len(data), CHUNK)
+    params = {"file_size": len(data), "file_hash": root, "chunk_size": CHUNK}
+    api("POST", "/upload/init", params={**params, "hash_mode": "tree"})
+    for offset, digest in zip(offsets, digests):
+        api(
+            "POST",
+            "/upload/chunk/raw",
+            params={"file_hash": root, "chunk_hash": digest.hex(), "offset": offset},
+            content=data[offset : offset + CHUNK],
+        )
+    assert api("GET", f"/upload/status/{root}").json()["status"] == "completed"
+    info = api("GET", "/download/init", params={"file_hash": root}).json()
+    assert info["merkle_root"] == root
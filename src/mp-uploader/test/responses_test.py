@@ -0,0 +1,46 @@
+import pytest
+from mp_server.responses import RangeNotSatisfiable, parse_range_header
+
+
+@pytest.mark.parametrize(
+    "http_range, expected",
+    [
+        ("bytes=0-99", (0, 100)),
+        ("bytes=100-", (100, 1000)),
+        ("bytes=-100", (900, 1000)),
+        ("bytes=999-999", (999, 1000)),
+        # past the end is clamped, as is a suffix longer than the file
+        ("bytes=900-5000", (900, 1000)),
+        ("bytes=-5000", (0, 1000)),
+        (" BYTES = 1 - 2 ", (1, 3)),
+    ],
+)
+def test_parse_range(http_range, expected):
+    assert parse_range_header(http_range, 1000) == expected
+
+
+@pytest.mark.parametrize(
+    "http_range",
+    [
+        "items=0-99",
+        "bytes=0-1,5-6",
+        "bytes=5-2",
+        "bytes=a-b",
+        "bytes=-",
+        "bytes=5",
+        "bytes=+1-2",
+    ],
+)
+def test_ignored_range(http_range):
+    assert parse_range_header(http_range, 1000) is None
+
+
+@pytest.mark.parametrize("http_range", ["bytes=1000-", "bytes=2000-3000", "bytes=-0"])
+def test_range_not_satisfiable(http_range):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(http_range, 1000)
+
+
+def test_range_of_empty_file():
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header("bytes=0-", 0)
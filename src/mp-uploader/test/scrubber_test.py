@@ -0,0 +1,87 @@
+import asyncio
+import hashlib
+import os
+import time
+
+import server
+from mp_server.scrubber import Throttle
+from mp_server.upload_index import UPLOAD_COMPLETED, UPLOAD_INCOMPLETE
+
+CHUNK = 64 * 1024
+
+
+def stored(api, data):
+    file_hash = hashlib.sha256(data).hexdigest()
+    api(
+        "POST",
+        "/upload/init",
+        params={"file_size": len(data), "file_hash": file_hash, "chunk_size": CHUNK},
+    )
+    for offset in range(0, len(data), CHUNK):
+        send(api, file_hash, data, offset)
+    assert server.upload_index().get(file_hash)["state"] == UPLOAD_COMPLETED
+    return file_hash
+
+
+def send(api, file_hash, data, offset):
+    chunk = data[offset : offset + CHUNK]
+    return api(
+        "POST",
+        "/upload/chunk/raw",
+        params={
+            "file_hash": file_hash,
+            "chunk_hash": hashlib.sha256(chunk).hexdigest(),
+            "offset": offset,
+        },
+        content=chunk,
+    )
+
+
+def incomplete_chunks(api, file_hash):
+    return api("GET", f"/upload/status/{file_hash}").json()["chunks"]
+
+
+def test_scrub_resets_a_rotten_chunk(api):
+    data = os.urandom(3 * CHUNK)
+    file_hash = stored(api, data)
+    fd = os.open(server.upload_dir(file_hash) / file_hash, os.O_WRONLY)
+    try:
+        os.pwrite(fd, b"\0", CHUNK + 5)
+    finally:
+        os.close(fd)
+
+    report = asyncio.run(server.upload_scrubber().run())
+    assert report["status"] == "finished"
+    assert report["bad_uploads"][file_hash] == [CHUNK]
+    assert server.upload_index().get(file_hash)["state"] == UPLOAD_INCOMPLETE
+    assert incomplete_chunks(api, file_hash) == [CHUNK]
+    # uploading it again completes the upload
+    send(api, file_hash, data, CHUNK)
+    assert api("GET", f"/upload/status/{file_hash}").json()["status"] == "completed"
+
+
+def test_verify_chunks_resets_like_a_scrub(api):
+    data = os.urandom(2 * CHUNK)
+    file_hash = stored(api, data)
+    good = hashlib.sha256(data[:CHUNK]).hexdigest()
+    result = api(
+        "POST",
+        "/upload/verify-chunks",
+        params={"file_hash": file_hash},
+        json={"0": good, str(CHUNK): "00" * 32},
+    ).json()
+    assert result["incomplete_chunks"] == [CHUNK]
+    assert server.upload_index().get(file_hash)["state"] == UPLOAD_INCOMPLETE
+    manifest = server.ChunkHashManifest(file_hash, server.upload_dir(file_hash))
+    assert manifest.get_digests() == {0: good, 1: None}
+
+
+def test_throttle_paces_reads():
+    async def main():
+        throttle = Throttle(1000)
+        start = time.monotonic()
+        await throttle.acquire(100)
+        await throttle.acquire(100)
+        return time.monotonic() - start
+
+    assert asyncio.run(main()) >= 0.19
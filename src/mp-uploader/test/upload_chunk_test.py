@@ -0,0 +1,66 @@
+import hashlib
+import os
+
+import server
+
+CHUNK = 64 * 1024
+
+
+def start(api, data):
+    file_hash = hashlib.sha256(data).hexdigest()
+    api(
+        "POST",
+        "/upload/init",
+        params={"file_size": len(data), "file_hash": file_hash, "chunk_size": CHUNK},
+    )
+    return file_hash
+
+
+def send(api, file_hash, offset, chunk):
+    return api(
+        "POST",
+        "/upload/chunk",
+        params={
+            "file_hash": file_hash,
+            "chunk_hash": hashlib.sha256(chunk).hexdigest(),
+            "offset": offset,
+        },
+        files={"chunk": ("chunk", chunk)},
+    )
+
+
+def test_multipart_upload_completes(api):
+    data = os.urandom(CHUNK + 1000)
+    file_hash = start(api, data)
+    for offset in (0, CHUNK):
+        response = send(api, file_hash, offset, data[offset : offset + CHUNK])
+        assert response.json()["status"] == "chunk_completed"
+    status = api("GET", f"/upload/status/{file_hash}").json()
+    assert status["status"] == "completed"
+    assert send(api, file_hash, 0, data[:CHUNK]).json()["message"] == (
+        "Upload already finished"
+    )
+
+
+def test_multipart_rejects_offsets_outside_the_file(api):
+    data = os.urandom(2 * CHUNK)
+    file_hash = start(api, data)
+    path = server.upload_dir(file_hash) / file_hash
+    for offset in (-CHUNK, 100, 2 * CHUNK, 10 * CHUNK):
+        response = send(api, file_hash, offset, data[:CHUNK])
+        assert response.status_code == 400
+    # nothing was written past the end
+    assert path.stat().st_size == len(data)
+
+
+def test_multipart_rejects_a_short_chunk(api):
+    data = os.urandom(2 * CHUNK)
+    file_hash = start(api, data)
+    assert send(api, file_hash, 0, data[:100]).status_code == 400
+    status = api("GET", f"/upload/status/{file_hash}").json()
+    assert status["chunks"] == [0, CHUNK]
+
+
+def test_multipart_needs_an_initialized_upload(api):
+    response = send(api, "00" * 32, 0, b"data")
+    assert response.json()["message"] == "Upload not initialized"
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import os
+
+import server
+from mp_server.layout import index_uploads
+from mp_server.upload_index import (
+    UPLOAD_COMPLETED,
+    UPLOAD_INCOMPLETE,
+    UPLOAD_UNVERIFIED,
+    UploadIndex,
+)
+
+CHUNK = 64 * 1024
+
+
+def start(api, data, **params):
+    file_hash = hashlib.sha256(data).hexdigest()
+    response = api(
+        "POST",
+        "/upload/init",
+        params={
+            "file_size": len(data),
+            "file_hash": file_hash,
+            "chunk_size": CHUNK,
+            **params,
+        },
+    )
+    return file_hash, response.json()
+
+
+def send(api, file_hash, data, offset):
+    chunk = data[offset : offset + CHUNK]
+    return api(
+        "POST",
+        "/upload/chunk/raw",
+        params={
+            "file_hash": file_hash,
+            "chunk_hash": hashlib.sha256(chunk).hexdigest(),
+            "offset": offset,
+        },
+        content=chunk,
+    )
+
+
+def state(file_hash):
+    return server.upload_index().get(file_hash)["state"]
+
+
+def test_zero_byte_upload_completes_at_init(api):
+    file_hash, result = start(api, b"")
+    assert result["status"] == "completed"
+    assert state(file_hash) == UPLOAD_COMPLETED
+    assert api("GET", "/download/init", params={"file_hash": file_hash}).is_success
+
+
+def test_failed_finalization_is_settled_later(api, monkeypatch):
+    data = os.urandom(2 * CHUNK)
+    file_hash, _ = start(api, data)
+    assert send(api, file_hash, data, 0).json()["status"] == "chunk_completed"
+
+    def crash(*args):
+        raise OSError("disk gone")
+
+    monkeypatch.setattr(server, "verify_upload", crash)
+    assert send(api, file_hash, data, CHUNK).status_code == 500
+    # every bit is set, but the row is not left incomplete
+    assert state(file_hash) == UPLOAD_UNVERIFIED
+    monkeypatch.undo()
+    assert api("GET", "/download/init", params={"file_hash": file_hash}).is_success
+    assert state(file_hash) == UPLOAD_COMPLETED
+
+
+def test_full_bitmap_with_incomplete_row_is_settled_at_init(api):
+    data = os.urandom(CHUNK + 100)
+    file_hash, _ = start(api, data)
+    for offset in (0, CHUNK):
+        send(api, file_hash, data, offset)
+    # as a worker crashing mid-hash before unverified rows left it
+    server.upload_index().set_state(file_hash, UPLOAD_INCOMPLETE)
+    server.invalidate_upload(file_hash)
+    _, result = start(api, data)
+    assert result["status"] == "completed"
+    assert state(file_hash) == UPLOAD_COMPLETED
+
+
+def test_index_uploads_reads_states_from_map_headers(api, tmp_path):
+    data = os.urandom(2 * CHUNK)
+    done, _ = start(api, data)
+    for offset in (0, CHUNK):
+        send(api, done, data, offset)
+    partial, _ = start(api, os.urandom(2 * CHUNK))
+    index = UploadIndex(tmp_path / "upload_index.db")
+    assert index_uploads(server.__UPLOAD_DIR__, index) >= 2
+    assert index.get(done)["state"] == UPLOAD_COMPLETED
+    assert index.get(partial)["state"] == UPLOAD_INCOMPLETE
+    # without its digest record a complete upload must be hashed first
+    server.VerifiedDigestRecord(done, server.upload_dir(done)).invalidate()
+    index.reset()
+    index_uploads(server.__UPLOAD_DIR__, index)
+    assert index.get(done)["state"] == UPLOAD_UNVERIFIED
+
+
+def test_status_polls_do_not_rehash(api, monkeypatch):
+    data = os.urandom(2 * CHUNK)
+    file_hash, _ = start(api, data)
+    for offset in (0, CHUNK):
+        send(api, file_hash, data, offset)
+    calls = []
+    verify_upload = server.verify_upload
+
+    def counted(*args):
+        calls.append(args)
+        return verify_upload(*args)
+
+    monkeypatch.setattr(server, "verify_upload", counted)
+
+    async def poll():
+        import httpx
+
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as c:
+            responses = await asyncio.gather(
+                *(c.get(f"/upload/status/{file_hash}") for _ in range(8))
+            )
+        return {response.json()["status"] for response in responses}
+
+    assert asyncio.run(poll()) == {"completed"}
+    assert calls == []
+    # an unverified upload is hashed once for all concurrent polls
+    server.upload_index().set_state(file_hash, UPLOAD_UNVERIFIED)
+    server.invalidate_upload(file_hash)
+    assert asyncio.run(poll()) == {"completed"}
+    assert len(calls) == 1